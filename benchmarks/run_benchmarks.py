@@ -0,0 +1,349 @@
+"""Benchmarks for conductor's hot paths.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--output results.json]
+                                        [--compare baseline.json]
+                                        [--only NAME ...] [--repeat N]
+
+Every benchmark is run --repeat times and the min, median and mean of the
+per-operation time are stored, along with a description of the machine, as
+JSON. With --compare, each result is checked against the same benchmark in an
+earlier results file and the run exits non-zero if any median got slower by
+more than --threshold.
+"""
+import argparse
+import collections
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import conductor  # noqa: E402
+
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name, operations, unit="op"):
+    """Registers a benchmark.
+
+    The decorated function receives a scratch directory and returns a
+    zero-argument callable that performs `operations` operations per call.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, operations, unit)
+        return setup
+    return register
+
+
+# -- process spawning ------------------------------------------------------
+
+@benchmark("spawn.os_popen", operations=50)
+def bench_os_popen(scratch):
+    def run():
+        for _ in range(50):
+            process = os.popen("true")
+            process.read()
+            process.close()
+    return run
+
+
+@benchmark("spawn.subprocess_run", operations=50)
+def bench_subprocess_run(scratch):
+    def run():
+        for _ in range(50):
+            subprocess.run("true", shell=True, stdout=subprocess.PIPE)
+    return run
+
+
+@benchmark("spawn.start_blocking_process", operations=50)
+def bench_start_blocking_process(scratch):
+    ops = conductor.OperationWrapper()
+
+    def run():
+        for _ in range(50):
+            ops.start_blocking_process("true")
+    return run
+
+
+@benchmark("spawn.shell_session", operations=50)
+def bench_shell_session(scratch):
+    ops = conductor.OperationWrapper(persistent_shell=True)
+
+    def run():
+        for _ in range(50):
+            ops.start_blocking_process("true")
+    return run
+
+
+# -- command building ------------------------------------------------------
+
+@benchmark("command_string_builder.large", operations=1000)
+def bench_command_string_builder(scratch):
+    arguments = dict(("option{n}".format(n=n), n) for n in range(200))
+    flags = ["flag{n}".format(n=n) for n in range(50)]
+
+    def run():
+        for _ in range(1000):
+            conductor.command_string_builder(arguments, "blastn", append="/data/query.fa",
+                                             flags_list=flags)
+    return run
+
+
+@benchmark("command_template.render_many_large", operations=1000)
+def bench_command_template(scratch):
+    template = conductor.CommandTemplate("blastn", append="/data/query.fa",
+                                         flags_list=["flag{n}".format(n=n) for n in range(50)])
+    argument_sets = [dict(("option{n}".format(n=n), n + m) for n in range(200))
+                     for m in range(1000)]
+
+    def run():
+        template.render_many(argument_sets, argv=True)
+    return run
+
+
+# -- parsing ---------------------------------------------------------------
+
+@benchmark("list_files.verbose_10k", operations=10000, unit="entry")
+def bench_list_files(scratch):
+    directory = os.path.join(scratch, "listing")
+    os.mkdir(directory)
+    for n in range(10000):
+        open(os.path.join(directory, "file {n}.txt".format(n=n)), "w").close()
+    ops = conductor.OperationWrapper()
+
+    def run():
+        for _ in ops.list_files(verbose=True, directory=directory):
+            pass
+    return run
+
+
+@benchmark("list_user_groups.verbose_20k_users", operations=1000, unit="lookup")
+def bench_list_user_groups(scratch):
+    passwd = os.path.join(scratch, "passwd")
+    group = os.path.join(scratch, "group")
+    with open(passwd, "w") as passwd_file:
+        for n in range(20000):
+            passwd_file.write("user{n}:x:{uid}:{uid}::/home/user{n}:/bin/sh\n".format(
+                n=n, uid=10000 + n))
+    with open(group, "w") as group_file:
+        for n in range(20000):
+            group_file.write("user{n}:x:{gid}:\n".format(n=n, gid=10000 + n))
+        for n in range(200):
+            members = ",".join("user{m}".format(m=m) for m in range(n, 20000, 200))
+            group_file.write("team{n}:x:{gid}:{members}\n".format(n=n, gid=50000 + n,
+                                                                  members=members))
+    ops = conductor.OperationWrapper()
+    ops.account_index = conductor.AccountIndex(passwd, group)
+    ops.list_user_groups("user0")  # build the index outside the timed loop
+
+    def run():
+        for n in range(1000):
+            ops.list_user_groups("user{n}".format(n=n * 7), verbose=True)
+    return run
+
+
+# -- checksums -------------------------------------------------------------
+
+CHECKSUM_FILES = 64
+CHECKSUM_FILE_SIZE = 1024 * 1024
+
+
+def _make_checksum_files(scratch):
+    filenames = []
+    block = os.urandom(CHECKSUM_FILE_SIZE)
+    for n in range(CHECKSUM_FILES):
+        filename = os.path.join(scratch, "artifact{n}".format(n=n))
+        with open(filename, "wb") as artifact:
+            artifact.write(block)
+        filenames.append(filename)
+    return filenames
+
+
+@benchmark("checksum.sha1_64MiB", operations=CHECKSUM_FILES * CHECKSUM_FILE_SIZE, unit="byte")
+def bench_checksum(scratch):
+    filenames = _make_checksum_files(scratch)
+    ops = conductor.OperationWrapper()
+
+    def run():
+        ops.checksum_files(filenames, "sha1")
+    return run
+
+
+@benchmark("checksum.sha1_64MiB_cached", operations=CHECKSUM_FILES, unit="file")
+def bench_checksum_cached(scratch):
+    filenames = _make_checksum_files(scratch)
+    cache_filename = os.path.join(scratch, "cache.json")
+    ops = conductor.OperationWrapper()
+    ops.checksum_files(filenames, "sha1", cache_filename=cache_filename)
+
+    def run():
+        ops.checksum_files(filenames, "sha1", cache_filename=cache_filename)
+    return run
+
+
+# -- directory trees -------------------------------------------------------
+
+@benchmark("copy_directory.1k_files", operations=1000, unit="file")
+def bench_copy_directory(scratch):
+    source = os.path.join(scratch, "tree")
+    block = os.urandom(16 * 1024)
+    for n in range(1000):
+        directory = os.path.join(source, "d{n}".format(n=n % 20))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "f{n}".format(n=n)), "wb") as leaf:
+            leaf.write(block)
+    ops = conductor.OperationWrapper()
+    copies = iter(range(1000000))
+
+    def run():
+        ops.copy_directory(source, os.path.join(scratch, "copy{n}".format(n=next(copies))))
+    return run
+
+
+@benchmark("change_permissions.10k_unchanged", operations=10000, unit="entry")
+def bench_change_permissions(scratch):
+    root = os.path.join(scratch, "perms")
+    for n in range(10000):
+        directory = os.path.join(root, "d{n}".format(n=n % 100))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        open(os.path.join(directory, "f{n}".format(n=n)), "w").close()
+    ops = conductor.OperationWrapper()
+
+    def run():
+        ops.change_permissions("u+rw,go+r", root, enable_recursion=True)
+    return run
+
+
+@benchmark("remote_sync.10k_unchanged", operations=10000, unit="file")
+def bench_remote_sync(scratch):
+    source = os.path.join(scratch, "sync")
+    for n in range(10000):
+        directory = os.path.join(source, "d{n}".format(n=n % 100))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "f{n}".format(n=n)), "w") as leaf:
+            leaf.write("x" * 100)
+    destination = os.path.join(scratch, "mirror")
+    ops = conductor.OperationWrapper()
+
+    def run():
+        ops.remote_sync(source, destination, manifest_directory=os.path.join(scratch, "manifests"))
+    return run
+
+
+@benchmark("health_probe.100", operations=100, unit="probe")
+def bench_health_probe(scratch):
+    ops = conductor.OperationWrapper()
+
+    def run():
+        for _ in range(100):
+            ops.disk_free_space()
+            ops.system_uptime()
+            ops.network_addresses()
+            ops.operating_system_kernel_information()
+            ops.operating_system_information()
+    return run
+
+
+# -- runner ----------------------------------------------------------------
+
+def run_benchmark(name, repeat):
+    setup, operations, unit = BENCHMARKS[name]
+    scratch = tempfile.mkdtemp(prefix="conductor-bench-")
+    try:
+        run = setup(scratch)
+        run()  # warm up caches and lazily built indexes
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) / operations)
+    finally:
+        shutil.rmtree(scratch)
+
+    return {
+        "unit": unit,
+        "operations": operations,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+    }
+
+
+def machine_description():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Prints a comparison table and returns the names of regressions."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if previous is None:
+            print("{name:45} {median:12.3e} s/{unit}  (new)".format(
+                name=name, median=result["median"], unit=result["unit"]))
+            continue
+        ratio = result["median"] / previous["median"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print("{name:45} {median:12.3e} s/{unit}  x{ratio:.2f}{flag}".format(
+            name=name, median=result["median"], unit=result["unit"], ratio=ratio, flag=flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run conductor benchmarks.")
+    parser.add_argument("--output", default="",
+                        help="Write results to this JSON file.")
+    parser.add_argument("--compare", default="",
+                        help="Compare against an earlier results file.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Slowdown that counts as a regression. Defaults to 0.10.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timed repetitions per benchmark. Defaults to 5.")
+    parser.add_argument("--only", nargs="*", default=None,
+                        help="Only run benchmarks whose names start with these prefixes.")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS
+             if not args.only or any(name.startswith(prefix) for prefix in args.only)]
+    results = collections.OrderedDict()
+    for name in names:
+        results[name] = run_benchmark(name, args.repeat)
+        if not args.compare:
+            print("{name:45} {median:12.3e} s/{unit}".format(
+                name=name, median=results[name]["median"], unit=results[name]["unit"]))
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"machine": machine_description(), "benchmarks": results},
+                      output_file, indent=2, sort_keys=True)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
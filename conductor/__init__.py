@@ -1,2 +1,49 @@
 from conductor.conductor import OperationWrapper
 from conductor.conductor import command_string_builder
+from conductor.conductor import CommandTemplate
+from conductor.async_wrapper import AsyncOperationWrapper
+from conductor.process import CommandResult
+from conductor.process import ProcessHandle
+from conductor.scheduler import CommandScheduler
+from conductor.resources import ResourcePool
+from conductor.scheduler import Step
+from conductor.scheduler import parse_command_lines
+from conductor.plan import ExecutionPlan
+from conductor.plan import compile_plan
+from conductor.checksum import ChecksumCache
+from conductor.checksum import FileDigest
+from conductor.files import FileEntry
+from conductor.download import DownloadCache
+from conductor.download import DownloadError
+from conductor.download import DownloadResult
+from conductor.download import Downloader
+from conductor.trees import TreeStats
+from conductor.permissions import ChangeStats
+from conductor.sync import SyncStats
+from conductor.sync import TreeSync
+from conductor.sysinfo import DiskUsage
+from conductor.sysinfo import KernelInfo
+from conductor.sysinfo import NetworkInterface
+from conductor.sysinfo import OSRelease
+from conductor.sysinfo import Sample
+from conductor.sysinfo import SystemSampler
+from conductor.sysinfo import Uptime
+from conductor.accounts import AccountIndex
+from conductor.accounts import GroupAccount
+from conductor.accounts import UserAccount
+from conductor.packages import AptPackageManager
+from conductor.packages import DpkgStatus
+from conductor.journal import CheckpointJournal
+from conductor.querycache import QueryCache
+from conductor.session import SessionClosedError
+from conductor.session import ShellSession
+from conductor.transport import ConnectionPool
+from conductor.transport import LocalTransport
+from conductor.transport import SSHTransport
+from conductor.transport import SessionTransport
+from conductor.transport import Transport
+from conductor.transport import TransportUnsupportedError
+from conductor.metrics import JsonLinesExporter
+from conductor.metrics import PrometheusExporter
+from conductor.sweep import ParameterSweep
+from conductor.sweep import expand_parameters
@@ -0,0 +1,97 @@
+import argparse
+import signal
+import sys
+
+from conductor.conductor import OperationWrapper
+from conductor.plan import DEFAULT_CACHE_DIRECTORY
+from conductor.resources import ResourcePool
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="conductor",
+        description="Run the shell commands listed in a command file.")
+    parser.add_argument("command_filename",
+                        help="File with one shell command per line.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of commands to run at the same time. "
+                             "Defaults to 1.")
+    parser.add_argument("--stop-on-failure", action="store_true",
+                        help="Stop starting new commands once one fails.")
+    parser.add_argument("--batch-packages", action="store_true",
+                        help="Merge consecutive apt-get installs, skip "
+                             "installed packages and fresh apt-get updates.")
+    parser.add_argument("--journal", default="",
+                        help="Record each finished command in this "
+                             "checkpoint journal.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip commands the journal shows already "
+                             "succeeded. Requires --journal.")
+    parser.add_argument("--reserve-resources", action="store_true",
+                        help="Only start a command while the cores and memory "
+                             "it declares or implies are free on this host.")
+    parser.add_argument("--cpus", type=int, default=None,
+                        help="Cores --reserve-resources may hand out. "
+                             "Defaults to the cores available.")
+    parser.add_argument("--memory", default=None,
+                        help="Memory --reserve-resources may hand out, e.g. "
+                             "16G. Defaults to MemAvailable.")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Seconds each command may run before its process "
+                             "group is stopped.")
+    parser.add_argument("--run-timeout", type=float, default=None,
+                        help="Seconds the whole file may take before "
+                             "everything in flight is stopped.")
+    parser.add_argument("--grace-period", type=float, default=5.0,
+                        help="Seconds between SIGTERM and SIGKILL when a "
+                             "command is stopped. Defaults to 5.")
+    parser.add_argument("--plan-cache", default=DEFAULT_CACHE_DIRECTORY,
+                        help="Directory compiled command files are cached "
+                             "in; pass \"\" to turn the cache off.")
+    parser.add_argument("--debug", action="store_true",
+                        help="Log each command string before it runs.")
+    parser.add_argument("--log-filename", default="",
+                        help="Where debug logging goes. Defaults to stderr.")
+    return parser
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.resume and not args.journal:
+        parser.error("--resume requires --journal")
+    resources = None
+    if args.reserve_resources:
+        resources = ResourcePool(cpus=args.cpus, memory=args.memory)
+    ops = OperationWrapper(debug=args.debug, log_filename=args.log_filename,
+                           command_timeout=args.timeout,
+                           grace_period=args.grace_period)
+    # Turn SIGTERM into an exception like Ctrl-C, so running commands are
+    # torn down on the way out instead of being orphaned.
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    results = ops.install(args.command_filename, jobs=args.jobs,
+                          stop_on_failure=args.stop_on_failure,
+                          batch_packages=args.batch_packages,
+                          journal_filename=args.journal, resume=args.resume,
+                          resources=resources, run_timeout=args.run_timeout,
+                          plan_cache_directory=args.plan_cache)
+
+    failures = [step_id for step_id, result in results.items()
+                if not result.succeeded]
+    for step_id in failures:
+        sys.stderr.write("{id} {how}: {cmd}\n".format(
+            id=step_id, how="timed out" if results[step_id].timed_out else "failed",
+            cmd=results[step_id].command_string))
+    if ops.last_run is not None and ops.last_run.cancelled:
+        sys.stderr.write("run timed out after {seconds}s; later commands were not started\n".format(
+            seconds=args.run_timeout))
+        return 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
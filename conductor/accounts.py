@@ -0,0 +1,159 @@
+import collections
+import os
+import threading
+
+
+PASSWD_FILENAME = "/etc/passwd"
+GROUP_FILENAME = "/etc/group"
+
+UserAccount = collections.namedtuple("UserAccount",
+                                     ["name", "uid", "gid", "gecos", "home", "shell"])
+GroupAccount = collections.namedtuple("GroupAccount", ["name", "gid", "members"])
+
+
+def _file_signature(filename):
+    try:
+        stat_result = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    # Tools like useradd replace the file rather than editing it in place, so
+    # the inode is checked as well as the size and mtime.
+    return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+def _read_colon_file(filename, min_fields):
+    records = []
+    if not os.path.exists(filename):
+        return records
+    with open(filename, "r") as source:
+        for line in source:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#") or line.startswith(("+", "-")):
+                continue  # skip comments and NIS compat entries
+            fields = line.split(":")
+            if len(fields) >= min_fields:
+                records.append(fields)
+    return records
+
+
+class AccountIndex(object):
+    """An in-memory index of local users and groups.
+
+    The passwd and group files are parsed once and then served from
+    dictionaries, so every lookup is O(1). Each lookup checks whether either
+    file has changed since it was read (one stat per file) and rebuilds the
+    index if so, so callers never see stale data and never have to invalidate
+    it by hand.
+
+    Only the local files are read; accounts that come from LDAP or other NSS
+    sources are not included.
+
+    Args:
+        passwd_filename (str): Defaults to /etc/passwd.
+        group_filename (str): Defaults to /etc/group.
+    """
+
+    def __init__(self, passwd_filename=PASSWD_FILENAME, group_filename=GROUP_FILENAME):
+        self.passwd_filename = passwd_filename
+        self.group_filename = group_filename
+        self._lock = threading.Lock()
+        self._signature = None
+        self._users = []
+        self._groups = []
+        self._users_by_name = {}
+        self._users_by_uid = {}
+        self._groups_by_name = {}
+        self._groups_by_gid = {}
+        self._groups_by_member = {}
+
+    def _current_signature(self):
+        return (_file_signature(self.passwd_filename),
+                _file_signature(self.group_filename))
+
+    def refresh(self, force=False):
+        """Rebuilds the index if either file changed since it was read.
+
+        Args:
+            force (bool): Rebuild even if nothing seems to have changed.
+        """
+        signature = self._current_signature()
+        with self._lock:
+            if not force and signature == self._signature:
+                return
+
+            users = [UserAccount(name=fields[0], uid=int(fields[2]),
+                                 gid=int(fields[3]), gecos=fields[4],
+                                 home=fields[5], shell=fields[6])
+                     for fields in _read_colon_file(self.passwd_filename, 7)]
+            groups = [GroupAccount(name=fields[0], gid=int(fields[2]),
+                                   members=tuple(m for m in fields[3].split(",") if m))
+                      for fields in _read_colon_file(self.group_filename, 4)]
+
+            groups_by_member = collections.defaultdict(list)
+            for group in groups:
+                for member in group.members:
+                    groups_by_member[member].append(group)
+
+            # Keep the first entry for duplicate names/ids, as getpwnam does.
+            self._users_by_name = {}
+            self._users_by_uid = {}
+            for user in users:
+                self._users_by_name.setdefault(user.name, user)
+                self._users_by_uid.setdefault(user.uid, user)
+            self._groups_by_name = {}
+            self._groups_by_gid = {}
+            for group in groups:
+                self._groups_by_name.setdefault(group.name, group)
+                self._groups_by_gid.setdefault(group.gid, group)
+
+            self._users = users
+            self._groups = groups
+            self._groups_by_member = dict(groups_by_member)
+            self._signature = signature
+
+    def users(self):
+        """Returns every UserAccount in file order."""
+        self.refresh()
+        return list(self._users)
+
+    def groups(self):
+        """Returns every GroupAccount in file order."""
+        self.refresh()
+        return list(self._groups)
+
+    def user_by_name(self, name):
+        """Raises KeyError if there is no such user."""
+        self.refresh()
+        return self._users_by_name[name]
+
+    def user_by_uid(self, uid):
+        """Raises KeyError if there is no such user."""
+        self.refresh()
+        return self._users_by_uid[uid]
+
+    def group_by_name(self, name):
+        """Raises KeyError if there is no such group."""
+        self.refresh()
+        return self._groups_by_name[name]
+
+    def group_by_gid(self, gid):
+        """Raises KeyError if there is no such group."""
+        self.refresh()
+        return self._groups_by_gid[gid]
+
+    def groups_for_user(self, name):
+        """Returns the groups a user belongs to, primary group first, in the
+        same order as the id and groups commands.
+
+        Raises:
+            KeyError: If there is no such user.
+        """
+        user = self.user_by_name(name)
+        result = []
+        primary = self._groups_by_gid.get(user.gid)
+        if primary is not None:
+            result.append(primary)
+        for group in self._groups_by_member.get(name, ()):
+            if group.gid != user.gid:
+                result.append(group)
+        return result
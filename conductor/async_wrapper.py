@@ -0,0 +1,583 @@
+import asyncio
+import collections
+import functools
+import inspect
+import os
+import shlex
+import signal
+import time
+
+from conductor import journal
+from conductor import packages
+from conductor import plan
+from conductor.conductor import OperationWrapper
+from conductor.process import MAX_CHUNK_SIZE
+from conductor.process import STDERR
+from conductor.process import STDOUT
+from conductor.process import CommandResult
+from conductor.transport import TransportUnsupportedError
+
+
+DEFAULT_MAX_CONCURRENCY = 64
+
+# OperationWrapper methods that do their work in-process, with file system
+# calls, reads of /proc and /etc, or HTTP, rather than by running a command.
+# AsyncOperationWrapper runs them on the event loop's default executor.
+_IN_PROCESS_METHODS = (
+    "load_commands_from_text_file", "list_my_groups", "list_user_groups",
+    "list_all_groups_on_system", "list_all_users", "make_directory", "move_directory",
+    "copy_directory", "remove_directory", "head_file", "tail_file", "view_file_contents",
+    "list_files", "web_get", "remote_sync", "network_addresses", "disk_free_space",
+    "operating_system_information", "operating_system_kernel_information", "md5_checksum",
+    "sha1_checksum", "checksum_files", "system_uptime", "change_permissions",
+    "change_group", "change_owner",
+)
+
+
+def _signal_group(pid, sig):
+    try:
+        os.killpg(pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _chunks(stream):
+    """Yields what stream produces line by line, splitting lines longer
+    than the stream's limit into pieces, like ProcessHandle does."""
+    while True:
+        try:
+            yield await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as error:
+            if error.partial:
+                yield error.partial
+            return
+        except asyncio.LimitOverrunError as error:
+            yield await stream.read(max(error.consumed, 1))
+
+
+class AsyncOperationWrapper(object):
+    """OperationWrapper for asyncio programs.
+
+    Shell commands run as asyncio subprocesses, so waiting on one ties up no
+    thread and thousands can share one event loop. Like OperationWrapper,
+    each command gets its own process group, and a command that runs past
+    its timeout, or whose task is cancelled, is stopped with SIGTERM and
+    then SIGKILL across the whole group. At most max_concurrency commands
+    run at once; the rest wait their turn.
+
+    The other methods of OperationWrapper are available as coroutines too.
+    Those that run commands, such as add_group, install_system_packages or
+    run_command_steps, run them the same way, with the wrapped wrapper's
+    package manager and query cache doing their bookkeeping. Those that work
+    in-process, such as list_files, copy_directory or system_uptime, run on
+    the loop's default executor under the same limit. Results go through the
+    wrapped OperationWrapper's command hooks.
+
+    Commands start in the wrapped wrapper's working directory. They always
+    run on this machine, so a wrapper with a transport is refused with
+    TransportUnsupportedError.
+
+    Resource usage (user_time, system_time, max_rss) isn't measured for
+    asyncio subprocesses and is left as None.
+
+    Args:
+        wrapper (OperationWrapper): Supplies the command hooks, timeout,
+            grace period, logging and in-process methods. Defaults to a new
+            OperationWrapper built from options.
+        max_concurrency (int): Commands and calls in flight at once.
+            Defaults to 64.
+        **options: OperationWrapper arguments, used when wrapper is None.
+    """
+
+    def __init__(self, wrapper=None, max_concurrency=DEFAULT_MAX_CONCURRENCY, **options):
+        self.wrapper = wrapper or OperationWrapper(**options)
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._apt_lock = None
+        self._processes = set()
+        self._cancelled = False
+
+    @property
+    def grace_period(self):
+        return self.wrapper.processes.grace_period
+
+    def _limit(self):
+        # Created on first use so it belongs to the loop that is running.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _apt(self):
+        # dpkg holds a global lock, so apt-get runs one at a time.
+        if self._apt_lock is None:
+            self._apt_lock = asyncio.Lock()
+        return self._apt_lock
+
+    async def _spawn(self, command_string, capture_stderr=True):
+        if self.wrapper.transport is not None:
+            raise TransportUnsupportedError(
+                "AsyncOperationWrapper runs commands on this machine, not on {host}".format(
+                    host=self.wrapper.transport.host))
+        stderr = asyncio.subprocess.PIPE if capture_stderr else None
+        cwd = self.wrapper._working_directory()
+        if isinstance(command_string, (list, tuple)):
+            process = await asyncio.create_subprocess_exec(
+                *[str(arg) for arg in command_string], stdout=asyncio.subprocess.PIPE,
+                stderr=stderr, start_new_session=True, limit=MAX_CHUNK_SIZE, cwd=cwd)
+        else:
+            process = await asyncio.create_subprocess_exec(
+                "/bin/sh", "-c", command_string, stdout=asyncio.subprocess.PIPE,
+                stderr=stderr, start_new_session=True, limit=MAX_CHUNK_SIZE, cwd=cwd)
+        self._processes.add(process)
+        return process
+
+    async def _stop(self, process, grace_period=None):
+        """Sends SIGTERM to the process group, then SIGKILL after the grace
+        period, and kills whatever is left in the group once the leader has
+        exited."""
+        grace_period = self.grace_period if grace_period is None else grace_period
+        if process.returncode is None:
+            _signal_group(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(process.wait(), grace_period)
+            except asyncio.TimeoutError:
+                pass
+        _signal_group(process.pid, signal.SIGKILL)
+        await process.wait()
+
+    async def _collect(self, process, captured, sizes, callback):
+        async def pump(name, stream):
+            async for chunk in _chunks(stream):
+                line = chunk.decode(errors="replace")
+                sizes[name] += len(line)
+                captured[name].append(line)
+                if callback is not None:
+                    outcome = callback(name, line)
+                    if inspect.isawaitable(outcome):
+                        await outcome
+
+        pumps = [pump(STDOUT, process.stdout)]
+        if process.stderr is not None:
+            pumps.append(pump(STDERR, process.stderr))
+        await asyncio.gather(*pumps)
+        await process.wait()
+
+    async def _run(self, command_string, timeout=None, capture_stderr=True, callback=None,
+                   keep_lines=None):
+        timeout = self.wrapper.command_timeout if timeout is None else timeout
+        if self.wrapper.print_command_strings:
+            self.wrapper.logger.info(command_string)
+        captured = {STDOUT: collections.deque(maxlen=keep_lines),
+                    STDERR: collections.deque(maxlen=keep_lines)}
+        sizes = {STDOUT: 0, STDERR: 0}
+        timed_out = False
+        async with self._limit():
+            started = time.time()
+            process = await self._spawn(command_string, capture_stderr)
+            collecting = asyncio.ensure_future(
+                self._collect(process, captured, sizes, callback))
+            try:
+                done, _ = await asyncio.wait([collecting], timeout=timeout)
+                if not done:
+                    timed_out = True
+                    await self._stop(process)
+                    # Keep whatever was printed on the way out, without
+                    # waiting long on a daemon that escaped the group.
+                    done, _ = await asyncio.wait([collecting], timeout=self.grace_period)
+                    if not done:
+                        collecting.cancel()
+                for future in done:
+                    future.result()
+            except BaseException:
+                # e.g. the task was cancelled: don't leave the command
+                # running behind us.
+                collecting.cancel()
+                await asyncio.shield(self._stop(process))
+                raise
+            finally:
+                self._processes.discard(process)
+
+        if isinstance(command_string, (list, tuple)):
+            command_string = " ".join(shlex.quote(str(arg)) for arg in command_string)
+        result = CommandResult(command_string, process.returncode, "".join(captured[STDOUT]),
+                               "".join(captured[STDERR]), time.time() - started,
+                               started=started, stdout_size=sizes[STDOUT],
+                               stderr_size=sizes[STDERR], timed_out=timed_out)
+        return self.wrapper._record(result)
+
+    async def run(self, command_string, timeout=None):
+        """Runs a shell command and captures its output.
+
+        Args:
+            command_string (str or List[str]): A shell command, or an argv
+                list to run without a shell.
+            timeout (float): Seconds the command may run before its process
+                group is stopped. Defaults to the wrapper's command_timeout.
+
+        Returns:
+            CommandResult: Exit status, stdout, stderr and duration.
+                timed_out is set if the command was stopped.
+        """
+        return await self._run(command_string, timeout)
+
+    async def start_blocking_process(self, command_string, timeout=None):
+        """Runs a shell command and returns its output, like
+        OperationWrapper.start_blocking_process. stderr stays attached to
+        ours.
+
+        Returns:
+            str: The shell output of the command.
+        """
+        result = await self._run(command_string, timeout, capture_stderr=False)
+        return result.stdout
+
+    async def start_streaming_process(self, command_string, callback=None, keep_lines=1000,
+                                      timeout=None):
+        """Runs a shell command, handing output over as it is produced.
+
+        Args:
+            command_string (str): A shell command represented as a string.
+            callback (callable): Called as callback(stream_name, line) for
+                each line. May be a coroutine function.
+            keep_lines (int): How many of the most recent lines of each
+                stream to keep for the result. Defaults to 1000.
+            timeout (float): Seconds the command may run.
+
+        Returns:
+            CommandResult: The exit status plus the tail of stdout and stderr.
+        """
+        return await self._run(command_string, timeout, callback=callback, keep_lines=keep_lines)
+
+    async def start_non_blocking_process(self, command_string, timeout=None):
+        """Starts a shell command in the background and returns at once.
+
+        Args:
+            command_string (str or List[str]): A shell command, or an argv
+                list to run without a shell.
+            timeout (float): Seconds the command may run.
+
+        Returns:
+            asyncio.Task: Resolves to the command's CommandResult.
+                Cancelling it stops the command's process group, as does
+                cancel().
+        """
+        return asyncio.ensure_future(self.run(command_string, timeout))
+
+    async def run_list_of_commands(self, list_of_command_strings):
+        """Runs each shell command in turn.
+
+        Returns:
+            List(str): The output of each command.
+        """
+        return [await self.start_blocking_process(command_string)
+                for command_string in list_of_command_strings]
+
+    async def run_many(self, list_of_command_strings, timeout=None, return_exceptions=False):
+        """Runs shell commands concurrently, at most max_concurrency at a
+        time.
+
+        Args:
+            list_of_command_strings (List[str]): Commands to run.
+            timeout (float): Seconds each command may run.
+            return_exceptions (bool): As for asyncio.gather: return errors in
+                place of results instead of raising the first one.
+
+        Returns:
+            List[CommandResult]: One per command, in the order given.
+        """
+        return await self.gather(*[self.run(command_string, timeout)
+                                   for command_string in list_of_command_strings],
+                                 return_exceptions=return_exceptions)
+
+    async def gather(self, *coroutines, return_exceptions=False):
+        """Awaits several calls of this wrapper at once, e.g.
+        gather(ops.system_uptime(), ops.run("hostname")).
+
+        Returns:
+            list: Their results, in the order given.
+        """
+        return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+    async def list_hardware(self, timeout=None):
+        """Gets hardware configuration of machine.
+
+        Returns:
+            str: Output of lshw command.
+        """
+        cache = self.wrapper.query_cache
+        if cache is not None and cache.ttl("list_hardware") > 0:
+            # Cached like the synchronous method, so a hit costs nothing.
+            return await self._in_executor(self.wrapper.list_hardware)
+        return await self.start_blocking_process("lshw", timeout)
+
+    async def print_working_directory(self):
+        """Gets the current working directory.
+
+        Returns:
+            str: Location of current working directory.
+        """
+        return await self.start_blocking_process("pwd")
+
+    async def change_working_directory(self, directory_name):
+        """Changes the working directory later commands run in; see
+        OperationWrapper.change_working_directory.
+
+        Returns:
+            str: Output of cd command.
+        """
+        if self.wrapper.session is not None:
+            # Only the session's shell can move itself.
+            return await self._in_executor(self.wrapper.change_working_directory,
+                                           directory_name)
+        output = await self.start_blocking_process("cd {dir} && pwd".format(dir=directory_name))
+        if output:
+            self.wrapper.working_directory = output[:-1]
+        return ""
+
+    async def add_group(self, group_name):
+        """Creates a new group account with default values.
+
+        Returns:
+            str: Output of groupadd command.
+        """
+        output = await self.start_blocking_process("groupadd {name}".format(name=group_name))
+        self.wrapper._invalidate_accounts()
+        return output
+
+    async def add_new_user(self, username, user_home_directory, user_groups):
+        """Adds a new user account to the system.
+
+        Returns:
+            str: Output of useradd command.
+        """
+        output = await self.start_blocking_process("useradd -d {home} -m {user} -G {groups}".format(
+            home=user_home_directory, user=username, groups=user_groups))
+        self.wrapper._invalidate_accounts()
+        return output
+
+    async def set_user_password(self, username, password):
+        """Sets or changes password for the specified user.
+
+        Returns:
+            str: Output of chpasswd command.
+        """
+        return await self.start_blocking_process("echo {user}:{password} | chpasswd".format(
+            user=username, password=password))
+
+    async def _update(self, command_string="apt-get update", force=False):
+        manager = self.wrapper.package_manager
+        if not force and manager.lists_are_fresh():
+            return CommandResult(command_string, 0)
+        started = time.time()
+        async with self._apt():
+            result = await self._run(command_string)
+        if result.succeeded:
+            manager.mark_updated(started)
+        return result
+
+    async def _install(self, names, command_prefix):
+        missing = self.wrapper.package_manager.missing_packages(names)
+        command_string = "{prefix} {packages}".format(
+            prefix=command_prefix, packages=" ".join(missing or names))
+        if not missing:
+            return CommandResult(command_string, 0)
+        async with self._apt():
+            return await self._run(command_string)
+
+    async def update_system_packages(self, force=False):
+        """Synchronizes index files of packages on machine, unless they are
+        still fresh; see OperationWrapper.update_system_packages.
+
+        Returns:
+            str: Output of apt-get update command, or "" if skipped.
+        """
+        return (await self._update(force=force)).stdout
+
+    async def upgrade_system_packages(self):
+        """Fetches newest versions of packages on machine.
+
+        Returns:
+            str: Output of apt-get upgrade command.
+        """
+        async with self._apt():
+            return await self.start_blocking_process("apt-get upgrade")
+
+    async def install_system_packages(self, package_name):
+        """Installs the packages that aren't installed yet in one apt-get
+        transaction; see OperationWrapper.install_system_packages.
+
+        Returns:
+            str: Output of apt-get install command, or "" if skipped.
+        """
+        if isinstance(package_name, str):
+            package_name = package_name.split()
+        return (await self._install(package_name, "apt-get install")).stdout
+
+    async def _run_step(self, step):
+        return await self._run(step.command_string)
+
+    async def _run_package_aware_step(self, step):
+        command_string = step.command_string.strip()
+        if packages.is_update_command(command_string):
+            return await self._update(command_string)
+        parsed = packages.parse_install_command(command_string)
+        if parsed is not None:
+            command_prefix, names = parsed
+            return await self._install(names, command_prefix)
+        return await self._run(command_string)
+
+    async def run_command_steps(self, steps, jobs=1, stop_on_failure=False,
+                                batch_packages=False, journal_filename="", resume=False,
+                                resources=None, run_timeout=None):
+        """Runs a dependency graph of steps as asyncio subprocesses, up to
+        jobs of them at once. The arguments are those of
+        OperationWrapper.run_command_steps.
+
+        Returns:
+            OrderedDict: Maps step id to CommandResult for every step that
+                ran, in completion order.
+        """
+        run_step = self._run_step
+        if batch_packages:
+            steps = packages.batch_install_steps(steps)
+            run_step = self._run_package_aware_step
+        if journal_filename:
+            checkpoints = journal.CheckpointJournal(journal_filename)
+            keys = journal.step_keys(steps)
+            if resume:
+                steps, skipped = checkpoints.resume_steps(steps, keys)
+                for step_id in skipped:
+                    self.wrapper._log("skipping {id}: already done".format(id=step_id))
+            run_step = self._journaled(run_step, checkpoints, keys)
+
+        self._cancelled = False
+        timer = None
+        if run_timeout:
+            loop = asyncio.get_running_loop()
+            timer = loop.call_later(run_timeout, lambda: asyncio.ensure_future(self.cancel()))
+        try:
+            return await self._schedule(steps, run_step, jobs, stop_on_failure, resources)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def _journaled(self, run_step, checkpoints, keys):
+        async def run_and_record(step):
+            result = await run_step(step)
+            # The journal fsyncs each record; keep that off the loop.
+            await self._in_executor(checkpoints.record, keys[step.step_id], step, result)
+            return result
+        return run_and_record
+
+    async def _schedule(self, steps, run_step, jobs, stop_on_failure, resources):
+        """Starts each step once the steps it depends on have finished, in
+        file order among the ready ones, like CommandScheduler."""
+        steps_by_id = collections.OrderedDict((step.step_id, step) for step in steps)
+        position = dict((step.step_id, index) for index, step in enumerate(steps))
+        waiting_on = dict((step.step_id, len(step.depends_on)) for step in steps)
+        dependents = collections.defaultdict(list)
+        for step in steps:
+            for dep in step.depends_on:
+                dependents[dep].append(step.step_id)
+
+        ready = [step.step_id for step in steps if not step.depends_on]
+        results = collections.OrderedDict()
+        running = {}
+        failed = False
+        try:
+            while ready or running:
+                for step_id in list(ready):
+                    if len(running) >= jobs or failed or self._cancelled:
+                        break
+                    step = steps_by_id[step_id]
+                    reservation = None
+                    if resources is not None:
+                        reservation = resources.try_acquire(*step.requirements())
+                        if reservation is None and running:
+                            continue
+                        if reservation is None:
+                            # Nothing of ours to wait for, so wait on the pool.
+                            reservation = await self._in_executor(resources.acquire,
+                                                                  *step.requirements())
+                    ready.remove(step_id)
+                    running[asyncio.ensure_future(run_step(step))] = (step, reservation)
+
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    step, reservation = running.pop(task)
+                    if reservation is not None:
+                        resources.release(reservation)
+                    result = task.result()
+                    results[step.step_id] = result
+                    if stop_on_failure and not result.succeeded:
+                        failed = True
+                    for dependent in dependents[step.step_id]:
+                        waiting_on[dependent] -= 1
+                        if waiting_on[dependent] == 0:
+                            ready.append(dependent)
+                ready.sort(key=position.get)
+        except BaseException:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            for _, reservation in running.values():
+                if reservation is not None:
+                    resources.release(reservation)
+            raise
+        return results
+
+    async def install(self, command_filename, jobs=1, stop_on_failure=False,
+                      batch_packages=False, journal_filename="", resume=False,
+                      resources=None, run_timeout=None,
+                      plan_cache_directory=""):
+        """Compiles command_filename into an execution plan and runs it; see
+        OperationWrapper.install.
+
+        Returns:
+            OrderedDict: Maps step id to CommandResult for every step that
+                ran.
+        """
+        execution_plan = await self._in_executor(
+            plan.compile_plan, command_filename, optimize=batch_packages,
+            cache_directory=plan_cache_directory)
+        for step_id in execution_plan.dropped:
+            self.wrapper._log("dropping {id}: redundant".format(id=step_id))
+        return await self.run_command_steps(execution_plan.steps, jobs=jobs,
+                                            stop_on_failure=stop_on_failure,
+                                            batch_packages=batch_packages,
+                                            journal_filename=journal_filename,
+                                            resume=resume, resources=resources,
+                                            run_timeout=run_timeout)
+
+    async def _in_executor(self, method, *args, **kwargs):
+        async with self._limit():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+    async def cancel(self, grace_period=None):
+        """Stops every command this wrapper is running. A running
+        run_command_steps or install starts no further steps.
+
+        Returns:
+            int: How many commands were stopped.
+        """
+        self._cancelled = True
+        processes = list(self._processes)
+        await asyncio.gather(*[self._stop(process, grace_period) for process in processes])
+        return len(processes)
+
+
+def _in_executor_method(name):
+    method = getattr(OperationWrapper, name)
+
+    @functools.wraps(method)
+    async def coroutine(self, *args, **kwargs):
+        return await self._in_executor(getattr(self.wrapper, name), *args, **kwargs)
+    return coroutine
+
+
+for _name in _IN_PROCESS_METHODS:
+    setattr(AsyncOperationWrapper, _name, _in_executor_method(_name))
@@ -0,0 +1,133 @@
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent import futures
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+FileDigest = collections.namedtuple("FileDigest",
+                                    ["filename", "algorithm", "hexdigest", "size"])
+
+
+def hash_file(filename, algorithm="md5", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Hashes a file in large chunks. hashlib releases the GIL while it
+    digests each chunk, so several of these can run usefully on threads.
+
+    Args:
+        filename (str): File to hash.
+        algorithm (str): Any name accepted by hashlib.new, e.g. "md5",
+            "sha1" or "sha256".
+        chunk_size (int): Bytes read per chunk.
+
+    Returns:
+        FileDigest: The digest of the file.
+    """
+    digest = hashlib.new(algorithm)
+    size = 0
+    with open(filename, "rb") as source:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return FileDigest(filename, algorithm, digest.hexdigest(), size)
+
+
+def _file_signature(stat_result):
+    return [stat_result.st_dev, stat_result.st_ino, stat_result.st_size,
+            stat_result.st_mtime_ns]
+
+
+class ChecksumCache(object):
+    """Remembers digests between runs so unchanged files are never re-read.
+
+    An entry is reused only while the file's device, inode, size and
+    modification time all match what they were when it was hashed. The cache
+    is kept in memory and written to cache_filename as JSON by save().
+
+    Args:
+        cache_filename (str): Where the cache is persisted. If empty the
+            cache only lives as long as the object.
+    """
+
+    def __init__(self, cache_filename=""):
+        self.cache_filename = cache_filename
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        if cache_filename and os.path.exists(cache_filename):
+            with open(cache_filename, "r") as cache_file:
+                self._entries = json.load(cache_file)
+
+    @staticmethod
+    def _key(filename, algorithm):
+        return "{algorithm}:{path}".format(algorithm=algorithm,
+                                           path=os.path.abspath(filename))
+
+    def lookup(self, filename, algorithm, stat_result):
+        """Returns the cached FileDigest, or None if the file has changed."""
+        with self._lock:
+            entry = self._entries.get(self._key(filename, algorithm))
+        if entry is None or entry["signature"] != _file_signature(stat_result):
+            return None
+        return FileDigest(filename, algorithm, entry["hexdigest"], stat_result.st_size)
+
+    def store(self, file_digest, stat_result):
+        with self._lock:
+            self._entries[self._key(file_digest.filename, file_digest.algorithm)] = {
+                "signature": _file_signature(stat_result),
+                "hexdigest": file_digest.hexdigest,
+            }
+            self._dirty = True
+
+    def save(self):
+        """Atomically writes the cache to cache_filename if it changed."""
+        if not self.cache_filename or not self._dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_filename))
+        with self._lock:
+            handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(handle, "w") as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(temp_name, self.cache_filename)
+            self._dirty = False
+
+
+def _cached_hash(filename, algorithm, cache, chunk_size):
+    if cache is None:
+        return hash_file(filename, algorithm, chunk_size)
+
+    before = os.stat(filename)
+    cached = cache.lookup(filename, algorithm, before)
+    if cached is not None:
+        return cached
+
+    file_digest = hash_file(filename, algorithm, chunk_size)
+    # Only trust the digest if the file didn't change while it was read.
+    if _file_signature(os.stat(filename)) == _file_signature(before):
+        cache.store(file_digest, before)
+    return file_digest
+
+
+def checksum_files(filenames, algorithm="md5", jobs=None, cache=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE):
+    """Hashes many files concurrently on a thread pool.
+
+    Args:
+        filenames (List[str]): Files to hash.
+        algorithm (str): Any name accepted by hashlib.new.
+        jobs (int): Number of worker threads. Defaults to the
+            ThreadPoolExecutor default.
+        cache (ChecksumCache): Optional cache of earlier results. It is
+            updated but not saved; call cache.save() afterwards.
+        chunk_size (int): Bytes read per chunk.
+
+    Returns:
+        List[FileDigest]: One digest per file, in the order given.
+    """
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = [executor.submit(_cached_hash, filename, algorithm, cache, chunk_size)
+                   for filename in filenames]
+        return [future.result() for future in pending]
@@ -1,7 +1,53 @@
+import functools
 import os
+import re
+import shlex
+import sys
+import threading
 import logging
 import logging.config
 
+from conductor import accounts
+from conductor import checksum
+from conductor import download
+from conductor import files
+from conductor import journal
+from conductor import packages
+from conductor import permissions
+from conductor import plan
+from conductor import sync
+from conductor import sysinfo
+from conductor import trees
+from conductor.process import DEFAULT_GRACE_PERIOD
+from conductor.process import ProcessHandle
+from conductor.process import ProcessRegistry
+from conductor.querycache import cached_query
+from conductor.scheduler import CommandScheduler
+from conductor.session import ShellSession
+from conductor.transport import ConnectionPool
+from conductor.transport import TransportUnsupportedError
+from conductor.transport import run_on_hosts
+
+
+# rsync's [user@]host:path form. Local paths containing ":" can be written
+# as ./name.
+_REMOTE_PATH = re.compile(r"^(?:[\w.-]+@)?[\w.-]+:")
+
+
+def _local_only(method):
+    """Marks an OperationWrapper method that works in-process on this
+    machine. It raises TransportUnsupportedError rather than describe or
+    change this machine when the wrapper's commands run elsewhere."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.transport is not None:
+            raise TransportUnsupportedError(
+                "{name} only works on this machine, not on {host}".format(
+                    name=method.__name__, host=self.transport.host))
+        return method(self, *args, **kwargs)
+    return wrapper
+
 
 def command_string_builder(argument_dictionary, prepend, append="",
                            flags_list="", argument_delimiter="-"):
@@ -24,7 +70,8 @@ def command_string_builder(argument_dictionary, prepend, append="",
 
     Returns:
         str: A fully formatted command string. Not in this implementation
-            arguments will be placed in random order.
+            arguments will be placed in random order. See CommandTemplate for
+            a faster, deterministic builder that can also produce argv lists.
     """
     argument_list = []
     for key in argument_dictionary:
@@ -62,17 +109,334 @@ def command_string_builder(argument_dictionary, prepend, append="",
     return formatted_command_string
 
 
+class CommandTemplate(object):
+    """A compiled command line that many argument sets can be rendered into.
+
+    Everything that doesn't depend on the arguments (the split prepend, the
+    formatted flags, the delimiter) is worked out once, and formatted option
+    names are remembered, so rendering is little more than a list join.
+    Arguments are emitted in argument_order if given, then in sorted key
+    order, so the same dictionary always gives the same command line.
+
+    Args:
+        prepend (str): The software name/path, plus any fixed leading words.
+        append (str): A single trailing argument, often a file path.
+        flags_list (List[str]): Flags without argument delimiters.
+        argument_delimiter (str): Prefix for argument and flag names.
+        argument_order (List[str]): Argument names to put first, in this
+            order.
+        cache_size (int): How many rendered argument sets to remember.
+            Repeated renders of the same arguments are then a lookup.
+    """
+
+    def __init__(self, prepend, append="", flags_list="", argument_delimiter="-",
+                 argument_order=(), cache_size=1024):
+        self.prepend = prepend
+        self.append = append
+        self.flags_list = list(flags_list or [])
+        self.argument_delimiter = argument_delimiter
+        self.argument_order = dict((name, index) for index, name in enumerate(argument_order))
+
+        self._head = shlex.split(prepend)
+        self._tail = ["{delim}{flag}".format(delim=argument_delimiter, flag=flag)
+                      for flag in self.flags_list]
+        if append:
+            self._tail.append(append)
+        self._quoted_head = prepend
+        self._quoted_tail = " ".join(shlex.quote(word) for word in self._tail)
+        self._option_names = {}
+        self._render_items = functools.lru_cache(maxsize=cache_size)(self._render_items_uncached)
+
+    def _option(self, key):
+        option = self._option_names.get(key)
+        if option is None:
+            option = self._option_names[key] = "{delim}{key}".format(
+                delim=self.argument_delimiter, key=key)
+        return option
+
+    def _sorted_items(self, argument_dictionary):
+        order = self.argument_order
+        last = len(order)
+        return tuple(sorted(((key, str(value)) for key, value in argument_dictionary.items()),
+                            key=lambda item: (order.get(item[0], last), item[0])))
+
+    def _render_items_uncached(self, items):
+        middle = []
+        for key, value in items:
+            middle.append(self._option(key))
+            middle.append(value)
+        return tuple(middle)
+
+    def render_argv(self, argument_dictionary):
+        """Renders one argument set as an argv list, ready to run without a
+        shell. Values are passed through untouched, so no quoting is needed.
+
+        Args:
+            argument_dictionary (dict): Argument names to values.
+
+        Returns:
+            List[str]: The command line as a list of words.
+        """
+        middle = self._render_items(self._sorted_items(argument_dictionary))
+        return self._head + list(middle) + self._tail
+
+    def render(self, argument_dictionary):
+        """Renders one argument set as a shell command string. Values are
+        shell-quoted, so spaces and metacharacters arrive intact.
+
+        Args:
+            argument_dictionary (dict): Argument names to values.
+
+        Returns:
+            str: The command string.
+        """
+        middle = self._render_items(self._sorted_items(argument_dictionary))
+        words = [self._quoted_head]
+        words.extend(shlex.quote(word) for word in middle)
+        if self._quoted_tail:
+            words.append(self._quoted_tail)
+        return " ".join(words)
+
+    def render_many(self, argument_dictionaries, argv=False):
+        """Renders many argument sets at once.
+
+        Args:
+            argument_dictionaries (iterable of dict): Argument sets.
+            argv (bool): Produce argv lists instead of strings.
+
+        Returns:
+            List: One command string (or argv list) per argument set.
+        """
+        render = self.render_argv if argv else self.render
+        return [render(arguments) for arguments in argument_dictionaries]
+
+
 class OperationWrapper(object):
+    """Runs system administration commands.
 
-    def __init__(self, debug=False, log_filename=""):
+    Args:
+        debug (bool): Log each command string before it runs.
+        log_filename (str): Where debug logging goes. Defaults to stderr.
+        persistent_shell (bool): Run start_blocking_process commands in one
+            long-lived shell; see open_session.
+        transport (Transport): Run commands there, e.g. on a remote host,
+            instead of locally. File and package methods then act on that
+            host too; methods that only work in-process on this machine,
+            such as disk_free_space or copy_directory, raise
+            TransportUnsupportedError.
+        command_timeout (float): Seconds any command may run before its
+            process group is stopped, locally, in the persistent shell or
+            over the transport. Defaults to no limit.
+        grace_period (float): Seconds between SIGTERM and SIGKILL when a
+            command is stopped. Defaults to 5.
+        query_cache (QueryCache): Serve read-only queries such as
+            list_hardware and list_all_users from this cache. It is saved
+            when the wrapper exits. Defaults to no caching.
+
+    Attributes:
+        working_directory (str): Where spawned commands start and relative
+            paths are resolved when no persistent shell is open, as set by
+            change_working_directory. None for the process's own.
+        last_run (ProcessRegistry): The registry of the most recent command
+            file, sweep or run_on_hosts call. Its cancelled flag tells
+            whether the run timed out or was cancelled.
+    """
+
+    def __init__(self, debug=False, log_filename="", persistent_shell=False,
+                 transport=None, command_timeout=None,
+                 grace_period=DEFAULT_GRACE_PERIOD, query_cache=None):
         self.print_command_strings = debug
+        self.account_index = accounts.AccountIndex()
+        self.package_manager = packages.AptPackageManager(self._run_command)
+        self.session = None
+        self.transport = transport
+        self.connection_pool = None
+        self.http_pool = None
+        self.sampler = None
+        self.query_cache = query_cache
+        self.command_hooks = []
+        self.command_timeout = command_timeout
+        self.working_directory = None
+        self.processes = ProcessRegistry(grace_period)
+        self.last_run = None
+        self._current_run = threading.local()
         if self.print_command_strings:
             logging.basicConfig(filename=log_filename, level=logging.INFO)
             self.logger = logging.getLogger(__name__)
+        if persistent_shell:
+            self.open_session()
+
+    @property
+    def transport(self):
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+        # dpkg's status and apt's lists here only describe local commands.
+        self.package_manager.local = transport is None
+
+    def open_session(self, cwd=None):
+        """Routes start_blocking_process through one long-lived shell, so
+        commands skip the fork/exec of a new shell and the working directory
+        and environment carry over between calls. The native file methods
+        resolve relative paths against the session's working directory.
+
+        Args:
+            cwd (str): Working directory to start in. Defaults to the
+                current one.
+
+        Returns:
+            ShellSession: The session, which is also kept as self.session.
+        """
+        if self.session is None or not self.session.is_alive:
+            self.session = ShellSession(cwd=cwd)
+        return self.session
+
+    def _working_directory(self):
+        if self.session is not None:
+            return self.session.cwd
+        return self.working_directory
+
+    def _path(self, path):
+        """Resolves path against the working directory commands run in, so
+        a relative path means the same to the native file methods as to
+        shell commands."""
+        working_directory = self._working_directory()
+        if working_directory is None:
+            return path
+        return os.path.join(working_directory, path)
+
+    def close_session(self):
+        """Ends the persistent shell, if any. Later calls spawn a fresh
+        shell per command again."""
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.processes.stop_all()
+        self.close_session()
+        if self.connection_pool is not None:
+            self.connection_pool.close()
+        if self.http_pool is not None:
+            self.http_pool.close()
+        if self.query_cache is not None:
+            self.query_cache.save()
+
+    def cancel(self, grace_period=None):
+        """Tears down everything this wrapper has in flight.
+
+        Every running command's process group gets SIGTERM, then SIGKILL
+        after grace_period seconds, and running command files and sweeps
+        stop starting new commands. Commands started once cancel() has
+        returned run as usual.
+
+        Args:
+            grace_period (float): Seconds between SIGTERM and SIGKILL.
+                Defaults to the wrapper's grace_period.
+
+        Returns:
+            int: How many commands were stopped.
+        """
+        self._log("cancelling everything in flight")
+        try:
+            return self.processes.cancel(grace_period)
+        finally:
+            self.processes.reset()
+
+    def _registry(self):
+        # The registry of the run this thread is working for, if any.
+        return getattr(self._current_run, "processes", None) or self.processes
+
+    def _spawn(self, command_string, **kwargs):
+        return self._registry().add(ProcessHandle.spawn(command_string,
+                                                        cwd=self._working_directory(), **kwargs))
+
+    def _finish(self, handle, timeout=None, **kwargs):
+        timeout = self.command_timeout if timeout is None else timeout
+        try:
+            return handle.result(timeout=timeout, stop_on_timeout=True,
+                                 grace_period=self.processes.grace_period, **kwargs)
+        except BaseException:
+            # e.g. Ctrl-C: don't leave the command running behind us.
+            handle.stop(self.processes.grace_period)
+            raise
+        finally:
+            self._registry().discard(handle)
+
+    def _start_run(self, run_timeout):
+        """Starts a run with its own registry and, if run_timeout is set,
+        arranges for the run to be cancelled once it expires.
+
+        Returns:
+            tuple(ProcessRegistry, threading.Timer): The run's registry and
+                the timer, or None, to hand to _finish_run.
+        """
+        run = self.last_run = self.processes.start_run()
+        if not run_timeout:
+            return run, None
+        timer = threading.Timer(run_timeout, self._cancel_run, args=(run,))
+        timer.daemon = True
+        timer.start()
+        return run, timer
+
+    def _cancel_run(self, run):
+        self._log("run timed out; cancelling it")
+        run.cancel()
+
+    def _finish_run(self, run, timer):
+        if timer is not None:
+            timer.cancel()
+        self.processes.finish_run(run)
+
+    def _in_run(self, run, function):
+        """Wraps function so the commands it starts belong to run."""
+        @functools.wraps(function)
+        def run_within(*args, **kwargs):
+            self._current_run.processes = run
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._current_run.processes = None
+        return run_within
+
+    def _log(self, message):
+        if self.print_command_strings:
+            self.logger.info(message)
+
+    def add_command_hook(self, hook):
+        """Registers a function to be called with the CommandResult of every
+        command this wrapper runs, including its wall time, CPU time, peak
+        memory, exit status and output size. JsonLinesExporter and
+        PrometheusExporter are ready-made hooks.
+
+        Args:
+            hook (callable): Called as hook(result) after each command.
+        """
+        self.command_hooks.append(hook)
+
+    def _record(self, result):
+        if self.print_command_strings:
+            self.logger.info("exit {code} after {seconds:.3f}s: {cmd}".format(
+                code=result.exit_code, seconds=result.duration,
+                cmd=result.command_string))
+        for hook in self.command_hooks:
+            hook(result)
+        return result
 
     def load_commands_from_text_file(self, filename):
-        """Reads the contents of a text file and loads each line into a list
-        element.
+        """Reads the commands in a text file, one per element.
+
+        The file is streamed rather than read whole. Blank lines and
+        comments are left out, lines ending in a backslash are joined with
+        the next, and "@include other.txt" lines are replaced by the
+        commands in that file; see plan.read_command_lines.
 
         Args:
             filename (str): Name of file with a list of shell commands on each
@@ -81,34 +445,104 @@ class OperationWrapper(object):
         Returns:
             List(str): A list of shell commands without newlines.
         """
-        with open(filename, 'r') as command_file:
-            commands = command_file.read().splitlines()
-
+        commands = []
+        for _, line in plan.read_command_lines(filename):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                commands.append(line)
         return commands
 
-    def start_blocking_process(self, command_string):
+    def start_blocking_process(self, command_string, timeout=None):
         """Executes a shell commend. The function will not exit until the shell
-        command has completed.
+        command has completed. If the wrapper was given a transport, the
+        command runs there (e.g. on a remote host) instead.
+
+        Locally, the command runs in its own process group. If it runs past
+        its timeout, or the caller is interrupted, the whole group is sent
+        SIGTERM and then SIGKILL; cancel() does the same. In a persistent
+        shell, or over a transport's shell, stopping a command stops that
+        shell, and the next command starts a fresh one.
 
         Args:
             command_string (str): A shell command represented as a string.
-        
+            timeout (float): Seconds the command may run. Defaults to the
+                wrapper's command_timeout.
+
         Returns:
             str: The shell output of the command.
         """
         if self.print_command_strings:
             self.logger.info(command_string)
 
-        process = os.popen(command_string)
-        process_response = process.read()
-        process.close()
+        runner = self.transport or self.session
+        if runner is not None:
+            result = self._record(self._run_remotely(runner, command_string, timeout))
+            # Match os.popen, which leaves stderr attached to ours.
+            sys.stderr.write(result.stderr)
+            return result.stdout
+
+        handle = self._spawn(command_string, capture_stderr=False)
+        return self._record(self._finish(handle, timeout)).stdout
+
+    def _run_remotely(self, runner, command_string, timeout=None):
+        if runner is self.session and not self.session.is_alive:
+            # Stopped by a timeout or cancel(); carry on in a new shell, in
+            # the same directory if it is still there.
+            cwd = self.session.cwd
+            self.close_session()
+            runner = self.open_session(cwd if os.path.isdir(cwd) else None)
+        timeout = self.command_timeout if timeout is None else timeout
+        return runner.run(command_string, timeout=timeout,
+                          grace_period=self.processes.grace_period,
+                          processes=self._registry())
+
+    def start_streaming_process(self, command_string, callback=None,
+                                keep_lines=1000, max_buffered_lines=1024,
+                                timeout=None):
+        """Executes a shell command, handing output over as it is produced
+        instead of buffering all of it. Memory use stays bounded no matter how
+        much the command prints.
 
-        return process_response
+        Args:
+            command_string (str): A shell command represented as a string.
+            callback (callable): Called as callback(stream_name, line) for
+                each line, where stream_name is "stdout" or "stderr".
+            keep_lines (int): How many of the most recent lines of each stream
+                to keep for the result. Defaults to 1000.
+            max_buffered_lines (int): How many unread lines may queue up
+                before the command is paused. Defaults to 1024.
+            timeout (float): Seconds the command may run before its process
+                group is stopped. Defaults to the wrapper's command_timeout.
+
+        Returns:
+            CommandResult: The exit status plus the tail of stdout and stderr.
+                timed_out is set if the command was stopped.
+        """
+        if self.print_command_strings:
+            self.logger.info(command_string)
+
+        handle = self._spawn(command_string, max_buffered_lines=max_buffered_lines)
+        return self._record(self._finish(handle, timeout, keep_lines=keep_lines,
+                                         callback=callback))
 
     def start_non_blocking_process(self, command_string):
-        # TODO: Find a lazy way to start a non-blocking process with the
-        # multithreading lib? Or maybe async?
-        raise NotImplementedError
+        """Starts a shell command in the background and returns at once.
+
+        Args:
+            command_string (str or List[str]): A shell command represented as
+                a string, or an argv list (e.g. from
+                CommandTemplate.render_argv) to run without a shell.
+
+        Returns:
+            ProcessHandle: A handle that can be polled, waited on, streamed
+                and killed. cancel() stops it too.
+        """
+        if self.print_command_strings:
+            self.logger.info(command_string)
+
+        handle = self._spawn(command_string)
+        handle.on_result = self._record
+        return handle
 
     def run_list_of_commands(self, list_of_command_strings):
         """Executes each shell command sequentially by iterating though the
@@ -121,21 +555,201 @@ class OperationWrapper(object):
         for command in list_of_command_strings:
             self.start_blocking_process(command_string=command)
 
-    def install(self, command_filename):
-        """Reads the contents of command_filename and then runs each install
-        command sequentially.
+    def run_command_steps(self, steps, jobs=1, stop_on_failure=False,
+                          batch_packages=False, journal_filename="",
+                          resume=False, resources=None, run_timeout=None):
+        """Runs a dependency graph of steps, up to jobs of them at once.
+
+        Args:
+            steps (List[Step]): Steps as returned by parse_command_lines.
+            jobs (int): Maximum number of commands running at the same time.
+                Defaults to 1.
+            stop_on_failure (bool): Stop starting new commands once one exits
+                non-zero. Defaults to False.
+            batch_packages (bool): Merge consecutive apt-get install steps
+                into one transaction, skip packages that are already
+                installed and skip apt-get update while the package lists
+                are fresh. Defaults to False.
+            journal_filename (str): If given, the exit status and timing of
+                every finished step is appended to this checkpoint journal.
+            resume (bool): Skip steps the journal shows already succeeded,
+                as long as neither they nor anything upstream of them has
+                changed since. Defaults to False.
+            resources (ResourcePool): Only start a step while the cores and
+                memory it declares or implies are free, e.g.
+                ResourcePool() for this machine's capacity.
+            run_timeout (float): Seconds the whole run may take. When it
+                expires, everything in flight is cancelled and no further
+                steps start. Each command is also limited by the wrapper's
+                command_timeout.
+
+        Returns:
+            OrderedDict: Maps step id to CommandResult for every step that
+                ran. Steps skipped on resume or never started because of a
+                cancellation are not included.
+        """
+        run_step = self._run_step
+        if batch_packages:
+            steps = packages.batch_install_steps(steps)
+            run_step = self._run_package_aware_step
+
+        if journal_filename:
+            checkpoints = journal.CheckpointJournal(journal_filename)
+            keys = journal.step_keys(steps)
+            if resume:
+                steps, skipped = checkpoints.resume_steps(steps, keys)
+                for step_id in skipped:
+                    self._log("skipping {id}: already done".format(id=step_id))
+            run_step = self._journaled(run_step, checkpoints, keys)
+
+        run, timer = self._start_run(run_timeout)
+        scheduler = CommandScheduler(run_step=self._in_run(run, run_step), jobs=jobs,
+                                     stop_on_failure=stop_on_failure,
+                                     resources=resources, cancellation=run)
+        try:
+            return scheduler.run(steps)
+        finally:
+            self._finish_run(run, timer)
+
+    @staticmethod
+    def _journaled(run_step, checkpoints, keys):
+        def run_and_record(step):
+            result = run_step(step)
+            checkpoints.record(keys[step.step_id], step, result)
+            return result
+        return run_and_record
+
+    def _run_command(self, command_string):
+        runner = self.transport or self.session
+        if runner is not None:
+            self._log(command_string)
+            return self._record(self._run_remotely(runner, command_string))
+        return self._finish(self.start_non_blocking_process(command_string))
+
+    def _run_step(self, step):
+        return self._run_command(step.command_string)
+
+    def _run_package_aware_step(self, step):
+        return self.package_manager.run(step.command_string)
+
+    def run_on_hosts(self, hosts, list_of_command_strings, max_parallel=10,
+                     stop_on_failure=True):
+        """Runs a list of commands on many hosts concurrently, over pooled
+        connections that stay open for later calls. Each command is limited
+        by the wrapper's command_timeout, and cancel() stops the run.
+
+        Args:
+            hosts (List[str]): Hosts to run on.
+            list_of_command_strings (List[str]): Commands, run in order on
+                every host.
+            max_parallel (int): Maximum number of hosts worked on at once.
+                Defaults to 10.
+            stop_on_failure (bool): Stop a host's list at its first failing
+                command. Defaults to True.
+
+        Returns:
+            OrderedDict: Maps each host to the CommandResults of the
+                commands that ran there.
+        """
+        if self.connection_pool is None:
+            self.connection_pool = ConnectionPool()
+        for host in hosts:
+            self._log("{host}: {count} commands".format(
+                host=host, count=len(list_of_command_strings)))
+        run, timer = self._start_run(None)
+        try:
+            return run_on_hosts(hosts, list_of_command_strings,
+                                self.connection_pool, max_parallel=max_parallel,
+                                stop_on_failure=stop_on_failure,
+                                on_result=self._record, timeout=self.command_timeout,
+                                processes=run)
+        finally:
+            self._finish_run(run, timer)
+
+    def run_sweep(self, parameter_sweep, jobs=1, resume=True, resources=None,
+                  run_timeout=None):
+        """Runs every command of a parameter sweep, jobs at a time.
+
+        Args:
+            parameter_sweep (ParameterSweep): The template and parameter
+                values to expand.
+            jobs (int): Maximum number of commands running at once.
+                Defaults to 1.
+            resume (bool): Skip parameter sets whose output file already
+                exists. Defaults to True.
+            resources (ResourcePool): Only start a command while the cores
+                and memory implied by its num_threads or memory arguments
+                are free.
+            run_timeout (float): Seconds the whole sweep may take before
+                everything in flight is cancelled.
+
+        Returns:
+            generator: SweepResult tuples keyed by parameter tuple, yielded
+                as each command finishes.
+        """
+        run, timer = self._start_run(run_timeout)
+        try:
+            for sweep_result in parameter_sweep.run(self._in_run(run, self._run_command),
+                                                    jobs=jobs, resume=resume,
+                                                    resources=resources, cancellation=run,
+                                                    resolve_path=self._path):
+                yield sweep_result
+        finally:
+            self._finish_run(run, timer)
+
+    def install(self, command_filename, jobs=1, stop_on_failure=False,
+                batch_packages=False, journal_filename="", resume=False,
+                resources=None, run_timeout=None,
+                plan_cache_directory=""):
+        """Compiles command_filename into an execution plan and then runs
+        each install command. Plain files run sequentially; see
+        parse_command_lines for the "&" and "[name <- deps]" syntax that lets
+        independent commands run concurrently, and plan.read_command_lines
+        for continuations and includes.
 
         Args:
             command_filename (str): Name of file with a list of shell commands
             on each line.
-        """
-        command_list = self.load_commands_from_text_file(command_filename)
-        self.run_list_of_commands(command_list)
+            jobs (int): Maximum number of commands running at the same time.
+                Defaults to 1.
+            stop_on_failure (bool): Stop starting new commands once one exits
+                non-zero. Defaults to False.
+            batch_packages (bool): Batch and skip redundant apt-get work; see
+                run_command_steps. The plan also drops repeated apt-get
+                updates, already requested packages and no-op steps; see
+                plan.optimize_steps. Defaults to False.
+            journal_filename (str): Checkpoint journal to record progress in.
+            resume (bool): Skip steps that already succeeded according to
+                the journal; see run_command_steps. Defaults to False.
+            resources (ResourcePool): Reserve cores and memory per command;
+                see run_command_steps.
+            run_timeout (float): Seconds the whole file may take; see
+                run_command_steps.
+            plan_cache_directory (str): Where compiled plans are cached by
+                the file's content hash, e.g. plan.DEFAULT_CACHE_DIRECTORY,
+                or "" for no cache. Defaults to "".
 
+        Returns:
+            OrderedDict: Maps step id to CommandResult for every step that
+                ran.
+        """
+        execution_plan = plan.compile_plan(command_filename, optimize=batch_packages,
+                                           cache_directory=plan_cache_directory)
+        for step_id in execution_plan.dropped:
+            self._log("dropping {id}: redundant".format(id=step_id))
+        return self.run_command_steps(execution_plan.steps, jobs=jobs,
+                                      stop_on_failure=stop_on_failure,
+                                      batch_packages=batch_packages,
+                                      journal_filename=journal_filename,
+                                      resume=resume, resources=resources,
+                                      run_timeout=run_timeout)
+
+    @_local_only
     def change_permissions(self, permission_code, directory_name,
-                           enable_recursion):
+                           enable_recursion, jobs=None):
 
-        """Uses chmod to change permissions on the specified directory.
+        """Changes permissions on the specified directory, like chmod, but
+        only touches entries whose mode actually differs.
 
         Args:
             permission_code (str): Code used for allocating file/directory
@@ -144,58 +758,74 @@ class OperationWrapper(object):
                 edit permissions on.
             enable_recursion (bool): Enable recursion to apply the permission
                 code to all files/folders within the directory
+            jobs (int): Number of directories processed at once. Defaults to
+                the ThreadPoolExecutor default.
 
         Returns:
-            str:: A formatted chmod command string.
+            ChangeStats: How many entries were examined and changed.
         """
-        if enable_recursion:
-            command = "chmod {code} {dir}".format(code=permission_code,
-                                                  dir=directory_name)
-        else:
-            command = "chmod {code} {dir} -R".format(code=permission_code,
-                                                     dir=directory_name)
-        return self.start_blocking_process(command_string=command)
+        self._log("change_permissions {code} {dir}".format(code=permission_code,
+                                                           dir=directory_name))
+        return permissions.change_tree(self._path(directory_name), mode=permission_code,
+                                       recursive=enable_recursion, jobs=jobs)
 
-    def change_group(self, group_name, directory_name, enable_recursion):
+    def _resolve_gid(self, group_name):
+        if str(group_name).isdigit():
+            return int(group_name)
+        return self.account_index.group_by_name(group_name).gid
 
-        """Changes user group on the specified directory.
+    @_local_only
+    def change_group(self, group_name, directory_name, enable_recursion, jobs=None):
+
+        """Changes user group on the specified directory, like chgrp, but
+        only touches entries whose group actually differs.
 
         Args:
-            group_name (str): The name of the user group.
+            group_name (str): The name or gid of the user group.
             directory_name (str): The name of the directory.
             enable_recursion (bool): Enable recursion to apply the permission
                 code to all files/folders within the directory
-        
+            jobs (int): Number of directories processed at once.
+
         Returns:
-            str: A formatted chgrp command
+            ChangeStats: How many entries were examined and changed.
+
+        Raises:
+            KeyError: If the group does not exist.
         """
-        if enable_recursion:
-            command = "chgrp {grp} {dir}".format(grp=group_name,
-                                                 dir=directory_name)
-        else:
-            command = "chgrp {grp} {dir} -R".format(grp=group_name,
-                                                    dir=directory_name)
-        return self.start_blocking_process(command_string=command)
+        self._log("change_group {grp} {dir}".format(grp=group_name, dir=directory_name))
+        return permissions.change_tree(self._path(directory_name),
+                                       gid=self._resolve_gid(group_name),
+                                       recursive=enable_recursion, jobs=jobs)
 
-    def change_owner(self, new_owner, directory_name, enable_recursion):
-        """Changes ownership of the specified directory.
+    @_local_only
+    def change_owner(self, new_owner, directory_name, enable_recursion, jobs=None):
+        """Changes ownership of the specified directory, like chown, but
+        only touches entries whose owner actually differs.
 
         Args:
-             new_owner (str): User to be assigned to the specified directory.
+             new_owner (str): User to be assigned to the specified directory,
+                as a name or uid, optionally followed by ":group".
              directory_name (str): Directory to be modified.
              enable_recursion (bool): Enable recursion to apply the owner to
                 all files and folders within the directory.
+             jobs (int): Number of directories processed at once.
 
         Returns:
-            str: A formatted chown command.
+            ChangeStats: How many entries were examined and changed.
+
+        Raises:
+            KeyError: If the user or group does not exist.
         """
-        if enable_recursion:
-            command = "chown {own} {dir}".format(own=new_owner,
-                                                 dir=directory_name)
+        user_name, _, group_name = str(new_owner).partition(":")
+        if user_name.isdigit():
+            uid = int(user_name)
         else:
-            command = "chgrp {own} {dir} -R".format(own=new_owner,
-                                                    dir=directory_name)
-        return self.start_blocking_process(command_string=command)
+            uid = self.account_index.user_by_name(user_name).uid
+        gid = self._resolve_gid(group_name) if group_name else -1
+        self._log("change_owner {own} {dir}".format(own=new_owner, dir=directory_name))
+        return permissions.change_tree(self._path(directory_name), uid=uid, gid=gid,
+                                       recursive=enable_recursion, jobs=jobs)
 
     def add_group(self, group_name):
         """Creates a new group account with default values.
@@ -207,20 +837,34 @@ class OperationWrapper(object):
             str: A formatted groupadd command.
         """
         command = "groupadd {name}".format(name=group_name)
-        return self.start_blocking_process(command_string=command)
+        output = self.start_blocking_process(command_string=command)
+        self._invalidate_accounts()
+        return output
+
+    def _invalidate_accounts(self):
+        if self.query_cache is not None:
+            self.query_cache.invalidate("list_all_users", "list_all_groups_on_system",
+                                        "list_user_groups", "list_my_groups")
 
+    @_local_only
+    @cached_query
     def list_my_groups(self):
-        """Lists the groups the current user belongs to.
+        """Lists the groups the current process belongs to.
 
         Returns:
             List(str): List of user's groups as strings.
         """
-        command = "groups"
+        gids = [os.getegid()] + [gid for gid in os.getgroups() if gid != os.getegid()]
+        return [self._group_name(gid) for gid in gids]
 
-        results = self.start_blocking_process(command_string=command)
-        results = str(results).rstrip()
-        return results.split(" ")
+    def _group_name(self, gid):
+        try:
+            return self.account_index.group_by_gid(gid).name
+        except KeyError:
+            return str(gid)
 
+    @_local_only
+    @cached_query
     def list_user_groups(self, username, verbose=False):
         """Lists the groups a user belongs to.
 
@@ -232,39 +876,22 @@ class OperationWrapper(object):
 
         Returns:
             List(str) or dict: Groups the user belongs to.
+
+        Raises:
+            KeyError: If the user does not exist.
         """
+        user = self.account_index.user_by_name(username)
+        groups = self.account_index.groups_for_user(username)
         if verbose:
-            command = "id {user}".format(user=username)
-            raw_results = self.start_blocking_process(command_string=command)
-            raw_results = str(raw_results).rstrip().split(" ")
-
-            # parse uid
-            uid = raw_results[0].replace("uid=", "").replace(")", "")
-            uid_temp = uid.split("(")
-            uid = {uid_temp[0]: uid_temp[1]}
-
-            # parse gid
-            gid = raw_results[1].replace("gid=", "").replace(")", "")
-            gid_temp = gid.split("(")
-            gid = {gid_temp[0]: gid_temp[1]}
-
-            # parse groups
-            groups_raw = raw_results[2].replace("groups=",
-                                                "").replace(")", "").split(",")
-            groups = {}
-            for group in groups_raw:
-                group_temp = group.split("(")
-                groups[group_temp[0]] = group_temp[1]
-
-            final_results = {"username": username, "uid": uid, "gid": gid,
-                             "groups": groups}
+            # Same shape as the parsed output of the id command.
+            final_results = {
+                "username": username,
+                "uid": {str(user.uid): username},
+                "gid": {str(user.gid): self._group_name(user.gid)},
+                "groups": dict((str(group.gid), group.name) for group in groups)
+            }
         else:
-            string_to_remove = '{user} : '.format(user=username)
-            command = "groups {user}".format(user=username)
-            raw_results = self.start_blocking_process(command_string=command)
-            raw_results = str(raw_results.rstrip())
-            final_results = raw_results.replace(string_to_remove,
-                                                "").split(" ")
+            final_results = [group.name for group in groups]
 
         return final_results
 
@@ -284,7 +911,9 @@ class OperationWrapper(object):
             home=user_home_directory,
             user=username,
             groups=user_groups)
-        return self.start_blocking_process(command_string=command)
+        output = self.start_blocking_process(command_string=command)
+        self._invalidate_accounts()
+        return output
 
     def set_user_password(self, username, password):
         """Sets or changes password for the specified user.
@@ -300,73 +929,104 @@ class OperationWrapper(object):
                                                              password=password)
         return self.start_blocking_process(command_string=command)
 
+    @_local_only
+    @cached_query
     def list_all_groups_on_system(self):
         """Lists all groups on the OS.
 
         Returns:
-            str: Contents of /etc/group
+            List(GroupAccount): The entries of /etc/group.
         """
-        command = "cat /etc/group"
-        return self.start_blocking_process(command_string=command)
+        return self.account_index.groups()
 
+    @_local_only
+    @cached_query
     def list_all_users(self):
         """Lists all users on the system.
 
         Returns:
-            str: Output of /etc/passwd
+            List(UserAccount): The entries of /etc/passwd.
         """
-        command = "cat /etc/passwd"
+        return self.account_index.users()
 
-        return self.start_blocking_process(command_string=command)
-
-    def make_directory(self, full_dir_path):
+    @_local_only
+    def make_directory(self, full_dir_path, parents=False):
         """Makes a new file directory.
 
         Args:
             full_dir_path (str): path where the dir should be created.
-        """
-        mk_dir_command = "mkdir {dir}".format(dir=full_dir_path)
-        self.start_blocking_process(command_string=mk_dir_command)
+            parents (bool): Also create missing parent directories, and
+                succeed if the directory already exists, like mkdir -p.
+                Defaults to False.
 
-    def move_directory(self, from_directory, to_directory):
-        """Moves the specified directory.
+        Returns:
+            TreeStats: How many directories were created.
+        """
+        self._log("make_directory {dir}".format(dir=full_dir_path))
+        return trees.make_directory(self._path(full_dir_path), parents=parents)
+
+    @staticmethod
+    def _target_path(from_path, to_path):
+        # Like mv and cp: moving or copying onto an existing directory puts
+        # the source inside it.
+        if os.path.isdir(to_path):
+            return os.path.join(to_path, os.path.basename(os.path.normpath(from_path)))
+        return to_path
+
+    @_local_only
+    def move_directory(self, from_directory, to_directory, jobs=None):
+        """Moves the specified directory. Within a file system this is a
+        rename; across file systems the tree is copied and then removed.
 
         Args:
             from_directory (str): Directory to be moved.
-            to_directory (str): New location for directory.
+            to_directory (str): New location for directory. If it is an
+                existing directory, from_directory is moved inside it.
+            jobs (int): Worker threads for a cross-file-system move.
 
         Returns:
-            str: Output of mv command.
+            TreeStats: What was moved; see trees.move_tree.
         """
-        command = "mv {dir1} {dir2}".format(dir1=from_directory,
-                                            dir2=to_directory)
-        return self.start_blocking_process(command_string=command)
+        from_directory = self._path(from_directory)
+        target = self._target_path(from_directory, self._path(to_directory))
+        self._log("move_directory {dir1} {dir2}".format(dir1=from_directory, dir2=target))
+        return trees.move_tree(from_directory, target, jobs=jobs)
 
-    def copy_directory(self, from_directory, to_directory):
-        """Copies the specified directory.
+    @_local_only
+    def copy_directory(self, from_directory, to_directory, jobs=None):
+        """Copies the specified directory and everything in it, copying
+        files in parallel and inside the kernel where possible.
 
         Args:
             from_directory (str): Directory to be copied.
-            to_directory (str): New location for directory.
+            to_directory (str): New location for directory. If it is an
+                existing directory, the copy is made inside it.
+            jobs (int): Number of files copied at once. Defaults to the
+                ThreadPoolExecutor default.
 
         Returns:
-            str: Output of cp command.
+            TreeStats: Files, directories, symlinks and bytes copied.
         """
-        command = "cp {dir1} {dir2}".format(dir1=from_directory,
-                                            dir2=to_directory)
-        return self.start_blocking_process(command_string=command)
+        from_directory = self._path(from_directory)
+        target = self._target_path(from_directory, self._path(to_directory))
+        self._log("copy_directory {dir1} {dir2}".format(dir1=from_directory, dir2=target))
+        return trees.copy_tree(from_directory, target, jobs=jobs)
 
-    def remove_directory(self, directory_name):
-        """Removes the specified directory.
+    @_local_only
+    def remove_directory(self, directory_name, jobs=None):
+        """Removes the specified directory and everything in it.
 
         Args:
             directory_name (str): Directory to be removed.
+            jobs (int): Number of directories emptied at once. Defaults to
+                the ThreadPoolExecutor default.
 
         Returns:
-            str: Output of rm command.
+            TreeStats: Files, directories and symlinks removed, and the bytes
+                the files took up.
         """
-        command = "rm {dir}".format(dir=directory_name)
-        return self.start_blocking_process(command_string=command)
+        self._log("remove_directory {dir}".format(dir=directory_name))
+        return trees.remove_tree(self._path(directory_name), jobs=jobs)
 
     def print_working_directory(self):
         """Gets the current working directory.
@@ -378,7 +1038,12 @@ class OperationWrapper(object):
         return self.start_blocking_process(command_string=command)
 
     def change_working_directory(self, directory_name):
-        """Changes the current working directory.
+        """Changes the working directory later commands run in. Relative
+        paths given to later calls are resolved against it too.
+
+        In a persistent shell or over a transport's shell, cd runs there.
+        Otherwise the directory is kept as working_directory, and every
+        command the wrapper spawns starts in it.
 
         Args:
              directory_name (str): Directory to move into.
@@ -387,130 +1052,221 @@ class OperationWrapper(object):
             str: Output of cd command.
         """
         command = "cd {dir}".format(dir=directory_name)
-        return self.start_blocking_process(command_string=command)
+        if self.transport is not None or self.session is not None:
+            return self.start_blocking_process(command_string=command)
+        # cd's error, if any, goes to stderr as it would in a shell.
+        output = self.start_blocking_process("{cd} && pwd".format(cd=command))
+        if output:
+            self.working_directory = output[:-1]
+        return ""
 
     def head_file(self, filename, number_of_lines):
         """Returns the specified number of lines from the beginning of a file.
+        With a transport, head runs there.
 
         Args:
              filename (str): Name of file to parse.
              number_of_lines (int): Number of lines to return.
-             
+
         Returns:
             str: The beginning of the specified file.
         """
-        command = "head -n {lines} {file}".format(file=filename,
-                                                  lines=number_of_lines)
-        return self.start_blocking_process(command_string=command)
+        if self.transport is not None:
+            return self.start_blocking_process("head -n {lines} {file}".format(
+                lines=int(number_of_lines), file=shlex.quote(filename)))
+        self._log("head_file {lines} {file}".format(file=filename,
+                                                    lines=number_of_lines))
+        return files.head_file(self._path(filename), number_of_lines)
 
     def tail_file(self, filename, number_of_lines):
         """Returns the specified number of lines from the end of a file.
+        Only the end of the file is read, however large it is. With a
+        transport, tail runs there.
 
         Args:
              filename (str): Name of file to parse.
              number_of_lines (int): Number of lines to return.
-             
+
         Returns:
             str: The end of the specified file.
         """
-        command = "tail -n {lines} {file}".format(file=filename,
-                                                  lines=number_of_lines)
-        return self.start_blocking_process(command_string=command)
-
-    def view_file_contents(self, filename):
+        if self.transport is not None:
+            return self.start_blocking_process("tail -n {lines} {file}".format(
+                lines=int(number_of_lines), file=shlex.quote(filename)))
+        self._log("tail_file {lines} {file}".format(file=filename,
+                                                    lines=number_of_lines))
+        return files.tail_file(self._path(filename), number_of_lines)
+
+    def view_file_contents(self, filename, chunk_size=None, use_mmap=False):
         """Returns a text representation of the entire contents of a file.
 
         Args:
             filename (str): File whose contents should be returned.
-            
-        Returns:
-            str: String representation of file.
-        """
+            chunk_size (int): If given, return an iterator over pieces of the
+                file of roughly this many bytes instead of one string.
+            use_mmap (bool): If True, return a read-only memory map of the
+                raw file instead of decoded text. Defaults to False.
 
-        command = "cat {file}".format(file=filename)
-        return self.start_blocking_process(command_string=command)
+        Returns:
+            str, iterator or mmap: String representation of file, or a lazy
+                view of it when chunk_size or use_mmap is set.
 
-    def list_files(self, verbose=False):
+        Raises:
+            TransportUnsupportedError: If chunk_size or use_mmap is set and
+                the wrapper has a transport. Otherwise cat runs there.
+        """
+        if self.transport is not None:
+            if use_mmap or chunk_size:
+                raise TransportUnsupportedError(
+                    "view_file_contents can only map or chunk files on this machine")
+            return self.start_blocking_process("cat {file}".format(file=shlex.quote(filename)))
+        self._log("view_file_contents {file}".format(file=filename))
+        filename = self._path(filename)
+        if use_mmap:
+            return files.map_file(filename)
+        if chunk_size:
+            return files.iter_file_chunks(filename, chunk_size)
+        return files.read_file(filename)
+
+    def list_files(self, verbose=False, directory=".", recursive=False,
+                   jobs=1):
         """Returns a listing of the files in the current working directory.
 
         Args:
-             verbose (bool): If True, returns a dictionary including each
-                item's permissions, score, owner, group, size, month, day,
-                time, and filename. Otherwise, returns only a list of names of
-                contents. Defaults to False.
+             verbose (bool): If True, returns a generator of FileEntry tuples
+                with each item's path, name, type, size, mtime, mode, uid,
+                gid, inode and link count. Otherwise, returns only a sorted
+                list of names of contents. Defaults to False.
+             directory (str): Directory to list. Defaults to the current one.
+             recursive (bool): Walk the whole tree. Names are then given
+                relative to directory. Defaults to False.
+             jobs (int): Number of directories read at once when recursive.
+                Defaults to 1.
         Returns:
-            List(str) or dict: Contents of current directory.
+            List(str) or generator: Contents of the directory.
+
+        Raises:
+            TransportUnsupportedError: If verbose is set and the wrapper has
+                a transport. Otherwise find runs there.
         """
+        if self.transport is not None:
+            if verbose:
+                raise TransportUnsupportedError("list_files can only stat files on this machine")
+            # Hidden entries are left out and not descended into, as below.
+            output = self.start_blocking_process(
+                "cd {dir} && find . -mindepth 1 {depth}-name '.*' -prune -o -print".format(
+                    dir=shlex.quote(directory), depth="" if recursive else "-maxdepth 1 "))
+            return sorted(line[2:] for line in output.splitlines())
+        self._log("list_files {dir}".format(dir=directory))
+        directory = self._path(directory)
+        entries = files.scan_directory(directory, recursive=recursive, jobs=jobs)
         if verbose:
-            command = "ls -ll"
-            raw_results = self.start_blocking_process(command_string=command)
-            result_lines = str(raw_results).split("\n")
-            result_lines.pop()
-
-            total = result_lines.pop(0)
-            total = total.replace("total ", "")
-            final_lines = []
-            for line in result_lines:
-                split_line = line.split(" ")
-                filtered_line = list(filter(lambda a: a != "",
-                                            split_line))  # remove all ""
-                final_line = {
-                    "permissions": filtered_line[0],
-                    "score": filtered_line[1],
-                    "owner": filtered_line[2],
-                    "group": filtered_line[3],
-                    "size": filtered_line[4],
-                    "month": filtered_line[5],
-                    "day": filtered_line[6],
-                    "time": filtered_line[7],
-                    "filename": filtered_line[8]
-                }
-                final_lines.append(final_line)
-
-            final_results = {"total": total, "files": final_lines}
+            return entries
+        return sorted(os.path.relpath(entry.path, directory) for entry in entries)
 
-        else:
-            command = "ls"
-            raw_results = self.start_blocking_process(command_string=command)
-            final_results = str(raw_results).split("\n")
-            final_results.remove("")
-        return final_results
+    @_local_only
+    def web_get(self, url, filename=None, jobs=4, cache_directory="", expected_sha256=None,
+                progress=None):
+        """Downloads one or more files from the Internet.
 
-    def web_get(self, url):
-        """Downloads a file from the Internet.
+        Several URLs are fetched at once over kept-alive connections, large
+        files as parallel range requests, and an interrupted download resumes
+        where it stopped. Given a cache_directory, downloads are kept in a
+        content-addressed cache, so fetching an unchanged URL again costs one
+        conditional request. See download.Downloader.
 
         Args:
-             url (str): URL to retrieve.
+             url (str or List[str]): URL, or list of URLs, to retrieve.
+             filename (str or List[str]): Where to save each download.
+                Defaults to the last part of the URL's path, like wget.
+             jobs (int): URLs downloaded at once. Defaults to 4.
+             cache_directory (str): Download cache, e.g.
+                download.DEFAULT_CACHE_DIRECTORY, or "" for none. Defaults
+                to "".
+             expected_sha256 (str or List[str]): Digest each download must
+                have. A cached file with this digest is used without any
+                request.
+             progress (callable): Called as progress(url, bytes_done, total).
 
         Returns:
-            str: Output of wget command.
-        """
-        command = "wget {url}".format(url=url)
-        return self.start_blocking_process(command_string=command)
+            DownloadResult or List[DownloadResult]: One per URL.
 
-    def remote_sync(self, from_directory, to_directory):
-        """Copies a directory remotely.
+        Raises:
+            DownloadError: If a download fails or doesn't match its digest.
+        """
+        single = isinstance(url, str)
+        urls = [url] if single else list(url)
+        filenames = [filename] if single else list(filename or [None] * len(urls))
+        digests = [expected_sha256] if single else list(expected_sha256 or [None] * len(urls))
+        downloads = [(u, self._path(f or download.default_filename(u)), d)
+                     for u, f, d in zip(urls, filenames, digests)]
+        for u, f, _ in downloads:
+            self._log("web_get {url} {filename}".format(url=u, filename=f))
+
+        if self.http_pool is None:
+            self.http_pool = download.HTTPConnectionPool()
+        downloader = download.Downloader(cache_directory, jobs=jobs, pool=self.http_pool,
+                                         progress=progress)
+        results = downloader.download_many(downloads)
+        return results[0] if single else results
+
+    def remote_sync(self, from_directory, to_directory, jobs=None, checksum=False,
+                    delete=False, delta_threshold=None,
+                    manifest_directory=""):
+        """Copies a directory, transferring only files that are new or have
+        changed since the last sync. See sync.TreeSync for how changes are
+        found.
+
+        As with rsync, a source ending in "/" has its contents synced into
+        to_directory; otherwise to_directory/<name> is synced. Paths in
+        rsync's host:path form are still handed to rsync, as is every sync
+        when the wrapper has a transport.
 
         Args:
             from_directory (str): Name of source directory.
             to_directory (str): Name of destination for directory.
+            jobs (int): Number of files copied at once.
+            checksum (bool): Also compare file contents. Defaults to False.
+            delete (bool): Remove destination files that are not in the
+                source. Defaults to False.
+            delta_threshold (int): Update existing files of at least this
+                many bytes block by block. Defaults to None.
+            manifest_directory (str): Where the destination's manifest is
+                kept between syncs, e.g. sync.DEFAULT_MANIFEST_DIRECTORY, or
+                "" for none. Defaults to "".
 
         Returns:
-            str: Output of rsync command.
+            SyncStats or str: What the sync did, or rsync's output when
+                rsync ran.
         """
-        command = "rsync -a {dir1} {dir2}".format(dir1=from_directory,
-                                                  dir2=to_directory)
-        return self.start_blocking_process(command_string=command)
-
+        if self.transport is not None or _REMOTE_PATH.match(from_directory) or \
+                _REMOTE_PATH.match(to_directory):
+            command = "rsync -a {delete}{dir1} {dir2}".format(
+                delete="--delete " if delete else "", dir1=from_directory, dir2=to_directory)
+            return self.start_blocking_process(command_string=command)
+
+        from_directory = self._path(from_directory)
+        to_directory = self._path(to_directory)
+        if not from_directory.endswith(os.sep):
+            to_directory = os.path.join(to_directory, os.path.basename(from_directory))
+        self._log("remote_sync {dir1} {dir2}".format(dir1=from_directory, dir2=to_directory))
+        return sync.sync_tree(from_directory, to_directory, jobs=jobs, checksum=checksum,
+                              delete=delete, delta_threshold=delta_threshold,
+                              manifest_directory=manifest_directory)
+
+    @_local_only
+    @cached_query
     def network_addresses(self):
-        """Configures kernel-resident network interface.
+        """Lists network interfaces with their addresses and traffic
+        counters, read in-process rather than from ifconfig.
 
         Returns:
-            str: Output of ifconfig command.
+            List[NetworkInterface]: One per interface.
         """
-        command = "ifconfig"
-        return self.start_blocking_process(command_string=command)
+        self._log("network_addresses")
+        return sysinfo.network_interfaces()
 
+    @cached_query
     def list_hardware(self):
         """Gets hardware configuration of machine.
 
@@ -520,65 +1276,108 @@ class OperationWrapper(object):
         command = "lshw"
         return self.start_blocking_process(command_string=command)
 
-    def disk_free_space(self):
-        """Looks up free disk space on the machine.
+    @_local_only
+    @cached_query
+    def disk_free_space(self, paths=None):
+        """Looks up free disk space on the machine, like df, using
+        os.statvfs.
+
+        Args:
+             paths (List[str]): Paths whose file systems to report. Defaults
+                to every mounted file system with a size.
 
         Returns:
-            str: Output of df command.
+            List[DiskUsage]: Sizes in bytes per file system.
         """
-        command = "df -h"
-        return self.start_blocking_process(command_string=command)
+        self._log("disk_free_space")
+        return sysinfo.disk_usage(None if paths is None else [self._path(path) for path in paths])
 
+    @_local_only
+    @cached_query
     def operating_system_information(self):
-        """Gets operating system information.
+        """Gets operating system information from /etc/os-release.
 
         Returns:
-            str: Output of lsb_release command.
+            OSRelease: Distribution ID, name, version and codename.
         """
-        command = "lsb_release -a"
-        return self.start_blocking_process(command_string=command)
+        self._log("operating_system_information")
+        return sysinfo.os_release()
 
+    @_local_only
+    @cached_query
     def operating_system_kernel_information(self):
-        """Gets OS kernel information.
+        """Gets OS kernel information, as printed by uname -a.
 
         Returns:
-            str: Output of uname command.
+            KernelInfo: Kernel name, host name, release, version and machine.
         """
-        command = "uname -a"
-        return self.start_blocking_process(command_string=command)
+        self._log("operating_system_kernel_information")
+        return sysinfo.kernel_information()
 
-    def md5_checksum(self, filename):
+    def md5_checksum(self, filename, cache_filename=""):
         """Gets the MD5 checksum of a file.
 
         Args:
             filename (str): File to find checksum for.
+            cache_filename (str): Optional checksum cache; see
+                checksum_files.
 
         Returns:
-            str: Output of md5sum command.
+            FileDigest: The filename, algorithm, hex digest and size.
         """
-        command = "md5sum {file}".format(file=filename)
-        return self.start_blocking_process(command_string=command)
+        return self.checksum_files([filename], "md5", cache_filename=cache_filename)[0]
 
-    def sha1_checksum(self, filename):
+    def sha1_checksum(self, filename, cache_filename=""):
         """Gets the SHA1 checksum of a file.
 
         Args:
             filename (str): File to find checksum for.
+            cache_filename (str): Optional checksum cache; see
+                checksum_files.
 
         Returns:
-            str: Output of sha1sum command.
+            FileDigest: The filename, algorithm, hex digest and size.
         """
-        command = "sha1sum {file}".format(file=filename)
-        return self.start_blocking_process(command_string=command)
+        return self.checksum_files([filename], "sha1", cache_filename=cache_filename)[0]
 
-    def update_system_packages(self):
-        """Synchronizes index files of packages on machine.
+    @_local_only
+    def checksum_files(self, filenames, algorithm="md5", jobs=None,
+                       cache_filename=""):
+        """Checksums many files in parallel.
+
+        Args:
+            filenames (List[str]): Files to find checksums for.
+            algorithm (str): Any hashlib algorithm name. Defaults to "md5".
+            jobs (int): Number of files hashed at once. Defaults to a thread
+                per core (capped by the standard library).
+            cache_filename (str): If given, digests are remembered in this
+                file and reused for files whose inode, size and mtime have not
+                changed since they were last hashed.
 
         Returns:
-            str: Output of apt-get update command.
+            List[FileDigest]: One digest per file, in the order given.
         """
-        command = "apt-get update"
-        return self.start_blocking_process(command_string=command)
+        self._log("checksum_files {algorithm} x{count}".format(
+            algorithm=algorithm, count=len(filenames)))
+        cache = checksum.ChecksumCache(cache_filename) if cache_filename else None
+        digests = checksum.checksum_files([self._path(filename) for filename in filenames],
+                                          algorithm, jobs=jobs, cache=cache)
+        if cache is not None:
+            cache.save()
+        return digests
+
+    def update_system_packages(self, force=False):
+        """Synchronizes index files of packages on machine. Skipped while the
+        indexes are younger than package_manager.update_max_age seconds and
+        no apt source has changed since.
+
+        Args:
+            force (bool): Update even if the indexes are fresh.
+
+        Returns:
+            str: Output of apt-get update command, or "" if skipped.
+        """
+        return self.package_manager.update(force=force).stdout
 
     def upgrade_system_packages(self):
         """Fetches newest versions of packages on machine.
@@ -590,22 +1389,48 @@ class OperationWrapper(object):
         return self.start_blocking_process(command_string=command)
 
     def install_system_packages(self, package_name):
-        """Installs a software package.
+        """Installs one or more software packages in a single apt-get
+        transaction. Packages dpkg already lists as installed are left out,
+        and apt-get isn't run at all if nothing is missing.
 
         Args:
-             package_name (str): Name of package to install.
+             package_name (str or List[str]): Name of package to install, or
+                a list of names.
 
         Returns:
-            str: Output of apt-get install command.
+            str: Output of apt-get install command, or "" if skipped.
         """
-        command = "apt-get install {name}".format(name=package_name)
-        return self.start_blocking_process(command_string=command)
+        if isinstance(package_name, str):
+            package_name = package_name.split()
+        return self.package_manager.install(package_name,
+                                            command_prefix="apt-get install").stdout
 
+    @_local_only
     def system_uptime(self):
-        """Returns duration the system has been online.
+        """Returns duration the system has been online, from /proc/uptime.
 
         Returns:
-            str: System uptime.
+            Uptime: Seconds up and idle, and the load averages.
         """
-        command = "uptime"
-        return self.start_blocking_process(command_string=command)
+        self._log("system_uptime")
+        return sysinfo.uptime()
+
+    @_local_only
+    def sample_system(self, interval=10.0, capacity=360, collectors=None):
+        """Starts sampling disk space, uptime and network counters in the
+        background into a ring buffer, for health checks that shouldn't
+        spawn processes. The sampler is stopped when the wrapper exits.
+
+        Args:
+             interval (float): Seconds between samples. Defaults to 10.
+             capacity (int): Samples kept. Defaults to 360.
+             collectors (dict): Name to collector function; see
+                sysinfo.SystemSampler.
+
+        Returns:
+            SystemSampler: The running sampler, also kept as self.sampler.
+        """
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.sampler = sysinfo.SystemSampler(interval, capacity, collectors).start()
+        return self.sampler
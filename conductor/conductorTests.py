@@ -1,5 +1,18 @@
+import asyncio
+import hashlib
+import http.server
+import json
+import os
+import shlex
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
 import conductor
+import conductor.__main__
 
 
 class TestCommandStringBuilder(unittest.TestCase):
@@ -73,6 +86,942 @@ class TestCommandStringBuilder(unittest.TestCase):
             self.assertIn(param, actual_string_str_array)
 
 
+class TestCommandTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.software_params = {"db": "16s", "out": "results.xml", "num_threads": 2, "outfmt": 5}
+        self.template = conductor.CommandTemplate("blastn", append="/test/dir", flags_list=["no_greedy"],
+                                                  argument_order=["query"])
+
+    def test_render_is_deterministic(self):
+        expected = "blastn -db 16s -num_threads 2 -out results.xml -outfmt 5 -no_greedy /test/dir"
+
+        self.assertEqual(expected, self.template.render(self.software_params))
+        self.assertEqual(expected, self.template.render(dict(reversed(list(self.software_params.items())))))
+
+    def test_argument_order_and_quoting(self):
+        command = self.template.render({"out": "my results.xml", "query": "q.fa"})
+
+        self.assertEqual("blastn -query q.fa -out 'my results.xml' -no_greedy /test/dir", command)
+
+    def test_render_argv(self):
+        template = conductor.CommandTemplate("python3 -c", argument_delimiter="--")
+        argv = template.render_argv({"x": "it's"})
+
+        self.assertEqual(["python3", "-c", "--x", "it's"], argv)
+
+    def test_render_many_and_run_without_shell(self):
+        template = conductor.CommandTemplate("printf")
+        argvs = template.render_many([{"v": "x"}, {"v": "$HOME"}], argv=True)
+        result = conductor.OperationWrapper().start_non_blocking_process(["echo"] + argvs[1][1:]).result()
+
+        self.assertEqual([["printf", "-v", "x"], ["printf", "-v", "$HOME"]], argvs)
+        self.assertEqual("-v $HOME\n", result.stdout)
+
+
+class TestTimeoutsAndCancellation(unittest.TestCase):
+
+    def test_result_stops_on_timeout(self):
+        handle = conductor.ProcessHandle.spawn("echo started; sleep 30")
+
+        started = time.time()
+        result = handle.result(timeout=0.3, stop_on_timeout=True, grace_period=1)
+
+        self.assertLess(time.time() - started, 2)
+        self.assertTrue(result.timed_out)
+        self.assertEqual(-signal.SIGTERM, result.exit_code)
+        self.assertEqual("started\n", result.stdout)
+
+    def test_stop_escalates_to_sigkill(self):
+        handle = conductor.ProcessHandle.spawn("trap '' TERM; sleep 30")
+        time.sleep(0.1)
+
+        self.assertEqual(-signal.SIGKILL, handle.stop(grace_period=0.3))
+
+    def test_blocking_process_timeout_reaches_whole_group(self):
+        ops = conductor.OperationWrapper(command_timeout=0.3, grace_period=1)
+
+        started = time.time()
+        ops.start_blocking_process("sleep 30 | cat")
+
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual([], ops.processes.running())
+
+    def test_cancel_tears_down_running_steps(self):
+        steps = conductor.parse_command_lines(["& sleep 30", "& sleep 30", "echo never"])
+        ops = conductor.OperationWrapper()
+        threading.Timer(0.3, ops.cancel).start()
+
+        started = time.time()
+        results = ops.run_command_steps(steps, jobs=2)
+
+        self.assertLess(time.time() - started, 3)
+        self.assertEqual(["line1", "line2"], sorted(results))
+        self.assertTrue(all(result.exit_code == -signal.SIGTERM for result in results.values()))
+
+    def test_run_timeout(self):
+        steps = conductor.parse_command_lines(["sleep 30", "echo never"])
+        ops = conductor.OperationWrapper()
+
+        results = ops.run_command_steps(steps, run_timeout=0.3)
+
+        self.assertEqual(["line1"], list(results))
+        self.assertTrue(ops.last_run.cancelled)
+        self.assertFalse(ops.processes.cancelled)
+        again = ops.run_command_steps(conductor.parse_command_lines(["echo again"]))
+        self.assertEqual("again\n", again["line1"].stdout)
+
+    def test_commands_run_after_cancellation(self):
+        ops = conductor.OperationWrapper(grace_period=1)
+        template = conductor.CommandTemplate("sh -c 'sleep 0.1' sh")
+        sweep = conductor.ParameterSweep(template, {"n": [1, 2, 3]})
+
+        ops.cancel()
+        self.assertEqual("hi\n", ops.start_blocking_process("sleep 0.2; echo hi"))
+
+        ops.run_command_steps(conductor.parse_command_lines(["sleep 30"]), run_timeout=0.2)
+        self.assertEqual("hi\n", ops.start_blocking_process("sleep 0.2; echo hi"))
+
+        for _ in ops.run_sweep(sweep, jobs=2):
+            break
+        self.assertEqual("hi\n", ops.start_blocking_process("sleep 0.2; echo hi"))
+        self.assertFalse(ops.processes.cancelled)
+
+
+class TestTreeOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.ops = conductor.OperationWrapper()
+        self.source = os.path.join(self.work_dir.name, "source")
+        self.payload = os.urandom(3 * 1024 * 1024)
+        os.makedirs(os.path.join(self.source, "a", "b"))
+        with open(os.path.join(self.source, "a", "b", "big.bin"), "wb") as big:
+            big.write(self.payload)
+        with open(os.path.join(self.source, "run.sh"), "w") as script:
+            script.write("echo hi\n")
+        os.chmod(os.path.join(self.source, "run.sh"), 0o750)
+        os.symlink("run.sh", os.path.join(self.source, "link"))
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_copy_directory(self):
+        target = os.path.join(self.work_dir.name, "target")
+        os.mkdir(target)
+
+        stats = self.ops.copy_directory(self.source, target, jobs=4)
+
+        copy = os.path.join(target, "source")
+        self.assertEqual(conductor.TreeStats(files=2, directories=3, symlinks=1,
+                                             bytes=len(self.payload) + 8, skipped=0), stats)
+        with open(os.path.join(copy, "a", "b", "big.bin"), "rb") as big:
+            self.assertEqual(self.payload, big.read())
+        self.assertEqual(0o750, os.stat(os.path.join(copy, "run.sh")).st_mode & 0o777)
+        self.assertEqual("run.sh", os.readlink(os.path.join(copy, "link")))
+        self.assertEqual(os.stat(self.source).st_mtime_ns, os.stat(copy).st_mtime_ns)
+
+    def test_copy_refuses_to_overwrite_itself(self):
+        script = os.path.join(self.source, "run.sh")
+
+        self.assertRaises(ValueError, self.ops.copy_directory, self.source, os.path.join(self.source, "a"))
+        self.assertRaises(shutil.SameFileError, conductor.trees.copy_file, script, script)
+        self.assertEqual(8, os.path.getsize(script))
+
+    def test_remove_directory_does_not_follow_symlinks(self):
+        outside = os.path.join(self.work_dir.name, "outside")
+        os.mkdir(outside)
+        os.symlink(outside, os.path.join(self.source, "a", "escape"))
+
+        stats = self.ops.remove_directory(self.source, jobs=4)
+
+        self.assertEqual((2, 3, 2), (stats.files, stats.directories, stats.symlinks))
+        self.assertFalse(os.path.lexists(self.source))
+        self.assertTrue(os.path.isdir(outside))
+
+    def test_make_and_move_directory(self):
+        nested = os.path.join(self.work_dir.name, "x", "y", "z")
+
+        self.assertEqual(3, self.ops.make_directory(nested, parents=True).directories)
+        self.assertEqual(0, self.ops.make_directory(nested, parents=True).directories)
+        self.assertRaises(FileExistsError, self.ops.make_directory, nested)
+
+        self.ops.move_directory(self.source, nested)
+        self.assertTrue(os.path.isfile(os.path.join(nested, "source", "run.sh")))
+        self.assertFalse(os.path.exists(self.source))
+
+
+class TestChangeTree(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.ops = conductor.OperationWrapper()
+        self.root = os.path.join(self.work_dir.name, "tree")
+        for directory in ("a", "b"):
+            os.makedirs(os.path.join(self.root, directory))
+            for n in range(3):
+                open(os.path.join(self.root, directory, "f{n}".format(n=n)), "w").close()
+        os.symlink("/etc/passwd", os.path.join(self.root, "a", "link"))
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def _mode(self, *parts):
+        return os.stat(os.path.join(self.root, *parts)).st_mode & 0o7777
+
+    def test_only_changes_what_differs(self):
+        os.chmod(os.path.join(self.root, "b", "f0"), 0o640)
+
+        first = self.ops.change_permissions("644", self.root, enable_recursion=True, jobs=2)
+        second = self.ops.change_permissions("644", self.root, enable_recursion=True, jobs=2)
+
+        self.assertEqual(9, first.examined)
+        self.assertEqual(0, second.changed)
+        self.assertEqual(0o644, self._mode("b", "f0"))
+
+    def test_recursion_flag(self):
+        self.ops.change_permissions("700", self.root, enable_recursion=False)
+
+        self.assertEqual(0o700, self._mode())
+        self.assertNotEqual(0o700, self._mode("a"))
+
+    def test_symbolic_codes(self):
+        self.ops.change_permissions("u=rw,go=r", self.root, enable_recursion=True)
+        self.ops.change_permissions("a+X,o-r", self.root, enable_recursion=True)
+
+        self.assertEqual(0o751, self._mode("a"))
+        self.assertEqual(0o640, self._mode("a", "f1"))
+        self.assertRaises(ValueError, conductor.permissions.parse_mode, "u+q")
+
+    @unittest.skipUnless(shutil.which("chmod"), "needs the chmod binary")
+    def test_codes_match_chmod(self):
+        codes = ["755", "0755", "00755", "644", "4755", "=r", "+w", "-x", "a=r", "u=rwx,go=",
+                 "g=u", "o+g", "u-s,g=o", "a+X", "=rwX", "u+s,g+s", "+t", "o=u-w", "go=rX"]
+        start_modes = [0o1777, 0o2755, 0o6775, 0o644, 0o600, 0o4711, 0o0]
+        target = os.path.join(self.root, "target")
+        for is_dir in (False, True):
+            for code in codes:
+                mode_for = conductor.permissions.parse_mode(code)
+                for start_mode in start_modes:
+                    if is_dir:
+                        os.mkdir(target)
+                    else:
+                        open(target, "w").close()
+                    os.chmod(target, start_mode)
+                    subprocess.call(["chmod", code, target], stderr=subprocess.DEVNULL)
+                    expected = os.stat(target).st_mode & 0o7777
+                    actual = mode_for(start_mode, is_dir)
+                    os.chmod(target, 0o700)
+                    if is_dir:
+                        os.rmdir(target)
+                    else:
+                        os.remove(target)
+                    self.assertEqual(oct(expected), oct(actual), (code, oct(start_mode), is_dir))
+        self.assertRaises(ValueError, conductor.permissions.parse_mode, "g=ur")
+        self.assertRaises(ValueError, conductor.permissions.parse_mode, "17777")
+
+    def test_change_owner_to_current_owner(self):
+        uid, gid = os.getuid(), os.getgid()
+
+        stats = self.ops.change_owner("{uid}:{gid}".format(uid=uid, gid=gid), self.root, True)
+        self.assertEqual(conductor.ChangeStats(9, 0), stats)
+
+    @unittest.skipUnless(os.getuid() == 0, "needs root to give files away")
+    def test_change_group_as_root(self):
+        stats = self.ops.change_group("54321", self.root, enable_recursion=True)
+        self.assertEqual(9, stats.changed)
+        self.assertEqual(54321, os.stat(os.path.join(self.root, "b", "f2")).st_gid)
+        self.assertNotEqual(54321, os.lstat(os.path.join(self.root, "a", "link")).st_gid)
+
+
+class TestTreeSync(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.ops = conductor.OperationWrapper()
+        self.source = os.path.join(self.work_dir.name, "data")
+        self.target = os.path.join(self.work_dir.name, "backup")
+        self.manifests = os.path.join(self.work_dir.name, "manifests")
+        os.makedirs(os.path.join(self.source, "sub"))
+        for name in ("a.txt", os.path.join("sub", "b.txt")):
+            self._write(name, name.encode())
+        os.symlink("a.txt", os.path.join(self.source, "link"))
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def _write(self, name, data, mtime=None):
+        path = os.path.join(self.source, name)
+        with open(path, "wb") as output:
+            output.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def _read(self, name):
+        with open(os.path.join(self.target, "data", name), "rb") as copy:
+            return copy.read()
+
+    def _sync(self, source, destination, **options):
+        return self.ops.remote_sync(source, destination, manifest_directory=self.manifests,
+                                    **options)
+
+    def test_only_changes_are_copied(self):
+        first = self._sync(self.source, self.target)
+        second = self._sync(self.source, self.target)
+        self._write("a.txt", b"changed", mtime=1000000)
+        third = self._sync(self.source, self.target)
+
+        self.assertEqual((2, 2), (first.files, first.copied))
+        self.assertEqual((0, 2), (second.copied, second.unchanged))
+        self.assertEqual((1, 7), (third.copied, third.bytes_copied))
+        self.assertEqual(b"changed", self._read("a.txt"))
+        self.assertEqual("a.txt", os.readlink(os.path.join(self.target, "data", "link")))
+        self.assertEqual(1000000, os.stat(os.path.join(self.target, "data", "a.txt")).st_mtime)
+
+    def test_destination_changes_are_repaired(self):
+        self._sync(self.source, self.target)
+        copy = os.path.join(self.target, "data")
+        os.remove(os.path.join(copy, "a.txt"))
+        with open(os.path.join(copy, "sub", "b.txt"), "wb") as edited:
+            edited.write(b"edited")
+        os.remove(os.path.join(copy, "link"))
+
+        stats = self._sync(self.source, self.target)
+
+        self.assertEqual((2, 0), (stats.copied, stats.unchanged))
+        self.assertEqual(b"a.txt", self._read("a.txt"))
+        self.assertEqual(os.path.join("sub", "b.txt").encode(), self._read(os.path.join("sub", "b.txt")))
+        self.assertEqual("a.txt", os.readlink(os.path.join(copy, "link")))
+        self.assertEqual(["a.txt", "link", "sub"], sorted(os.listdir(copy)))
+
+    def test_trailing_slash_and_delete(self):
+        contents = os.path.join(self.target, "contents")
+        self._sync(self.source + os.sep, contents)
+        os.remove(os.path.join(self.source, "sub", "b.txt"))
+        os.rmdir(os.path.join(self.source, "sub"))
+        os.mkdir(os.path.join(self.source, "a.txt.d"))
+
+        kept = self._sync(self.source + os.sep, contents)
+        self.assertTrue(os.path.exists(os.path.join(contents, "sub", "b.txt")))
+        deleted = self._sync(self.source + os.sep, contents, delete=True)
+
+        self.assertEqual(0, kept.deleted)
+        self.assertEqual(2, deleted.deleted)
+        self.assertFalse(os.path.exists(os.path.join(contents, "sub")))
+        self.assertTrue(os.path.isdir(os.path.join(contents, "a.txt.d")))
+
+    def test_checksum_catches_same_size_and_mtime(self):
+        self._write("a.txt", b"12345", mtime=1000000)
+        self._sync(self.source, self.target)
+        self._write("a.txt", b"54321", mtime=1000000)
+
+        self.assertEqual(0, self._sync(self.source, self.target).copied)
+        self.assertEqual(1, self._sync(self.source, self.target, checksum=True).copied)
+        self.assertEqual(b"54321", self._read("a.txt"))
+
+    def test_delta_rewrites_only_changed_blocks(self):
+        block = 64 * 1024
+        payload = bytearray(os.urandom(8 * block))
+        self._write("big.bin", bytes(payload), mtime=1000000)
+        self._sync(self.source, self.target)
+
+        for attempt in range(2):
+            payload[3 * block + attempt] ^= 0xff
+            self._write("big.bin", bytes(payload[:7 * block]), mtime=1000001 + attempt)
+            stats = conductor.sync.sync_tree(self.source, os.path.join(self.target, "data"),
+                                             delta_threshold=block, block_size=block,
+                                             manifest_directory=self.manifests)
+
+            self.assertEqual((1, block), (stats.delta, stats.bytes_copied))
+            self.assertEqual(bytes(payload[:7 * block]), self._read("big.bin"))
+
+
+class _RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's files dict with ETags and single byte ranges,
+    counting requests."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"{digest}"'.format(digest=hashlib.sha256(body).hexdigest()[:16])
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        byte_range = self.headers.get("Range")
+        if byte_range and self.server.ranges:
+            start, end = (int(n) for n in byte_range[len("bytes="):].split("-"))
+            end = min(end, len(body) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {start}-{end}/{size}".format(
+                start=start, end=end, size=len(body)))
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWebGet(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.work_dir.name, "cache")
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _RangeRequestHandler)
+        self.server.files = {"/big.bin": os.urandom(300000), "/small.txt": b"hello"}
+        self.server.requests = []
+        self.server.ranges = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = "http://127.0.0.1:{port}".format(port=self.server.server_address[1])
+        self.downloader = conductor.Downloader(self.cache, segment_size=65536)
+
+    def tearDown(self):
+        self.downloader.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.work_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.work_dir.name, name)
+
+    def _read(self, name):
+        with open(self._path(name), "rb") as download:
+            return download.read()
+
+    def test_parallel_ranges_and_cache(self):
+        results = self.downloader.download_many([
+            (self.base + "/big.bin", self._path("big.bin")),
+            (self.base + "/small.txt", self._path("small.txt"))])
+        again = self.downloader.download(self.base + "/big.bin", self._path("copy.bin"))
+
+        self.assertEqual(self.server.files["/big.bin"], self._read("big.bin"))
+        self.assertEqual(b"hello", self._read("small.txt"))
+        self.assertEqual(5, results[0].segments)
+        self.assertEqual(hashlib.sha256(b"hello").hexdigest(), results[1].sha256)
+        self.assertTrue(again.from_cache)
+        self.assertEqual(self.server.files["/big.bin"], self._read("copy.bin"))
+        self.assertEqual(7, len(self.server.requests))
+
+    def test_known_digest_needs_no_request(self):
+        digest = hashlib.sha256(b"hello").hexdigest()
+        self.downloader.download(self.base + "/small.txt", self._path("a.txt"), digest)
+        result = self.downloader.download(self.base + "/elsewhere", self._path("b.txt"), digest)
+
+        self.assertTrue(result.from_cache)
+        self.assertEqual(1, len(self.server.requests))
+        with self.assertRaises(conductor.DownloadError):
+            self.downloader.download(self.base + "/big.bin", self._path("c.bin"), "0" * 64)
+
+    def test_resume_skips_completed_segments(self):
+        url = self.base + "/big.bin"
+        target = self._path("big.bin")
+        self.downloader.download(url, target)
+        os.rename(target, target + ".part")
+        with open(target + ".part.json", "w") as state:
+            json.dump({"url": url, "etag": self.downloader.cache.lookup(url)["etag"],
+                       "size": 300000, "done": [0, 1, 2]}, state)
+        self.server.requests = []
+
+        result = conductor.Downloader("", segment_size=65536).download(url, target)
+
+        self.assertTrue(result.resumed)
+        self.assertEqual(["bytes=0-65535", "bytes=196608-262143", "bytes=262144-299999"],
+                         sorted(r for _, r in self.server.requests))
+        self.assertEqual(self.server.files["/big.bin"], self._read("big.bin"))
+        self.assertFalse(os.path.exists(target + ".part.json"))
+
+    def test_web_get_without_range_support(self):
+        self.server.ranges = False
+        ops = conductor.OperationWrapper()
+        cwd = os.getcwd()
+        os.chdir(self.work_dir.name)
+        try:
+            result = ops.web_get(self.base + "/big.bin", cache_directory="")
+        finally:
+            os.chdir(cwd)
+            ops.__exit__(None, None, None)
+
+        self.assertEqual(1, result.segments)
+        self.assertEqual(self.server.files["/big.bin"], self._read("big.bin"))
+        with self.assertRaises(conductor.DownloadError):
+            self.downloader.download(self.base + "/missing", self._path("missing"))
+
+
+class TestSystemInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+
+    def tearDown(self):
+        self.ops.__exit__(None, None, None)
+
+    def test_collectors(self):
+        root = self.ops.disk_free_space(["/"])[0]
+        stats = os.statvfs("/")
+        uptime = self.ops.system_uptime()
+        interfaces = dict((i.name, i) for i in self.ops.network_addresses())
+
+        self.assertEqual(stats.f_blocks * stats.f_frsize, root.total)
+        self.assertEqual(root.total, root.used + root.free)
+        self.assertIn("/", [disk.mount_point for disk in self.ops.disk_free_space()])
+        self.assertGreater(uptime.seconds, 0)
+        self.assertEqual(3, len(uptime.load_average))
+        self.assertIn("127.0.0.1", interfaces["lo"].addresses)
+        self.assertEqual(os.uname().release, self.ops.operating_system_kernel_information().release)
+
+    def test_os_release(self):
+        with tempfile.NamedTemporaryFile("w", suffix="os-release") as release_file:
+            release_file.write('NAME="Ubuntu"\nVERSION_ID="16.04"\nID=ubuntu\n'
+                               '# comment\nPRETTY_NAME="Ubuntu 16.04.7 LTS"\n'
+                               'UBUNTU_CODENAME=xenial\n')
+            release_file.flush()
+            release = conductor.sysinfo.os_release([release_file.name])
+
+        self.assertEqual(("ubuntu", "Ubuntu", "16.04", "Ubuntu 16.04.7 LTS", "xenial"),
+                         release[:5])
+
+    def test_sampler_ring_buffer(self):
+        calls = []
+
+        def count():
+            calls.append(1)
+            return len(calls)
+
+        def failing():
+            raise IOError("gone")
+
+        sampler = self.ops.sample_system(interval=0.01, capacity=3,
+                                         collectors={"count": count, "broken": failing})
+        while len(calls) < 6:
+            time.sleep(0.01)
+        self.ops.__exit__(None, None, None)
+        samples = sampler.samples()
+
+        self.assertFalse(sampler.is_running)
+        self.assertEqual(3, len(samples))
+        self.assertEqual(len(calls), samples[-1].values["count"])
+        self.assertEqual(sampler.latest(), samples[-1])
+        self.assertIsNone(samples[-1].values["broken"])
+        self.assertLess(samples[0].timestamp, samples[-1].timestamp)
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.cache_filename = os.path.join(self.work_dir.name, "queries.json")
+        self.calls = []
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def _compute(self, value):
+        def compute():
+            self.calls.append(value)
+            return [value]
+        return compute
+
+    def test_ttl_lru_and_invalidation(self):
+        cache = conductor.QueryCache(ttls={"short": 0.05, "off": 0}, max_entries=2)
+        first = cache.get("long", "a", self._compute(1))
+        first.append("mutated")
+        self.assertEqual([1], cache.get("long", "a", self._compute(2)))
+        cache.get("short", "", self._compute(3))
+        time.sleep(0.06)
+        cache.get("short", "", self._compute(4))
+        cache.get("off", "", self._compute(5))
+        cache.get("off", "", self._compute(6))
+        self.assertEqual([1, 3, 4, 5, 6], self.calls)
+
+        cache.get("long", "a", self._compute(7))
+        cache.get("long", "b", self._compute(8))
+        self.assertEqual(2, len(cache))
+        cache.get("short", "", self._compute(9))
+        self.assertEqual([1, 3, 4, 5, 6, 8, 9], self.calls)
+
+        cache.invalidate("long")
+        cache.get("long", "b", self._compute(10))
+        cache.invalidate()
+        self.assertEqual(0, len(cache))
+        self.assertEqual(10, self.calls[-1])
+
+    def test_wrapper_queries_and_persistence(self):
+        with conductor.OperationWrapper(query_cache=conductor.QueryCache(
+                cache_filename=self.cache_filename)) as ops:
+            kernel = ops.operating_system_kernel_information()
+            ops.operating_system_kernel_information()
+            users = ops.list_all_users()
+            ops.list_all_users()
+            ops.disk_free_space(["/"])
+            self.assertEqual((2, 3), (ops.query_cache.hits, ops.query_cache.misses))
+
+        restarted = conductor.QueryCache(cache_filename=self.cache_filename)
+        ops = conductor.OperationWrapper(query_cache=restarted)
+        self.assertEqual(kernel, ops.operating_system_kernel_information())
+        self.assertEqual(users, ops.list_all_users())
+        self.assertEqual((2, 0), (restarted.hits, restarted.misses))
+
+        ops._invalidate_accounts()
+        ops.list_all_users()
+        self.assertEqual(1, restarted.misses)
+
+    def test_saved_as_json(self):
+        with conductor.OperationWrapper(query_cache=conductor.QueryCache(
+                cache_filename=self.cache_filename)) as ops:
+            results = [ops.list_all_groups_on_system(), ops.disk_free_space(["/"]),
+                       ops.network_addresses(), ops.operating_system_information(),
+                       ops.list_user_groups("root", verbose=True)]
+        with open(self.cache_filename) as cache_file:
+            self.assertEqual(5, len(json.load(cache_file)))
+
+        ops = conductor.OperationWrapper(query_cache=conductor.QueryCache(
+            cache_filename=self.cache_filename))
+        self.assertEqual(results, [ops.list_all_groups_on_system(), ops.disk_free_space(["/"]),
+                                   ops.network_addresses(), ops.operating_system_information(),
+                                   ops.list_user_groups("root", verbose=True)])
+        self.assertEqual(0, ops.query_cache.misses)
+
+        with open(self.cache_filename, "w") as cache_file:
+            cache_file.write("not json")
+        self.assertEqual(0, len(conductor.QueryCache(cache_filename=self.cache_filename)))
+
+    def test_shared_between_wrappers(self):
+        cache = conductor.QueryCache()
+        here = conductor.OperationWrapper(query_cache=cache)
+        there = conductor.OperationWrapper(query_cache=cache,
+                                           transport=conductor.LocalTransport("there"))
+        here.working_directory = self.work_dir.name
+
+        here.list_hardware()
+        there.list_hardware()
+        here.disk_free_space(["."])
+        conductor.OperationWrapper(query_cache=cache).disk_free_space(["."])
+        here.disk_free_space(["."])
+
+        self.assertEqual((1, 4), (cache.hits, cache.misses))
+
+
+class TestAsyncOperationWrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+        ops = conductor.OperationWrapper(grace_period=1)
+        ops.add_command_hook(self.results.append)
+        self.ops = conductor.AsyncOperationWrapper(ops, max_concurrency=2)
+
+    def test_run_many_respects_concurrency(self):
+        started = time.time()
+        results = asyncio.run(self.ops.run_many(["sleep 0.2; echo $0"] * 4 + [["echo", "a b"]]))
+        elapsed = time.time() - started
+
+        self.assertGreaterEqual(elapsed, 0.4)
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(["/bin/sh\n"] * 4 + ["a b\n"], [r.stdout for r in results])
+        self.assertEqual("echo 'a b'", results[-1].command_string)
+        self.assertEqual(5, len(self.results))
+
+    def test_timeout_and_cancellation_stop_the_group(self):
+        async def scenario():
+            # cat only sees end of file once sleep is gone too.
+            timed = await self.ops.run("sleep 30 | cat", timeout=0.3)
+            task = asyncio.ensure_future(self.ops.run("sleep 30"))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return timed
+
+        started = time.time()
+        timed = asyncio.run(scenario())
+
+        self.assertLess(time.time() - started, 2)
+        self.assertTrue(timed.timed_out)
+        self.assertLess(timed.duration, 0.9)
+        self.assertEqual(set(), self.ops._processes)
+
+    def test_streaming_and_in_process_methods(self):
+        lines = []
+
+        async def callback(name, line):
+            lines.append((name, line))
+
+        async def scenario():
+            return await self.ops.gather(
+                self.ops.start_streaming_process("echo out; echo err >&2; echo end",
+                                                 callback=callback, keep_lines=1),
+                self.ops.system_uptime(),
+                self.ops.list_files(directory=os.path.dirname(conductor.__file__)))
+
+        streamed, uptime, names = asyncio.run(scenario())
+
+        self.assertEqual("end\n", streamed.stdout)
+        self.assertEqual(8, streamed.stdout_size)
+        self.assertIn(("stderr", "err\n"), lines)
+        self.assertGreater(uptime.seconds, 0)
+        self.assertIn("async_wrapper.py", names)
+
+    def test_shell_methods_run_as_subprocesses(self):
+        for name in ("add_group", "install_system_packages", "update_system_packages",
+                     "print_working_directory", "change_working_directory"):
+            method = getattr(conductor.AsyncOperationWrapper, name)
+            self.assertEqual("conductor.async_wrapper", method.__module__)
+            self.assertNotIn("_in_executor_method", method.__qualname__)
+
+        with tempfile.TemporaryDirectory() as directory:
+            async def scenario():
+                await self.ops.change_working_directory(directory)
+                pwd = await self.ops.print_working_directory()
+                process = await self.ops.start_non_blocking_process("echo started")
+                return pwd, await process
+
+            pwd, started = asyncio.run(scenario())
+
+        self.assertEqual(os.path.realpath(directory) + "\n", pwd)
+        self.assertEqual(os.path.realpath(directory), self.ops.wrapper.working_directory)
+        self.assertEqual("started\n", started.stdout)
+
+    def test_run_command_steps_follows_dependencies(self):
+        steps = conductor.parse_command_lines(
+            ["[a] sleep 0.3; echo a", "[b] sleep 0.3; echo b", "[c <- a b] echo c"])
+
+        started = time.time()
+        results = asyncio.run(self.ops.run_command_steps(steps, jobs=2))
+        elapsed = time.time() - started
+
+        self.assertLess(elapsed, 0.55)
+        self.assertEqual("c", list(results)[-1])
+        self.assertEqual(["a\n", "b\n", "c\n"], [results[key].stdout for key in "abc"])
+
+        steps = conductor.parse_command_lines(["false", "echo never"])
+        results = asyncio.run(self.ops.run_command_steps(steps, stop_on_failure=True))
+        self.assertEqual(["line1"], list(results))
+
+
+class TestExecutionPlan(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.work_dir.name, "plans")
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def _write(self, name, text):
+        filename = os.path.join(self.work_dir.name, name)
+        with open(filename, "w") as command_file:
+            command_file.write(text)
+        return filename
+
+    def test_continuations_includes_and_comments(self):
+        self._write("common.txt", "# shared\necho common\n")
+        filename = self._write("main.txt", "echo one \\\n  two\n\n@include common.txt\necho three\n")
+
+        commands = conductor.OperationWrapper().load_commands_from_text_file(filename)
+        plan = conductor.compile_plan(filename, optimize=False, cache_directory="")
+
+        self.assertEqual(["echo one   two", "echo common", "echo three"], commands)
+        self.assertEqual(["line1", "line5", "line6"], [step.step_id for step in plan.steps])
+        self.assertEqual(["main.txt", "common.txt"],
+                         [os.path.basename(source) for source, _ in plan.sources])
+
+    def test_optimize_drops_redundant_steps(self):
+        filename = self._write("main.txt", "\n".join([
+            "apt-get update",
+            "true",
+            "apt-get update",
+            "apt-get -y install git curl",
+            "apt-get -y install git",
+            "[late] apt-get -y install curl vim",
+            "[after <- late] echo done",
+        ]) + "\n")
+
+        plan = conductor.compile_plan(filename, cache_directory="")
+
+        self.assertEqual(("line2", "line3", "line5"), plan.dropped)
+        self.assertEqual(["apt-get update", "apt-get install -y git curl vim", "echo done"],
+                         [step.command_string for step in plan.steps])
+        self.assertEqual(["late"], plan.steps[-1].depends_on)
+
+    def test_parallel_steps_are_not_deduplicated(self):
+        steps = conductor.parse_command_lines([
+            "apt-get update",
+            "& add-apt-repository ppa:example/tools",
+            "& apt-get update",
+        ])
+
+        optimized, dropped = conductor.plan.optimize_steps(steps)
+
+        self.assertEqual([], dropped)
+        self.assertEqual(3, len(optimized))
+
+    def test_cache_hit_and_invalidation(self):
+        common = self._write("common.txt", "echo common\n")
+        filename = self._write("main.txt", "@include common.txt\n")
+
+        first = conductor.compile_plan(filename, cache_directory=self.cache_dir)
+        cache_files = os.listdir(self.cache_dir)
+        self.assertEqual(1, len(cache_files))
+        cache_file = os.path.join(self.cache_dir, cache_files[0])
+        inode = os.stat(cache_file).st_ino
+        cached = conductor.compile_plan(filename, cache_directory=self.cache_dir)
+        # A hit doesn't rewrite the cached plan.
+        self.assertEqual(inode, os.stat(cache_file).st_ino)
+        self.assertEqual(first.sources, cached.sources)
+        self.assertEqual("echo common", cached.steps[0].command_string)
+
+        with open(common, "w") as command_file:
+            command_file.write("echo changed\n")
+        second = conductor.compile_plan(filename, cache_directory=self.cache_dir)
+        self.assertEqual("echo changed", second.steps[0].command_string)
+
+    def test_cached_plans_are_json(self):
+        filename = self._write("main.txt", "[a cpus=2 mem=1G] echo a\n[b <- a] echo b\n")
+        first = conductor.compile_plan(filename, cache_directory=self.cache_dir)
+        cache_file = os.path.join(self.cache_dir, os.listdir(self.cache_dir)[0])
+        with open(cache_file) as cached_json:
+            self.assertEqual("echo a", json.load(cached_json)["steps"][0]["command_string"])
+
+        cached = conductor.compile_plan(filename, cache_directory=self.cache_dir)
+        self.assertEqual([("a", 2, "1G", []), ("b", None, None, ["a"])],
+                         [(step.step_id, step.cpus, step.memory, step.depends_on)
+                          for step in cached.steps])
+        self.assertEqual(first.sources, cached.sources)
+
+        with open(cache_file, "w") as cached_json:
+            cached_json.write("not a plan")
+        recompiled = conductor.compile_plan(filename, cache_directory=self.cache_dir)
+        self.assertEqual(["a", "b"], [step.step_id for step in recompiled.steps])
+
+    def test_errors_name_file_and_line(self):
+        common = self._write("common.txt", "echo fine\n[a <- missing] true\n")
+        filename = self._write("main.txt", "echo one\n@include common.txt\n")
+        with self.assertRaisesRegex(ValueError, "^{file}, line 2:".format(file=common)):
+            conductor.compile_plan(filename, cache_directory="")
+
+        self._write("loop.txt", "@include loop.txt\n")
+        with self.assertRaisesRegex(ValueError, "includes itself"):
+            conductor.compile_plan(os.path.join(self.work_dir.name, "loop.txt"), cache_directory="")
+
+
+class TestResourcePool(unittest.TestCase):
+
+    def test_requirements_are_inferred(self):
+        self.assertEqual((8, 0), conductor.resources.requirements_from_arguments({"num_threads": 8}))
+        self.assertEqual((4, 2 * 1024 ** 3), conductor.resources.requirements_from_command(
+            "blastn -num_threads 4 --mem=2G -query q.fa"))
+        self.assertEqual((1, 0), conductor.resources.requirements_from_command("echo threads"))
+
+    def test_declared_requirements(self):
+        steps = conductor.parse_command_lines(["[align cpus=8 mem=512M] bwa mem -t 2 ref.fa", "& make"])
+
+        self.assertEqual((8, 512 * 1024 ** 2), steps[0].requirements())
+        self.assertEqual((1, 0), steps[1].requirements())
+        self.assertRaises(ValueError, conductor.parse_command_lines, ["[a gpus=1] true"])
+
+    def test_admission_and_clamping(self):
+        pool = conductor.ResourcePool(cpus=4, memory="1G")
+
+        first = pool.try_acquire(3, "768M")
+        self.assertIsNone(pool.try_acquire(2))
+        self.assertIsNone(pool.try_acquire(1, "512M"))
+        pool.release(first)
+        self.assertEqual((4, 1024 ** 3), pool.try_acquire(16, "2G"))
+
+    def test_scheduler_does_not_oversubscribe(self):
+        steps = conductor.parse_command_lines(["[a{n} cpus=2] sleep 0.2".format(n=n) for n in range(4)])
+        ops = conductor.OperationWrapper()
+
+        started = time.time()
+        results = ops.run_command_steps(steps, jobs=4, resources=conductor.ResourcePool(cpus=4))
+        elapsed = time.time() - started
+
+        self.assertEqual(4, len(results))
+        self.assertGreater(elapsed, 0.35)
+        self.assertLess(elapsed, 0.8)
+
+    def test_sweep_does_not_oversubscribe(self):
+        template = conductor.CommandTemplate("python3 -c 'import time; time.sleep(0.2)'")
+        sweep = conductor.ParameterSweep(template, {"num_threads": [3, 3, 3]})
+        ops = conductor.OperationWrapper()
+
+        started = time.time()
+        results = list(ops.run_sweep(sweep, jobs=3, resources=conductor.ResourcePool(cpus=4)))
+
+        self.assertEqual(3, len(results))
+        self.assertGreater(time.time() - started, 0.55)
+
+
+class TestParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.ops = conductor.OperationWrapper()
+        script = "import sys; args = dict(zip(sys.argv[1::2], sys.argv[2::2])); " \
+                 "open(args['-out'], 'w').write(args['-db']); sys.exit(args['-db'] == 'bad')"
+        self.template = conductor.CommandTemplate("python3 -c " + shlex.quote(script))
+        self.output = os.path.join(self.work_dir.name, "hits_{db}_{evalue}.xml")
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_expand_parameters(self):
+        product = conductor.expand_parameters({"evalue": [1, 2], "db": ["16s", "nt"]})
+        zipped = conductor.expand_parameters({"evalue": [1, 2], "db": ["16s", "nt"]}, mode="zip")
+
+        self.assertEqual([("16s", 1), ("16s", 2), ("nt", 1), ("nt", 2)], [tuple(p.values()) for p in product])
+        self.assertEqual([("16s", 1), ("nt", 2)], [tuple(p.values()) for p in zipped])
+        self.assertRaises(ValueError, conductor.expand_parameters, {"a": [1], "b": [1, 2]}, "zip")
+
+    def test_sweep_runs_and_resumes(self):
+        sweep = conductor.ParameterSweep(self.template, {"db": ["16s", "nt", "bad"], "evalue": [1, 2]},
+                                         output_template=self.output, output_argument="out")
+
+        first = dict((result.key, result) for result in self.ops.run_sweep(sweep, jobs=4))
+        self.assertEqual(6, len(first))
+        self.assertFalse(first[("bad", 1)].result.succeeded)
+        self.assertFalse(os.path.exists(self.output.format(db="bad", evalue=1)))
+        with open(self.output.format(db="nt", evalue=2)) as hits:
+            self.assertEqual("nt", hits.read())
+
+        second = list(self.ops.run_sweep(sweep, jobs=4))
+        self.assertEqual(set([("bad", 1), ("bad", 2)]),
+                         set(result.key for result in second if not result.skipped))
+
+    def test_resume_follows_the_working_directory(self):
+        sweep = conductor.ParameterSweep(self.template, {"db": ["16s", "bad"], "evalue": [1]},
+                                         output_template="hits_{db}_{evalue}.xml",
+                                         output_argument="out")
+        self.ops.working_directory = self.work_dir.name
+        # A finished point's output in the process's own directory means
+        # nothing to commands running elsewhere.
+        with tempfile.TemporaryDirectory() as elsewhere:
+            cwd = os.getcwd()
+            os.chdir(elsewhere)
+            try:
+                open("hits_bad_1.xml", "w").close()
+                first = list(self.ops.run_sweep(sweep))
+                second = list(self.ops.run_sweep(sweep))
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual([False, False], [result.skipped for result in first])
+        self.assertEqual({("16s", 1): True, ("bad", 1): False},
+                         dict((result.key, result.skipped) for result in second))
+        self.assertFalse(os.path.exists(os.path.join(self.work_dir.name, "hits_bad_1.xml")))
+
+
 class TestOperationWrapperMethods(unittest.TestCase):
 
     def setUp(self):
@@ -99,8 +1048,705 @@ class TestOperationWrapperMethods(unittest.TestCase):
     def test_install(self):
         pass
 
+class TestNonBlockingProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+
+    def test_returns_before_child_exits(self):
+        handle = self.ops.start_non_blocking_process("sleep 5")
+        self.assertIsNone(handle.poll())
+        self.assertRaises(subprocess.TimeoutExpired, handle.wait, 0.05)
+        handle.kill()
+        self.assertEqual(-signal.SIGKILL, handle.exit_code)
+
+    def test_stream_separates_stdout_and_stderr(self):
+        handle = self.ops.start_non_blocking_process("echo out; echo err >&2; exit 3")
+        lines = sorted(handle.stream())
+
+        self.assertEqual([("stderr", "err\n"), ("stdout", "out\n")], lines)
+        self.assertEqual(3, handle.wait(timeout=5))
+
+    def test_kill_reaches_process_group(self):
+        # cat holds the stdout pipe open, so the stream only ends if the
+        # whole group died rather than just the shell.
+        handle = self.ops.start_non_blocking_process("sleep 30 | cat")
+        started = time.time()
+        handle.kill()
+        stdout, stderr = handle.communicate(timeout=5)
+
+        self.assertEqual("", stdout)
+        self.assertLess(time.time() - started, 5)
+
+
+class TestStreamingProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+
+    def test_keeps_only_the_tail(self):
+        seen = []
+        result = self.ops.start_streaming_process(
+            "seq 1 5000; echo oops >&2; exit 2",
+            callback=lambda name, line: seen.append(name),
+            keep_lines=3, max_buffered_lines=10)
+
+        self.assertEqual("4998\n4999\n5000\n", result.stdout)
+        self.assertEqual("oops\n", result.stderr)
+        self.assertEqual(2, result.exit_code)
+        self.assertEqual(5001, len(seen))
+
+    def test_long_lines_are_chunked(self):
+        result = self.ops.start_streaming_process(
+            "head -c 200000 /dev/zero | tr '\\0' x", keep_lines=1)
+
+        self.assertEqual(200000 % conductor.process.MAX_CHUNK_SIZE, len(result.stdout))
+
+    def test_stream_timeout(self):
+        handle = self.ops.start_non_blocking_process("sleep 5")
+        self.assertRaises(subprocess.TimeoutExpired, handle.result, 0.1)
+        handle.kill()
+
+
+class TestFileViewing(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+        self.text_file = tempfile.NamedTemporaryFile("w", suffix=".log")
+        self.text_file.write("".join("line {n}\n".format(n=n) for n in range(1, 10001)))
+        self.text_file.flush()
+
+    def tearDown(self):
+        self.text_file.close()
+
+    def test_head_file(self):
+        self.assertEqual("line 1\nline 2\n", self.ops.head_file(self.text_file.name, 2))
+        # The shell version took counts as strings too.
+        self.assertEqual("line 1\n", self.ops.head_file(self.text_file.name, "1"))
+        self.assertEqual("line 10000\n", self.ops.tail_file(self.text_file.name, "1"))
+        self.assertRaises(ValueError, self.ops.head_file, self.text_file.name, "many")
+
+    def test_tail_file(self):
+        self.assertEqual("line 9999\nline 10000\n", self.ops.tail_file(self.text_file.name, 2))
+        self.assertEqual(self.ops.view_file_contents(self.text_file.name),
+                         self.ops.tail_file(self.text_file.name, 20000))
+
+    def test_tail_file_across_blocks_without_trailing_newline(self):
+        with open(self.text_file.name, "a") as log:
+            log.write("partial")
+
+        self.assertEqual("line 10000\npartial", conductor.files.tail_file(self.text_file.name, 2, block_size=3))
+
+    def test_view_file_contents_modes(self):
+        whole = self.ops.view_file_contents(self.text_file.name)
+        chunks = list(self.ops.view_file_contents(self.text_file.name, chunk_size=1000))
+        mapped = self.ops.view_file_contents(self.text_file.name, use_mmap=True)
+
+        self.assertEqual(whole, "".join(chunks))
+        self.assertEqual(whole.encode(), mapped[:])
+        mapped.close()
+
+
+class TestChecksums(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.filenames = []
+        for n in range(5):
+            filename = os.path.join(self.work_dir.name, "artifact{n}".format(n=n))
+            with open(filename, "wb") as artifact:
+                artifact.write(b"conductor" * (n + 1))
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_md5_and_sha1(self):
+        md5 = self.ops.md5_checksum(self.filenames[0])
+        sha1 = self.ops.sha1_checksum(self.filenames[0])
+
+        self.assertEqual(hashlib.md5(b"conductor").hexdigest(), md5.hexdigest)
+        self.assertEqual(hashlib.sha1(b"conductor").hexdigest(), sha1.hexdigest)
+        self.assertEqual(9, md5.size)
+
+    def test_checksum_files_preserves_order(self):
+        digests = self.ops.checksum_files(self.filenames, "sha256", jobs=3)
+
+        self.assertEqual(self.filenames, [digest.filename for digest in digests])
+        self.assertEqual(hashlib.sha256(b"conductor" * 5).hexdigest(), digests[4].hexdigest)
+
+    def test_cache_skips_unchanged_files(self):
+        cache_filename = os.path.join(self.work_dir.name, "cache.json")
+        self.ops.checksum_files(self.filenames, cache_filename=cache_filename)
+
+        cache = conductor.ChecksumCache(cache_filename)
+        stat_result = os.stat(self.filenames[0])
+        self.assertIsNotNone(cache.lookup(self.filenames[0], "md5", stat_result))
+
+        with open(self.filenames[0], "ab") as artifact:
+            artifact.write(b"changed")
+        self.assertIsNone(cache.lookup(self.filenames[0], "md5", os.stat(self.filenames[0])))
+        self.assertEqual(hashlib.md5(b"conductorchanged").hexdigest(),
+                         self.ops.md5_checksum(self.filenames[0], cache_filename).hexdigest)
+
+
+class TestListFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+        self.work_dir = tempfile.TemporaryDirectory()
+        root = self.work_dir.name
+        for sub in ("a", os.path.join("a", "b"), "c"):
+            os.mkdir(os.path.join(root, sub))
+        for name in ("top file.txt", os.path.join("a", "one"), os.path.join("a", "b", "two"), ".hidden"):
+            with open(os.path.join(root, name), "w") as handle:
+                handle.write(name)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_names(self):
+        self.assertEqual(["a", "c", "top file.txt"], self.ops.list_files(directory=self.work_dir.name))
+
+    def test_verbose_entries_are_typed(self):
+        entries = dict((entry.name, entry) for entry in self.ops.list_files(True, self.work_dir.name))
+
+        self.assertEqual(len("top file.txt"), entries["top file.txt"].size)
+        self.assertTrue(entries["a"].is_dir)
+        self.assertEqual(os.getuid(), entries["a"].uid)
+
+    def test_recursive_serial_and_parallel_agree(self):
+        expected = ["a", os.path.join("a", "b"), os.path.join("a", "b", "two"), os.path.join("a", "one"),
+                    "c", "top file.txt"]
+
+        self.assertEqual(expected, self.ops.list_files(directory=self.work_dir.name, recursive=True))
+        self.assertEqual(expected, self.ops.list_files(directory=self.work_dir.name, recursive=True, jobs=4))
+
+
+class TestAccountIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.passwd = os.path.join(self.work_dir.name, "passwd")
+        self.group = os.path.join(self.work_dir.name, "group")
+        self.write(self.passwd, "root:x:0:0:root:/root:/bin/bash\n"
+                                "alice:x:1000:1000:Alice:/home/alice:/bin/bash\n")
+        self.write(self.group, "root:x:0:\nalice:x:1000:\nsudo:x:27:alice\ndocker:x:999:alice,root\n")
+        self.ops = conductor.OperationWrapper()
+        self.ops.account_index = conductor.AccountIndex(self.passwd, self.group)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def write(self, filename, text):
+        with open(filename, "w") as handle:
+            handle.write(text)
+
+    def test_lookups(self):
+        index = self.ops.account_index
+
+        self.assertEqual("alice", index.user_by_uid(1000).name)
+        self.assertEqual(27, index.group_by_name("sudo").gid)
+        self.assertRaises(KeyError, index.user_by_name, "mallory")
+
+    def test_list_user_groups(self):
+        self.assertEqual(["alice", "sudo", "docker"], self.ops.list_user_groups("alice"))
+        self.assertEqual({"username": "alice", "uid": {"1000": "alice"}, "gid": {"1000": "alice"},
+                          "groups": {"1000": "alice", "27": "sudo", "999": "docker"}},
+                         self.ops.list_user_groups("alice", verbose=True))
+
+    def test_index_reloads_when_files_change(self):
+        self.assertEqual(2, len(self.ops.list_all_users()))
+
+        replacement = self.passwd + ".new"
+        self.write(replacement, "root:x:0:0:root:/root:/bin/bash\n")
+        os.replace(replacement, self.passwd)
+
+        self.assertEqual(["root"], [user.name for user in self.ops.list_all_users()])
+
+
+class TestPackageManager(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        status_filename = os.path.join(self.work_dir.name, "status")
+        with open(status_filename, "w") as status_file:
+            status_file.write("Package: git\nStatus: install ok installed\nVersion: 1:2.7.4\n\n"
+                              "Package: htop\nStatus: deinstall ok config-files\nVersion: 2.0.1\n")
+        self.lists = os.path.join(self.work_dir.name, "lists")
+        os.mkdir(self.lists)
+        os.utime(self.lists, (0, 0))
+        self.commands = []
+        self.manager = conductor.AptPackageManager(
+            self.record, conductor.DpkgStatus(status_filename),
+            lists_directory=self.lists, sources=[os.path.join(self.work_dir.name, "sources.list")])
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def record(self, command_string):
+        self.commands.append(command_string)
+        return conductor.CommandResult(command_string, 0)
+
+    def test_installed_packages_are_skipped(self):
+        self.manager.install(["git", "htop", "git=1:2.7.4"])
+        self.manager.install(["git"])
+
+        self.assertEqual(["apt-get -y install htop"], self.commands)
+
+    def test_update_freshness_window(self):
+        self.manager.update()
+        self.manager.update()
+        self.manager.update(force=True)
+        self.assertEqual(2, len(self.commands))
+
+        with open(self.manager.sources[0], "w") as sources:
+            sources.write("deb http://example.com/ubuntu xenial main\n")
+        future = time.time() + 10
+        os.utime(self.manager.sources[0], (future, future))
+        self.manager.update()
+        self.assertEqual(3, len(self.commands))
+
+    def test_batch_install_steps(self):
+        steps = conductor.parse_command_lines([
+            "apt-get update",
+            "apt-get -y install htop",
+            "apt-get install -y vim",
+            "apt-get -y install htop tmux",
+            "[x <- line4] echo done",
+            "apt-get -y install curl && echo ok",
+        ])
+        batched = conductor.packages.batch_install_steps(steps)
+
+        self.assertEqual(["apt-get update", "apt-get install -y htop vim tmux", "echo done",
+                          "apt-get -y install curl && echo ok"],
+                         [step.command_string for step in batched])
+        self.assertEqual(["line4"], batched[2].depends_on)
+
+    def test_batched_steps_keep_declared_resources(self):
+        steps = conductor.parse_command_lines([
+            "[a cpus=2] apt-get -y install htop",
+            "[b mem=1G <- a] apt-get -y install vim",
+            "[c cpus=4 <- b] echo done",
+        ])
+        batched = conductor.packages.batch_install_steps(steps)
+
+        self.assertEqual([("b", 2, "1G"), ("c", 4, None)],
+                         [(step.step_id, step.cpus, step.memory) for step in batched])
+
+    def test_run_routes_apt_commands(self):
+        self.manager.run("apt-get -y install git")
+        self.manager.run("echo hello")
+
+        self.assertEqual(["echo hello"], self.commands)
+
+
+class TestCheckpointJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.journal = os.path.join(self.work_dir.name, "journal.jsonl")
+        self.marker = os.path.join(self.work_dir.name, "ran")
+        self.ops = conductor.OperationWrapper()
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def run_lines(self, lines):
+        steps = conductor.parse_command_lines(lines)
+        return self.ops.run_command_steps(steps, journal_filename=self.journal, resume=True)
+
+    def test_resume_skips_steps_that_succeeded(self):
+        lines = ["echo 1 >> " + self.marker, "echo 2 >> " + self.marker, "test -e " + self.marker + ".ok"]
+        first = self.run_lines(lines)
+        self.assertEqual(1, first["line3"].exit_code)
+
+        open(self.marker + ".ok", "w").close()
+        second = self.run_lines(lines)
+
+        self.assertEqual(["line3"], list(second))
+        with open(self.marker) as ran:
+            self.assertEqual("1\n2\n", ran.read())
+
+    def test_changed_line_reruns_everything_downstream(self):
+        self.run_lines(["echo a >> " + self.marker, "echo b >> " + self.marker, "echo c >> " + self.marker])
+        results = self.run_lines(["echo a >> " + self.marker, "echo B >> " + self.marker,
+                                  "echo c >> " + self.marker])
+
+        self.assertEqual(["line2", "line3"], list(results))
+
+    def test_resume_keeps_declared_resources(self):
+        ok = self.marker + ".ok"
+        command_filename = os.path.join(self.work_dir.name, "commands.txt")
+        with open(command_filename, "w") as command_file:
+            command_file.write("[setup] echo setup >> {marker}\n"
+                               "[a cpus=2 <- setup] sleep 0.3; test -e {ok}\n"
+                               "[b cpus=2 <- setup] sleep 0.3; test -e {ok}\n".format(
+                                   marker=self.marker, ok=ok))
+        argv = [command_filename, "--jobs", "2", "--journal", self.journal, "--resume",
+                "--reserve-resources", "--cpus", "2", "--plan-cache", ""]
+        self.assertEqual(1, conductor.__main__.main(argv))
+
+        open(ok, "w").close()
+        started = time.time()
+        self.assertEqual(0, conductor.__main__.main(argv))
+
+        # Both steps need every core, so they still run one after the other.
+        self.assertGreaterEqual(time.time() - started, 0.6)
+        with open(self.marker) as ran:
+            self.assertEqual("setup\n", ran.read())
+
+    def test_records_when_the_step_started(self):
+        checkpoints = conductor.journal.CheckpointJournal(self.journal)
+        step = conductor.parse_command_lines(["echo hi"])[0]
+        checkpoints.record("key", step, conductor.CommandResult("echo hi", 0, duration=2.0,
+                                                                started=1000.0))
+
+        with open(self.journal) as journal_file:
+            entry = json.loads(journal_file.readline())
+        self.assertEqual((1000.0, 2.0), (entry["started"], entry["duration"]))
+
+    def test_step_keys_only_depend_on_upstream(self):
+        before = conductor.journal.step_keys(conductor.parse_command_lines(["a", "& b", "& c", "d"]))
+        after = conductor.journal.step_keys(conductor.parse_command_lines(["a", "& b", "& C", "d"]))
+
+        self.assertEqual(before["line2"], after["line2"])
+        self.assertNotEqual(before["line3"], after["line3"])
+        self.assertNotEqual(before["line4"], after["line4"])
+
+
+class TestShellSession(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper(persistent_shell=True)
+
+    def tearDown(self):
+        self.ops.close_session()
+
+    def test_state_carries_over(self):
+        work_dir = os.path.realpath(tempfile.gettempdir())
+        self.ops.change_working_directory(work_dir)
+        self.ops.start_blocking_process("export CONDUCTOR_TEST=kept")
+
+        self.assertEqual(work_dir + "\n", self.ops.print_working_directory())
+        self.assertEqual("kept\n", self.ops.start_blocking_process("echo $CONDUCTOR_TEST"))
+
+    def test_file_methods_follow_the_session_directory(self):
+        work_dir = tempfile.TemporaryDirectory()
+        real_dir = os.path.realpath(work_dir.name)
+        with open(os.path.join(real_dir, "notes.txt"), "w") as notes:
+            notes.write("one\ntwo\n")
+        self.ops.change_working_directory(real_dir)
+        self.ops.make_directory("made")
+
+        self.assertEqual(real_dir, self.ops.session.cwd)
+        self.assertEqual(["made", "notes.txt"], self.ops.list_files())
+        self.assertEqual("one\n", self.ops.head_file("notes.txt", 1))
+        self.assertEqual("two\n", self.ops.tail_file("notes.txt", 1))
+        self.assertEqual("one\ntwo\n", self.ops.view_file_contents("notes.txt"))
+
+        # A session stopped by a timeout is restarted where it was.
+        self.ops.start_blocking_process("sleep 4", timeout=0.2)
+        self.assertEqual(real_dir + "\n", self.ops.print_working_directory())
+        work_dir.cleanup()
+
+    def test_directory_kept_without_session(self):
+        work_dir = tempfile.TemporaryDirectory()
+        real_dir = os.path.realpath(work_dir.name)
+        os.mkdir(os.path.join(real_dir, "sub"))
+        ops = conductor.OperationWrapper()
+        ops.change_working_directory(real_dir)
+        ops.change_working_directory("sub")
+
+        self.assertEqual(os.path.join(real_dir, "sub"), ops.working_directory)
+        self.assertEqual(os.path.join(real_dir, "sub") + "\n", ops.print_working_directory())
+        ops.make_directory("made")
+        self.assertEqual(["made"], ops.list_files())
+        work_dir.cleanup()
+
+    def test_exit_status_stderr_and_quoting(self):
+        result = self.ops.session.run("printf 'no newline'; echo \"it's\" >&2; false")
+
+        self.assertEqual("no newline", result.stdout)
+        self.assertEqual("it's\n", result.stderr)
+        self.assertEqual(1, result.exit_code)
+        self.assertEqual(0, self.ops.session.run("true").exit_code)
+
+    def test_exit_closes_session(self):
+        self.assertRaises(conductor.SessionClosedError, self.ops.session.run, "exit 3")
+        self.assertRaises(conductor.SessionClosedError, self.ops.session.run, "true")
+        self.assertTrue(self.ops.open_session().is_alive)
+
+    def test_timeout_and_cancel_stop_the_session(self):
+        ops = conductor.OperationWrapper(persistent_shell=True, command_timeout=0.3,
+                                         grace_period=1)
+        results = []
+        ops.add_command_hook(results.append)
+        started = time.time()
+        self.assertEqual("", ops.start_blocking_process("sleep 4"))
+        self.assertLess(time.time() - started, 2)
+        self.assertTrue(results[-1].timed_out)
+        self.assertEqual("back\n", ops.start_blocking_process("echo back"))
+
+        ops.command_timeout = None
+        cancelled = []
+        timer = threading.Timer(0.3, lambda: cancelled.append(ops.cancel()))
+        timer.start()
+        started = time.time()
+        ops.start_blocking_process("sleep 4")
+        timer.join()
+        self.assertLess(time.time() - started, 2)
+        self.assertEqual([1], cancelled)
+        ops.close_session()
+
+    def test_transport_timeout(self):
+        for transport in (conductor.LocalTransport(), conductor.SessionTransport()):
+            result = transport.run("echo before; sleep 4", timeout=0.3, grace_period=1)
+
+            self.assertTrue(result.timed_out)
+            self.assertEqual("before\n", result.stdout)
+            self.assertLess(result.duration, 2)
+            self.assertEqual("after\n", transport.run("echo after").stdout)
+            transport.close()
+
+
+class TestMultiHostFanOut(unittest.TestCase):
+
+    def setUp(self):
+        self.ops = conductor.OperationWrapper()
+        self.ops.connection_pool = conductor.ConnectionPool(conductor.SessionTransport)
+
+    def tearDown(self):
+        self.ops.connection_pool.close()
+
+    def test_results_per_host(self):
+        results = self.ops.run_on_hosts(["web1", "web2"], ["echo hi", "false", "echo never"])
+
+        self.assertEqual(["web1", "web2"], list(results))
+        self.assertEqual(["hi\n", ""], [result.stdout for result in results["web1"]])
+        self.assertEqual(1, results["web2"][-1].exit_code)
+
+    def test_hosts_run_concurrently_over_reused_connections(self):
+        hosts = ["host{n}".format(n=n) for n in range(6)]
+        self.ops.run_on_hosts(hosts, ["true"])
+        first = self.ops.connection_pool.get("host0")
+
+        started = time.time()
+        self.ops.run_on_hosts(hosts, ["sleep 0.3"], max_parallel=6)
+
+        self.assertLess(time.time() - started, 1.0)
+        self.assertIs(first, self.ops.connection_pool.get("host0"))
+
+    def test_wrapper_transport(self):
+        transport = conductor.SessionTransport()
+        ops = conductor.OperationWrapper(transport=transport)
+        ops.start_blocking_process("cd /")
+
+        self.assertEqual("/\n", ops.print_working_directory())
+        transport.close()
+
+    def test_transport_carries_file_and_package_methods(self):
+        work_dir = tempfile.TemporaryDirectory()
+        with open(os.path.join(work_dir.name, "notes.txt"), "w") as notes:
+            notes.write("one\ntwo\nthree\n")
+        os.mkdir(os.path.join(work_dir.name, ".hidden"))
+        transport = conductor.SessionTransport()
+        ops = conductor.OperationWrapper(transport=transport)
+        ops.start_blocking_process("cd {dir}".format(dir=shlex.quote(work_dir.name)))
+
+        self.assertEqual("one\n", ops.head_file("notes.txt", 1))
+        self.assertEqual("three\n", ops.tail_file("notes.txt", 1))
+        self.assertEqual(["notes.txt"], ops.list_files())
+        steps = conductor.parse_command_lines(["cd /", "pwd"])
+        self.assertEqual("/\n", ops.run_command_steps(steps)["line2"].stdout)
+        self.assertEqual(["coreutils"], ops.package_manager.missing_packages(["coreutils"]))
+        self.assertRaises(conductor.TransportUnsupportedError, ops.disk_free_space)
+        self.assertRaises(conductor.TransportUnsupportedError, ops.md5_checksum, "notes.txt")
+
+        ops.transport = None
+        self.assertEqual([], ops.package_manager.missing_packages(["coreutils"]))
+        transport.close()
+        work_dir.cleanup()
+
+
+class TestCommandMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.TemporaryDirectory()
+        self.ops = conductor.OperationWrapper()
+        self.seen = []
+        self.ops.add_command_hook(self.seen.append)
+
+    def tearDown(self):
+        self.work_dir.cleanup()
+
+    def test_hook_sees_resource_usage(self):
+        self.ops.start_blocking_process("python3 -c 'bytearray(50 * 1024 * 1024); print(1)'")
+        result = self.seen[0]
+
+        self.assertEqual(0, result.exit_code)
+        self.assertEqual(2, result.stdout_size)
+        self.assertGreater(result.max_rss, 50 * 1024 * 1024)
+        self.assertGreater(result.user_time + result.system_time, 0)
+
+    def test_every_entry_point_is_recorded(self):
+        self.ops.start_non_blocking_process("true").result()
+        self.ops.start_streaming_process("seq 1 10", keep_lines=1)
+        self.ops.run_command_steps(conductor.parse_command_lines(["& true", "& true"]), jobs=2)
+
+        self.assertEqual(4, len(self.seen))
+        self.assertEqual(21, self.seen[1].stdout_size)
+
+    def test_exporters(self):
+        jsonl = os.path.join(self.work_dir.name, "metrics.jsonl")
+        prom = os.path.join(self.work_dir.name, "metrics.prom")
+        self.ops.add_command_hook(conductor.JsonLinesExporter(jsonl))
+        self.ops.add_command_hook(conductor.PrometheusExporter(prom))
+
+        self.ops.start_blocking_process("echo hi")
+        self.ops.start_blocking_process("sudo=no FOO=1 false")
+
+        with open(jsonl) as metrics_file:
+            records = [json.loads(line) for line in metrics_file]
+        self.assertEqual([0, 1], [record["exit_code"] for record in records])
+        with open(prom) as metrics_file:
+            exposition = metrics_file.read()
+        self.assertIn('conductor_command_total{program="echo",status="success"} 1.0', exposition)
+        self.assertIn('conductor_command_total{program="false",status="failure"} 1.0', exposition)
+
+
+class TestCommandScheduler(unittest.TestCase):
+
+    def test_plain_lines_run_in_order(self):
+        steps = conductor.parse_command_lines(["apt-get update", "", "# comment", "apt-get -y install git"])
+
+        self.assertEqual(["line1", "line4"], [step.step_id for step in steps])
+        self.assertEqual([], steps[0].depends_on)
+        self.assertEqual(["line1"], steps[1].depends_on)
+
+    def test_parallel_and_named_steps(self):
+        steps = conductor.parse_command_lines([
+            "mkdir -p /opt/tools",
+            "& wget http://example.com/a",
+            "[b] wget http://example.com/b",
+            "[check <- b] sha1sum b",
+            "[ -f a ] && echo found",
+        ])
+        depends_on = dict((step.step_id, step.depends_on) for step in steps)
+
+        self.assertEqual(["line1"], depends_on["line2"])
+        self.assertEqual(["line1"], depends_on["b"])
+        self.assertEqual(["line1", "b"], depends_on["check"])
+        self.assertEqual(["line1", "line2", "b", "check"], depends_on["line5"])
+
+    def test_unknown_dependency(self):
+        self.assertRaises(ValueError, conductor.parse_command_lines, ["[a <- b] true"])
+
+    def test_independent_steps_overlap(self):
+        steps = conductor.parse_command_lines(["& sleep 0.3"] * 4)
+        ops = conductor.OperationWrapper()
+
+        started = time.time()
+        results = ops.run_command_steps(steps, jobs=4)
+
+        self.assertEqual(4, len(results))
+        self.assertLess(time.time() - started, 1.0)
+
+    def test_stop_on_failure(self):
+        steps = conductor.parse_command_lines(["false", "true"])
+        ops = conductor.OperationWrapper()
+
+        results = ops.run_command_steps(steps, stop_on_failure=True)
+
+        self.assertEqual(["line1"], list(results))
+        self.assertEqual(1, results["line1"].exit_code)
+
+    def test_install_from_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as command_file:
+            command_file.write("echo one\n& echo two\n& echo three\necho four\n")
+            command_file.flush()
+            results = conductor.OperationWrapper().install(command_file.name, jobs=2,
+                                                           plan_cache_directory="")
+
+        self.assertEqual("line4", list(results)[-1])
+        self.assertEqual("four\n", results["line4"].stdout)
+
+
 string_builder_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestCommandStringBuilder)
 unittest.TextTestRunner(verbosity=2).run(string_builder_test_suite)
 
 operation_wrapper_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestOperationWrapperMethods)
 unittest.TextTestRunner(verbosity=2).run(operation_wrapper_test_suite)
+
+non_blocking_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestNonBlockingProcess)
+unittest.TextTestRunner(verbosity=2).run(non_blocking_test_suite)
+
+scheduler_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestCommandScheduler)
+unittest.TextTestRunner(verbosity=2).run(scheduler_test_suite)
+
+streaming_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestStreamingProcess)
+unittest.TextTestRunner(verbosity=2).run(streaming_test_suite)
+
+file_viewing_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestFileViewing)
+unittest.TextTestRunner(verbosity=2).run(file_viewing_test_suite)
+
+checksum_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestChecksums)
+unittest.TextTestRunner(verbosity=2).run(checksum_test_suite)
+
+list_files_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestListFiles)
+unittest.TextTestRunner(verbosity=2).run(list_files_test_suite)
+
+account_index_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestAccountIndex)
+unittest.TextTestRunner(verbosity=2).run(account_index_test_suite)
+
+package_manager_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestPackageManager)
+unittest.TextTestRunner(verbosity=2).run(package_manager_test_suite)
+
+journal_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestCheckpointJournal)
+unittest.TextTestRunner(verbosity=2).run(journal_test_suite)
+
+shell_session_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestShellSession)
+unittest.TextTestRunner(verbosity=2).run(shell_session_test_suite)
+
+fan_out_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestMultiHostFanOut)
+unittest.TextTestRunner(verbosity=2).run(fan_out_test_suite)
+
+metrics_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestCommandMetrics)
+unittest.TextTestRunner(verbosity=2).run(metrics_test_suite)
+
+command_template_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestCommandTemplate)
+unittest.TextTestRunner(verbosity=2).run(command_template_test_suite)
+
+parameter_sweep_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestParameterSweep)
+unittest.TextTestRunner(verbosity=2).run(parameter_sweep_test_suite)
+
+resource_pool_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestResourcePool)
+unittest.TextTestRunner(verbosity=2).run(resource_pool_test_suite)
+
+timeouts_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestTimeoutsAndCancellation)
+unittest.TextTestRunner(verbosity=2).run(timeouts_test_suite)
+
+tree_operations_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestTreeOperations)
+unittest.TextTestRunner(verbosity=2).run(tree_operations_test_suite)
+
+change_tree_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestChangeTree)
+unittest.TextTestRunner(verbosity=2).run(change_tree_test_suite)
+
+tree_sync_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestTreeSync)
+unittest.TextTestRunner(verbosity=2).run(tree_sync_test_suite)
+
+web_get_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestWebGet)
+unittest.TextTestRunner(verbosity=2).run(web_get_test_suite)
+
+system_info_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestSystemInfo)
+unittest.TextTestRunner(verbosity=2).run(system_info_test_suite)
+
+query_cache_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestQueryCache)
+unittest.TextTestRunner(verbosity=2).run(query_cache_test_suite)
+
+async_wrapper_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestAsyncOperationWrapper)
+unittest.TextTestRunner(verbosity=2).run(async_wrapper_test_suite)
+
+execution_plan_test_suite = unittest.TestLoader().loadTestsFromTestCase(TestExecutionPlan)
+unittest.TextTestRunner(verbosity=2).run(execution_plan_test_suite)
@@ -0,0 +1,432 @@
+import collections
+import contextlib
+import hashlib
+import http.client
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent import futures
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
+
+from conductor import trees
+
+
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+DEFAULT_CACHE_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "conductor", "downloads")
+READ_SIZE = 256 * 1024
+MAX_REDIRECTS = 5
+_REDIRECTS = (301, 302, 303, 307, 308)
+_CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+DownloadResult = collections.namedtuple("DownloadResult", [
+    "url", "filename", "size", "sha256", "etag", "from_cache", "resumed", "segments",
+    "duration"])
+
+
+class DownloadError(IOError):
+    """Raised when a URL can't be fetched or doesn't match its digest."""
+
+
+class HTTPConnectionPool(object):
+    """Keeps idle HTTP/1.1 connections open per host so later requests skip
+    the TCP and TLS handshakes.
+
+    A connection goes back into the pool only once its response has been
+    read to the end and the server didn't ask to close it. A request that
+    fails on a reused connection, which the server may have timed out, is
+    retried once on a fresh one.
+
+    Args:
+        timeout (float): Socket timeout in seconds.
+        max_idle_per_host (int): Idle connections kept per host.
+    """
+
+    def __init__(self, timeout=30, max_idle_per_host=8):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+
+    @staticmethod
+    def _key(url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise DownloadError("unsupported URL {url!r}".format(url=url))
+        return parts.scheme, parts.netloc
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def _send(self, method, url, headers):
+        key = self._key(url)
+        parts = urlsplit(url)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        with self._lock:
+            connection = self._idle[key].pop() if self._idle[key] else None
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._connect(key)
+            try:
+                connection.request(method, target, headers=headers)
+                return key, connection, connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = None, False
+
+    def _release(self, key, connection, response):
+        if response.isclosed() and not response.will_close:
+            with self._lock:
+                if len(self._idle[key]) < self.max_idle_per_host:
+                    self._idle[key].append(connection)
+                    return
+        connection.close()
+
+    @contextlib.contextmanager
+    def open(self, method, url, headers=None):
+        """Sends a request, following redirects, and yields the response.
+
+        The response's url attribute is set to the final URL. Read the body
+        to the end to let the connection be reused.
+        """
+        headers = dict(headers or {})
+        for _ in range(MAX_REDIRECTS + 1):
+            key, connection, response = self._send(method, url, headers)
+            location = response.getheader("Location")
+            if response.status in _REDIRECTS and location:
+                response.read()
+                self._release(key, connection, response)
+                url = urljoin(url, location)
+                continue
+            response.url = url
+            try:
+                yield response
+            finally:
+                self._release(key, connection, response)
+            return
+        raise DownloadError("too many redirects for {url!r}".format(url=url))
+
+    def close(self):
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+
+def _atomic_json(data, filename):
+    handle, temp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                         suffix=".tmp")
+    with os.fdopen(handle, "w") as output:
+        json.dump(data, output)
+    os.replace(temp_name, filename)
+
+
+def _sha256(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadCache(object):
+    """A content-addressed store of downloaded files.
+
+    Each file is kept once under its sha256 digest, and an index maps every
+    URL to the digest, ETag and Last-Modified date it was last fetched with,
+    so a later download can ask the server whether it changed, and a
+    download with a known digest needs no request at all.
+
+    Args:
+        cache_directory (str): Where the store lives. Created if needed.
+    """
+
+    def __init__(self, cache_directory=DEFAULT_CACHE_DIRECTORY):
+        self.cache_directory = cache_directory
+        self.index_filename = os.path.join(cache_directory, "index.json")
+        self._lock = threading.Lock()
+        os.makedirs(cache_directory, exist_ok=True)
+        try:
+            with open(self.index_filename, "r") as index_file:
+                self._index = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            self._index = {}
+
+    def blob_path(self, sha256):
+        return os.path.join(self.cache_directory, "sha256", sha256[:2], sha256)
+
+    def has(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+
+    def lookup(self, url):
+        """Returns {"sha256", "etag", "last_modified", "size"} for the last
+        download of url, or None if it isn't cached."""
+        with self._lock:
+            entry = self._index.get(url)
+        if entry is None or not self.has(entry["sha256"]):
+            return None
+        return entry
+
+    def store(self, url, filename, sha256, etag=None, last_modified=None):
+        """Adds a downloaded file to the store and records it for url."""
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            temp_name = "{blob}.{pid}.{thread}.tmp".format(blob=blob, pid=os.getpid(),
+                                                           thread=threading.get_ident())
+            trees.copy_file(filename, temp_name)
+            os.replace(temp_name, blob)
+        with self._lock:
+            self._index[url] = {"sha256": sha256, "etag": etag, "last_modified": last_modified,
+                                "size": os.path.getsize(blob)}
+            _atomic_json(self._index, self.index_filename)
+
+    def materialize(self, sha256, filename):
+        """Copies a stored file to filename, replacing it atomically."""
+        temp_name = "{filename}.{thread}.tmp".format(filename=filename,
+                                                     thread=threading.get_ident())
+        trees.copy_file(self.blob_path(sha256), temp_name)
+        os.replace(temp_name, filename)
+
+
+class _PartialDownload(object):
+    """A download in progress: the ".part" file plus a small JSON sidecar
+    listing which segments are already complete, so an interrupted download
+    picks up where it left off."""
+
+    def __init__(self, filename):
+        self.part_filename = filename + ".part"
+        self.state_filename = filename + ".part.json"
+        self._lock = threading.Lock()
+        self.state = {}
+        try:
+            with open(self.state_filename, "r") as state_file:
+                self.state = json.load(state_file)
+        except (IOError, OSError, ValueError):
+            pass
+
+    def completed(self, url, etag, size):
+        """Returns the segments already downloaded for the same URL and
+        version of the file, starting afresh if anything differs."""
+        state = self.state
+        if etag and state.get("url") == url and state.get("etag") == etag and \
+                state.get("size") == size and os.path.exists(self.part_filename) and \
+                os.path.getsize(self.part_filename) == size:
+            return set(state.get("done", []))
+        self.state = {"url": url, "etag": etag, "size": size, "done": []}
+        with open(self.part_filename, "wb") as part:
+            part.truncate(size)
+        return set()
+
+    def mark_done(self, index):
+        with self._lock:
+            self.state["done"].append(index)
+            _atomic_json(self.state, self.state_filename)
+
+    def finish(self, filename):
+        os.replace(self.part_filename, filename)
+        if os.path.exists(self.state_filename):
+            os.remove(self.state_filename)
+
+
+class Downloader(object):
+    """Downloads many URLs at once, reusing connections, splitting large
+    files into concurrent range requests and skipping anything the cache
+    already holds.
+
+    A URL in the cache is revalidated with If-None-Match or
+    If-Modified-Since and copied from the cache if the server says it is
+    unchanged. Otherwise a download starts with a request for the first
+    segment. If the server
+    answers with a partial response, the rest of the file is fetched as
+    further segments in parallel, and completed segments survive an
+    interruption: the next attempt resumes them as long as the ETag is
+    unchanged. Servers without range support are read in one stream.
+
+    Args:
+        cache_directory (str): A DownloadCache directory, e.g.
+            DEFAULT_CACHE_DIRECTORY, or "" for no cache. Defaults to "".
+        jobs (int): URLs downloaded at once by download_many.
+        segments (int): Range requests in flight per file.
+        segment_size (int): Bytes per range request.
+        pool (HTTPConnectionPool): Connections to reuse. Defaults to a new
+            pool.
+        progress (callable): Called as progress(url, bytes_done, total) as
+            data arrives; total is None if unknown.
+    """
+
+    def __init__(self, cache_directory="", jobs=4, segments=4,
+                 segment_size=DEFAULT_SEGMENT_SIZE, pool=None, progress=None):
+        self.cache = DownloadCache(cache_directory) if cache_directory else None
+        self.jobs = jobs
+        self.segments = segments
+        self.segment_size = segment_size
+        self.pool = pool or HTTPConnectionPool()
+        self.progress = progress
+
+    def _report(self, counter, url, count, total):
+        if self.progress is None:
+            return
+        with counter["lock"]:
+            counter["done"] += count
+            done = counter["done"]
+        self.progress(url, done, total)
+
+    def _write_body(self, response, fd, offset, url, counter, total):
+        written = 0
+        while True:
+            chunk = response.read(READ_SIZE)
+            if not chunk:
+                return written
+            os.pwrite(fd, chunk, offset + written)
+            written += len(chunk)
+            self._report(counter, url, len(chunk), total)
+
+    def _fetch_segment(self, url, etag, start, end, fd, counter, total):
+        headers = {"Range": "bytes={start}-{end}".format(start=start, end=end)}
+        if etag:
+            headers["If-Range"] = etag
+        with self.pool.open("GET", url, headers) as response:
+            if response.status != 206:
+                response.read()
+                raise DownloadError("{url} changed during download (HTTP {status})".format(
+                    url=url, status=response.status))
+            written = self._write_body(response, fd, start, url, counter, total)
+        if written != end - start + 1:
+            raise DownloadError("{url}: short segment at byte {start}".format(url=url, start=start))
+
+    def _from_cache(self, url, filename, entry, started):
+        self.cache.materialize(entry["sha256"], filename)
+        return DownloadResult(url, filename, entry["size"], entry["sha256"], entry.get("etag"),
+                              True, False, 0, time.time() - started)
+
+    def download(self, url, filename, expected_sha256=None):
+        """Downloads one URL to filename.
+
+        Args:
+            url (str): http or https URL.
+            filename (str): Where to save it. Replaced atomically once the
+                download is complete and verified.
+            expected_sha256 (str): If given, the download must have this
+                digest, and a cached copy with it is used without any
+                request.
+
+        Returns:
+            DownloadResult: Size, digest and ETag of the file, whether it
+                came from the cache or resumed a partial download, how many
+                range requests were made and how long it took.
+
+        Raises:
+            DownloadError: On an HTTP error or a digest mismatch.
+        """
+        started = time.time()
+        if self.cache is not None and expected_sha256 and self.cache.has(expected_sha256):
+            entry = {"sha256": expected_sha256,
+                     "size": os.path.getsize(self.cache.blob_path(expected_sha256))}
+            return self._from_cache(url, filename, entry, started)
+
+        entry = self.cache.lookup(url) if self.cache is not None else None
+        headers = {"Range": "bytes=0-{end}".format(end=self.segment_size - 1)}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        elif entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        partial = _PartialDownload(filename)
+        counter = {"lock": threading.Lock(), "done": 0}
+        resumed = False
+        segments = 0
+        with self.pool.open("GET", url, headers) as response:
+            if response.status == 304 and entry:
+                response.read()
+                return self._from_cache(url, filename, entry, started)
+            etag = response.getheader("ETag")
+            last_modified = response.getheader("Last-Modified")
+            match = _CONTENT_RANGE.match(response.getheader("Content-Range") or "")
+
+            if response.status == 206 and match and match.group(3) != "*":
+                total = int(match.group(3))
+                done = partial.completed(url, etag, total)
+                resumed = bool(done)
+                ranges = [(start, min(start + self.segment_size, total) - 1)
+                          for start in range(0, total, self.segment_size)]
+                segments = len(ranges)
+                fd = os.open(partial.part_filename, os.O_RDWR)
+                try:
+                    if 0 in done:
+                        response.read()
+                    else:
+                        self._write_body(response, fd, 0, url, counter, total)
+                        partial.mark_done(0)
+                    todo = [index for index in range(1, len(ranges)) if index not in done]
+                    with futures.ThreadPoolExecutor(max_workers=self.segments) as executor:
+                        pending = dict((executor.submit(self._fetch_segment, url, etag,
+                                                        ranges[index][0], ranges[index][1],
+                                                        fd, counter, total), index)
+                                       for index in todo)
+                        for future in futures.as_completed(pending):
+                            future.result()
+                            partial.mark_done(pending[future])
+                finally:
+                    os.close(fd)
+            elif response.status in (200, 416):
+                if response.status == 416:
+                    response.read()  # an empty file has no byte 0 to ask for
+                    response = None
+                total = response and response.length
+                with open(partial.part_filename, "wb") as part:
+                    if response is not None:
+                        self._write_body(response, part.fileno(), 0, url, counter, total)
+                segments = 1
+            else:
+                response.read()
+                raise DownloadError("{url}: HTTP {status} {reason}".format(
+                    url=url, status=response.status, reason=response.reason))
+
+        sha256 = _sha256(partial.part_filename)
+        if expected_sha256 and sha256 != expected_sha256:
+            os.remove(partial.part_filename)
+            raise DownloadError("{url}: expected sha256 {expected}, got {actual}".format(
+                url=url, expected=expected_sha256, actual=sha256))
+        if self.cache is not None:
+            self.cache.store(url, partial.part_filename, sha256, etag, last_modified)
+        partial.finish(filename)
+        return DownloadResult(url, filename, os.path.getsize(filename), sha256, etag,
+                              False, resumed, segments, time.time() - started)
+
+    def download_many(self, downloads):
+        """Downloads several URLs at once.
+
+        Args:
+            downloads (List[tuple]): (url, filename) or
+                (url, filename, expected_sha256) tuples.
+
+        Returns:
+            List[DownloadResult]: One per download, in the order given.
+        """
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            pending = [executor.submit(self.download, *download) for download in downloads]
+            return [future.result() for future in pending]
+
+    def close(self):
+        self.pool.close()
+
+
+def default_filename(url):
+    """Names a download like wget does: the last part of the URL's path, or
+    index.html."""
+    return os.path.basename(urlsplit(url).path) or "index.html"
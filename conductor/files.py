@@ -0,0 +1,208 @@
+import codecs
+import collections
+import itertools
+import mmap
+import os
+from concurrent import futures
+
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_ENCODING = "utf-8"
+
+FileEntry = collections.namedtuple("FileEntry", [
+    "path", "name", "is_dir", "is_symlink", "size", "mtime", "mode", "uid",
+    "gid", "inode", "nlink"])
+
+
+def _decode(data):
+    return data.decode(DEFAULT_ENCODING, "replace")
+
+
+def head_file(filename, number_of_lines):
+    """Reads the first lines of a file without reading the rest of it.
+
+    Args:
+        filename (str): Name of file to read.
+        number_of_lines (int or str): Number of lines to return.
+
+    Returns:
+        str: The first number_of_lines lines, newlines included.
+
+    Raises:
+        ValueError: If number_of_lines isn't a whole number.
+    """
+    number_of_lines = int(number_of_lines)
+    with open(filename, "rb") as source:
+        return _decode(b"".join(itertools.islice(source, max(number_of_lines, 0))))
+
+
+def tail_file(filename, number_of_lines, block_size=DEFAULT_BLOCK_SIZE):
+    """Reads the last lines of a file by seeking backwards from the end in
+    blocks, so the cost depends on the size of the tail, not of the file.
+
+    Args:
+        filename (str): Name of file to read.
+        number_of_lines (int or str): Number of lines to return.
+        block_size (int): Bytes read per backwards step.
+
+    Returns:
+        str: The last number_of_lines lines, newlines included.
+
+    Raises:
+        ValueError: If number_of_lines isn't a whole number.
+    """
+    number_of_lines = int(number_of_lines)
+    if number_of_lines <= 0:
+        return ""
+
+    with open(filename, "rb") as source:
+        position = source.seek(0, os.SEEK_END)
+        if position == 0:
+            return ""
+        source.seek(position - 1)
+        # A final newline terminates the last line rather than starting a new
+        # one, so one more newline has to be found before the wanted lines.
+        needed = number_of_lines + (1 if source.read(1) == b"\n" else 0)
+
+        blocks = []
+        newlines = 0
+        while position > 0 and newlines < needed:
+            size = min(block_size, position)
+            position -= size
+            source.seek(position)
+            block = source.read(size)
+            blocks.append(block)
+            newlines += block.count(b"\n")
+
+    data = b"".join(reversed(blocks))
+    if newlines >= needed:
+        cut = len(data)
+        for _ in range(needed):
+            cut = data.rindex(b"\n", 0, cut)
+        data = data[cut + 1:]
+    return _decode(data)
+
+
+def read_file(filename):
+    """Reads a whole file as text.
+
+    Args:
+        filename (str): Name of file to read.
+
+    Returns:
+        str: The decoded contents of the file.
+    """
+    with open(filename, "rb") as source:
+        return _decode(source.read())
+
+
+def iter_file_chunks(filename, chunk_size=DEFAULT_BLOCK_SIZE):
+    """Yields a file's text a chunk at a time, so that arbitrarily large files
+    can be scanned in constant memory. Multi-byte characters split across a
+    chunk boundary are decoded correctly.
+
+    Args:
+        filename (str): Name of file to read.
+        chunk_size (int): Bytes read per chunk.
+
+    Yields:
+        str: Consecutive pieces of the file.
+    """
+    decoder = codecs.getincrementaldecoder(DEFAULT_ENCODING)("replace")
+    with open(filename, "rb") as source:
+        for block in iter(lambda: source.read(chunk_size), b""):
+            text = decoder.decode(block)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def map_file(filename):
+    """Maps a file into memory read-only. Pages are loaded lazily by the
+    kernel, so slicing or searching a large file only touches the parts that
+    are used.
+
+    Args:
+        filename (str): Name of file to map.
+
+    Returns:
+        mmap.mmap or bytes: A read-only mapping of the file. Empty files
+            can't be mapped, so b"" is returned for those.
+    """
+    with open(filename, "rb") as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _iter_entries(directory, include_hidden):
+    with os.scandir(directory) as iterator:
+        for dir_entry in iterator:
+            if not include_hidden and dir_entry.name.startswith("."):
+                continue
+            try:
+                stat_result = dir_entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue  # removed between readdir and stat
+            yield FileEntry(path=dir_entry.path, name=dir_entry.name,
+                            is_dir=dir_entry.is_dir(follow_symlinks=False),
+                            is_symlink=dir_entry.is_symlink(),
+                            size=stat_result.st_size,
+                            mtime=stat_result.st_mtime,
+                            mode=stat_result.st_mode,
+                            uid=stat_result.st_uid, gid=stat_result.st_gid,
+                            inode=stat_result.st_ino,
+                            nlink=stat_result.st_nlink)
+
+
+def _scan_one_directory(directory, include_hidden):
+    entries = list(_iter_entries(directory, include_hidden))
+    return entries, [entry.path for entry in entries if entry.is_dir]
+
+
+def scan_directory(directory=".", recursive=False, jobs=1, include_hidden=False):
+    """Lists a directory with os.scandir, yielding one FileEntry per item.
+
+    Entries are yielded as they are read, so only the queue of directories
+    still to visit is held in memory. With jobs > 1 each directory is read
+    whole on a worker thread before its entries are handed over. Symlinks are
+    reported but never followed.
+
+    Args:
+        directory (str): Directory to list. Defaults to the current one.
+        recursive (bool): Also list every subdirectory. Defaults to False.
+        jobs (int): For recursive listings, how many directories to read at
+            once. Values above 1 help on network and spinning-disk file
+            systems where each readdir/stat waits on I/O. Defaults to 1.
+        include_hidden (bool): Include names starting with ".". Defaults to
+            False, like ls.
+
+    Yields:
+        FileEntry: Typed details of each file or directory. Order within a
+            directory is whatever the file system returns; with jobs > 1
+            directories are also interleaved.
+    """
+    if not recursive or jobs <= 1:
+        pending = [directory]
+        while pending:
+            subdirectories = []
+            for entry in _iter_entries(pending.pop(), include_hidden):
+                if recursive and entry.is_dir:
+                    subdirectories.append(entry.path)
+                yield entry
+            pending.extend(reversed(subdirectories))
+        return
+
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = set([executor.submit(_scan_one_directory, directory, include_hidden)])
+        while running:
+            done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                entries, subdirectories = future.result()
+                for subdirectory in subdirectories:
+                    running.add(executor.submit(_scan_one_directory, subdirectory,
+                                                include_hidden))
+                for entry in entries:
+                    yield entry
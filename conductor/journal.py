@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def step_keys(steps):
+    """Fingerprints each step by its command text and everything upstream.
+
+    A step's key is a hash of its own command plus the keys of the steps it
+    depends on, so editing one line changes the key of that line and of
+    every step downstream of it, but of nothing else.
+
+    Args:
+        steps (List[Step]): Steps in file order, as returned by
+            parse_command_lines.
+
+    Returns:
+        dict: Maps step id to a hex key.
+    """
+    keys = {}
+    for step in steps:
+        digest = hashlib.sha256(step.command_string.encode("utf-8"))
+        for dep in sorted(keys[dep] for dep in step.depends_on):
+            digest.update(b"\0")
+            digest.update(dep.encode("ascii"))
+        keys[step.step_id] = digest.hexdigest()
+    return keys
+
+
+class CheckpointJournal(object):
+    """An append-only record of finished commands, one JSON object per line.
+
+    Each line holds a step's key (see step_keys), id, command, exit status,
+    start time and duration. Lines are flushed and fsynced as they are
+    written, so the journal survives the run being killed part way.
+
+    Args:
+        journal_filename (str): Where the journal is kept. Created on first
+            write.
+    """
+
+    def __init__(self, journal_filename):
+        self.journal_filename = journal_filename
+        self._lock = threading.Lock()
+        self._succeeded = set()
+        if os.path.exists(journal_filename):
+            with open(journal_filename, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    if record.get("exit_code") == 0:
+                        self._succeeded.add(record["key"])
+                    else:
+                        self._succeeded.discard(record.get("key"))
+
+    def has_succeeded(self, key):
+        return key in self._succeeded
+
+    def record(self, key, step, result):
+        """Appends the outcome of a step to the journal."""
+        entry = {
+            "key": key,
+            "step_id": step.step_id,
+            "command": step.command_string,
+            "exit_code": result.exit_code,
+            "started": result.started,
+            "duration": result.duration,
+        }
+        with self._lock:
+            with open(self.journal_filename, "a") as journal_file:
+                journal_file.write(json.dumps(entry, sort_keys=True) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            if result.exit_code == 0:
+                self._succeeded.add(key)
+            else:
+                self._succeeded.discard(key)
+
+    def resume_steps(self, steps, keys):
+        """Removes the steps that can be skipped on a rerun.
+
+        A step is skipped when the journal shows it succeeded with the same
+        key, and every step it depends on is being skipped too. Anything that
+        follows a step which is re-run, for whatever reason, runs again.
+
+        Args:
+            steps (List[Step]): Steps in file order.
+            keys (dict): Step keys, as returned by step_keys.
+
+        Returns:
+            tuple(List[Step], List[str]): The steps still to run, with
+                dependencies on skipped steps removed, and the ids of the
+                skipped steps.
+        """
+        skipped = set()
+        remaining = []
+        for step in steps:
+            if self.has_succeeded(keys[step.step_id]) and all(
+                    dep in skipped for dep in step.depends_on):
+                skipped.add(step.step_id)
+                continue
+            remaining.append(step.replace(
+                depends_on=[dep for dep in step.depends_on if dep not in skipped]))
+        return remaining, [step.step_id for step in steps if step.step_id in skipped]
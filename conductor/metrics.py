@@ -0,0 +1,121 @@
+import collections
+import json
+import os
+import shlex
+import tempfile
+import threading
+
+
+def command_metrics(result):
+    """Flattens the measurements of a CommandResult into a dictionary.
+
+    Args:
+        result (CommandResult): A finished command.
+
+    Returns:
+        dict: JSON-serialisable metrics for the command.
+    """
+    return {
+        "command": result.command_string,
+        "host": result.host,
+        "started": result.started,
+        "wall_time": result.duration,
+        "user_time": result.user_time,
+        "system_time": result.system_time,
+        "max_rss": result.max_rss,
+        "exit_code": result.exit_code,
+        "stdout_size": result.stdout_size,
+        "stderr_size": result.stderr_size,
+    }
+
+
+def program_name(command_string):
+    """Returns the program a command runs, for use as a low-cardinality
+    label: "apt-get" for "sudo apt-get -y install git"."""
+    try:
+        words = shlex.split(command_string)
+    except ValueError:
+        words = command_string.split()
+    while words and (words[0] == "sudo" or "=" in words[0]):
+        words.pop(0)
+    return os.path.basename(words[0]) if words else ""
+
+
+def _write_atomically(filename, text):
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(handle, "w") as temp_file:
+        temp_file.write(text)
+    os.chmod(temp_name, 0o644)
+    os.replace(temp_name, filename)
+
+
+class JsonLinesExporter(object):
+    """A command hook that appends one JSON object per command to a file.
+
+    Args:
+        filename (str): File to append to.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def __call__(self, result):
+        line = json.dumps(command_metrics(result), sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.filename, "a") as metrics_file:
+                metrics_file.write(line)
+
+
+class PrometheusExporter(object):
+    """A command hook that keeps running totals per program and rewrites them
+    to a file in the Prometheus text format after each command, e.g. for the
+    node_exporter textfile collector.
+
+    Args:
+        filename (str): File to write. Replaced atomically, so scrapers never
+            see it half written.
+        prefix (str): Prefix for every metric name.
+    """
+
+    def __init__(self, filename, prefix="conductor_command"):
+        self.filename = filename
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._totals = collections.defaultdict(lambda: collections.defaultdict(float))
+
+    def __call__(self, result):
+        labels = (program_name(result.command_string),
+                  "success" if result.succeeded else "failure")
+        with self._lock:
+            totals = self._totals[labels]
+            totals["count"] += 1
+            totals["wall_seconds"] += result.duration
+            totals["user_seconds"] += result.user_time or 0
+            totals["system_seconds"] += result.system_time or 0
+            totals["output_bytes"] += result.stdout_size + result.stderr_size
+            totals["max_rss_bytes"] = max(totals["max_rss_bytes"], result.max_rss or 0)
+            _write_atomically(self.filename, self.render())
+
+    def render(self):
+        """Returns the current totals in the Prometheus text format."""
+        metrics = [
+            ("total", "counter", "count", "Commands run."),
+            ("seconds_total", "counter", "wall_seconds", "Wall-clock time spent in commands."),
+            ("user_cpu_seconds_total", "counter", "user_seconds", "User CPU time used by commands."),
+            ("system_cpu_seconds_total", "counter", "system_seconds",
+             "System CPU time used by commands."),
+            ("output_bytes_total", "counter", "output_bytes", "Output written by commands."),
+            ("max_rss_bytes", "gauge", "max_rss_bytes", "Largest peak RSS seen for a command."),
+        ]
+        lines = []
+        for suffix, metric_type, key, help_text in metrics:
+            name = "{prefix}_{suffix}".format(prefix=self.prefix, suffix=suffix)
+            lines.append("# HELP {name} {help}".format(name=name, help=help_text))
+            lines.append("# TYPE {name} {type}".format(name=name, type=metric_type))
+            for (program, status), totals in sorted(self._totals.items()):
+                lines.append('{name}{{program="{program}",status="{status}"}} {value}'.format(
+                    name=name, program=program.replace("\\", "\\\\").replace('"', '\\"'),
+                    status=status, value=repr(float(totals[key]))))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,304 @@
+import os
+import re
+import threading
+import time
+
+from conductor.process import CommandResult
+from conductor.resources import parse_memory
+
+
+DPKG_STATUS_FILENAME = "/var/lib/dpkg/status"
+APT_LISTS_DIRECTORY = "/var/lib/apt/lists"
+APT_SOURCES = ("/etc/apt/sources.list", "/etc/apt/sources.list.d")
+
+DEFAULT_UPDATE_MAX_AGE = 3600
+
+_APT_UPDATE = re.compile(r"^(?:sudo\s+)?apt-get\s+(?:-\S+\s+)*update\s*$")
+_APT_INSTALL = re.compile(
+    r"^(?P<prefix>(?:sudo\s+)?apt-get\s+(?:-\S+\s+)*install)\s+(?P<args>.+)$")
+_SHELL_SYNTAX = re.compile(r"""[;&|<>`$()\\'"*?]""")
+# Options whose value is a separate word, which would be mistaken for a
+# package name.
+_OPTIONS_WITH_VALUES = ("-o", "-t", "-c", "--option", "--target-release",
+                        "--config-file")
+
+
+def parse_install_command(command_string):
+    """Splits a simple apt-get install command into its parts.
+
+    Args:
+        command_string (str): A shell command.
+
+    Returns:
+        tuple(str, List[str]) or None: The command up to and including
+            "install" followed by any options as one normalised string, and
+            the list of packages. None if the command is anything else, or
+            uses shell syntax that makes it unsafe to rewrite.
+    """
+    command_string = command_string.strip()
+    if _SHELL_SYNTAX.search(command_string):
+        return None
+    match = _APT_INSTALL.match(command_string)
+    if not match:
+        return None
+
+    words = match.group("prefix").split() + match.group("args").split()
+    options = [word for word in words if word.startswith("-")]
+    if any(option in _OPTIONS_WITH_VALUES for option in options):
+        return None
+    packages = [word for word in match.group("args").split() if not word.startswith("-")]
+    if not packages:
+        return None
+    head = " ".join([word for word in match.group("prefix").split()
+                     if not word.startswith("-")] + sorted(options))
+    return head, packages
+
+
+def is_update_command(command_string):
+    return bool(_APT_UPDATE.match(command_string.strip()))
+
+
+def _package_name(package):
+    # "vim=2:8.0", "vim:amd64" and "vim/xenial" all refer to vim. A pinned
+    # version is only treated as satisfied by the exact installed version.
+    return re.split(r"[=:/]", package, 1)[0]
+
+
+class DpkgStatus(object):
+    """An index of installed packages read straight from dpkg's status file.
+
+    The file is re-read whenever its mtime or size changes, so the index
+    stays correct across installs made by other commands.
+
+    Args:
+        status_filename (str): Defaults to /var/lib/dpkg/status.
+    """
+
+    def __init__(self, status_filename=DPKG_STATUS_FILENAME):
+        self.status_filename = status_filename
+        self._lock = threading.Lock()
+        self._signature = None
+        self._installed = {}
+
+    def refresh(self):
+        try:
+            stat_result = os.stat(self.status_filename)
+        except FileNotFoundError:
+            signature = None
+        else:
+            signature = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+        with self._lock:
+            if signature == self._signature and self._signature is not None:
+                return
+            installed = {}
+            if signature is not None:
+                with open(self.status_filename, "r", errors="replace") as status_file:
+                    fields = {}
+                    for line in status_file:
+                        if line.strip() == "":
+                            self._add_record(installed, fields)
+                            fields = {}
+                        elif not line[0].isspace() and ":" in line:
+                            key, value = line.split(":", 1)
+                            fields[key] = value.strip()
+                    self._add_record(installed, fields)
+            self._installed = installed
+            self._signature = signature
+
+    @staticmethod
+    def _add_record(installed, fields):
+        if fields.get("Status", "").endswith(" installed") and "Package" in fields:
+            installed[fields["Package"]] = fields.get("Version", "")
+
+    def installed_version(self, package):
+        """Returns the installed version of package, or None."""
+        self.refresh()
+        return self._installed.get(_package_name(package))
+
+    def is_installed(self, package):
+        """Checks a package name, optionally pinned as name=version."""
+        version = self.installed_version(package)
+        if version is None:
+            return False
+        if "=" in package:
+            return package.split("=", 1)[1] == version
+        return True
+
+
+class AptPackageManager(object):
+    """Runs apt-get on behalf of OperationWrapper, avoiding work that has
+    already been done.
+
+    - Packages dpkg already lists as installed are dropped before apt-get
+      is called, and if nothing is left apt-get is not run at all.
+    - apt-get update is skipped while the package lists are younger than
+      update_max_age seconds and newer than every apt source file, so a
+      source added since the last update still triggers a fresh one.
+    - apt-get commands are serialised, since dpkg holds a global lock and
+      concurrent runs would fail rather than wait.
+
+    Args:
+        run_command (callable): Runs a shell string and returns a
+            CommandResult.
+        dpkg_status (DpkgStatus): Index of installed packages.
+        update_max_age (float): Freshness window for apt-get update in
+            seconds. 0 disables skipping.
+        lists_directory (str): Directory apt-get update refreshes.
+        sources (List[str]): apt source files and directories.
+        local (bool): Whether run_command runs commands on this machine. If
+            not, dpkg's status and apt's lists here say nothing about where
+            apt-get runs, so update and install always run it. Defaults to
+            True.
+    """
+
+    def __init__(self, run_command, dpkg_status=None,
+                 update_max_age=DEFAULT_UPDATE_MAX_AGE,
+                 lists_directory=APT_LISTS_DIRECTORY, sources=APT_SOURCES, local=True):
+        self.run_command = run_command
+        self.local = local
+        self.dpkg_status = dpkg_status or DpkgStatus()
+        self.update_max_age = update_max_age
+        self.lists_directory = lists_directory
+        self.sources = sources
+        self._apt_lock = threading.Lock()
+        self._last_update = 0
+
+    def lists_are_fresh(self):
+        """Checks whether apt-get update can be skipped."""
+        if not self.local or self.update_max_age <= 0:
+            return False
+        try:
+            lists_mtime = os.stat(self.lists_directory).st_mtime
+        except FileNotFoundError:
+            lists_mtime = 0
+        # apt only touches the directory when an index actually changed, so
+        # also count updates this object ran itself.
+        lists_mtime = max(lists_mtime, self._last_update)
+        if time.time() - lists_mtime > self.update_max_age:
+            return False
+        for source in self.sources:
+            try:
+                if os.stat(source).st_mtime > lists_mtime:
+                    return False
+            except FileNotFoundError:
+                continue
+        return True
+
+    def _run_apt(self, command_string):
+        with self._apt_lock:
+            return self.run_command(command_string)
+
+    def update(self, force=False, command_string="apt-get update"):
+        """Runs apt-get update unless the lists are still fresh.
+
+        Returns:
+            CommandResult: The result, or a successful empty result if the
+                update was skipped.
+        """
+        if not force and self.lists_are_fresh():
+            return CommandResult(command_string, 0)
+        started = time.time()
+        result = self._run_apt(command_string)
+        if result.succeeded:
+            self.mark_updated(started)
+        return result
+
+    def mark_updated(self, started):
+        """Records that an apt-get update started at started succeeded, for
+        updates run by other means than update()."""
+        self._last_update = max(self._last_update, started)
+
+    def missing_packages(self, packages):
+        if not self.local:
+            return list(packages)
+        return [package for package in packages
+                if not self.dpkg_status.is_installed(package)]
+
+    def install(self, packages, command_prefix="apt-get -y install"):
+        """Installs every package that isn't installed yet in one apt-get
+        transaction.
+
+        Args:
+            packages (List[str]): Package names, optionally as name=version.
+            command_prefix (str): The apt-get invocation to append the
+                package names to.
+
+        Returns:
+            CommandResult: The result, or a successful empty result if
+                everything was already installed.
+        """
+        missing = self.missing_packages(packages)
+        if not missing:
+            return CommandResult("{prefix} {packages}".format(
+                prefix=command_prefix, packages=" ".join(packages)), 0)
+        return self._run_apt("{prefix} {packages}".format(
+            prefix=command_prefix, packages=" ".join(missing)))
+
+    def run(self, command_string):
+        """Runs any shell command, routing simple apt-get update and install
+        commands through update() and install().
+
+        Returns:
+            CommandResult: The result of the command.
+        """
+        if is_update_command(command_string):
+            return self.update(command_string=command_string.strip())
+        parsed = parse_install_command(command_string)
+        if parsed is not None:
+            command_prefix, packages = parsed
+            return self.install(packages, command_prefix=command_prefix)
+        return self.run_command(command_string)
+
+
+def _larger(first, second, parse):
+    if first is None or second is None:
+        return second if first is None else first
+    return first if parse(first) >= parse(second) else second
+
+
+def batch_install_steps(steps):
+    """Merges runs of consecutive apt-get install steps into single steps.
+
+    Two steps are merged when the second depends on nothing but the first
+    and both are simple apt-get install commands with the same options, as
+    with consecutive plain lines in a command file. Later steps that depended
+    on a merged step are pointed at the step it was merged into.
+
+    Args:
+        steps (List[Step]): Steps as returned by parse_command_lines.
+
+    Returns:
+        List[Step]: The new list of steps. The input is not modified.
+    """
+    merged = []
+    renamed = {}
+    previous_packages = None
+    for step in steps:
+        depends_on = []
+        for dep in step.depends_on:
+            # Two dependencies may have been merged into the same step.
+            if renamed.get(dep, dep) not in depends_on:
+                depends_on.append(renamed.get(dep, dep))
+        parsed = parse_install_command(step.command_string)
+        last = merged[-1] if merged else None
+        if (parsed is not None and previous_packages is not None and
+                depends_on == [last.step_id] and parsed[0] == previous_packages[0]):
+            packages = previous_packages[1] + [package for package in parsed[1]
+                                               if package not in previous_packages[1]]
+            # The merged step runs both commands, so it needs whichever
+            # declared more.
+            cpus, memory = _larger(last.cpus, step.cpus, int), _larger(
+                last.memory, step.memory, parse_memory)
+            merged[-1] = last.replace(step_id=step.step_id, command_string="{prefix} {packages}".format(
+                prefix=parsed[0], packages=" ".join(packages)), cpus=cpus, memory=memory)
+            renamed[last.step_id] = step.step_id
+            for old_id, new_id in list(renamed.items()):
+                if new_id == last.step_id:
+                    renamed[old_id] = step.step_id
+            previous_packages = (parsed[0], packages)
+            continue
+
+        merged.append(step.replace(depends_on=depends_on))
+        previous_packages = parsed
+    return merged
@@ -0,0 +1,226 @@
+import collections
+import os
+import re
+import stat
+from concurrent import futures
+
+
+ChangeStats = collections.namedtuple("ChangeStats", ["examined", "changed"])
+
+_ALL_BITS = 0o7777
+_SET_ID_BITS = stat.S_ISUID | stat.S_ISGID
+_READ_BITS = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+_EXECUTE_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+_WHO_BITS = {
+    "u": stat.S_IRWXU | stat.S_ISUID,
+    "g": stat.S_IRWXG | stat.S_ISGID,
+    "o": stat.S_IRWXO | stat.S_ISVTX,
+    "a": _ALL_BITS,
+}
+_PERMISSION_BITS = {
+    "r": _READ_BITS,
+    "w": _WRITE_BITS,
+    "x": _EXECUTE_BITS,
+    "X": 0,
+    "s": _SET_ID_BITS,
+    "t": stat.S_ISVTX,
+}
+# "g=u" copies the user's bits, which are then moved to the who's place.
+_COPY_BITS = {"u": stat.S_IRWXU, "g": stat.S_IRWXG, "o": stat.S_IRWXO}
+_CLAUSE = re.compile(r"^(?P<who>[ugoa]*)(?P<actions>(?:[-+=](?:[ugo]|[rwxXst]*))+)$")
+_ACTION = re.compile(r"([-+=])([ugo]|[rwxXst]*)")
+
+# One operation of a compiled code. affected is 0 when no who letters were
+# given, mentioned holds the bits the code names explicitly.
+_Operation = collections.namedtuple(
+    "_Operation", ["operator", "letters", "affected", "value", "mentioned"])
+
+
+def _current_umask():
+    # Setting and restoring the umask would briefly change it for every
+    # thread, so read it from /proc where the kernel reports it.
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (IOError, OSError):
+        pass
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+def parse_mode(permission_code):
+    """Turns a chmod permission code into a function of the current mode.
+
+    Both octal codes such as "755" and symbolic ones such as "g+rwx",
+    "u=rwx,go-w", "a+X" or "g=u" are understood, with the same meaning as
+    for GNU chmod:
+
+    - A symbolic clause without u, g, o or a leaves the bits set in the
+      umask alone, though "=" still clears them.
+    - On a directory, set-user-ID and set-group-ID bits the code doesn't
+      mention are kept. An octal code only mentions the ones it sets,
+      unless it has a fifth leading digit, as in "00755".
+
+    Args:
+        permission_code (str): The code.
+
+    Returns:
+        callable: Called as mode_for(current_mode, is_dir) and returns the
+            permission bits the entry should end up with.
+
+    Raises:
+        ValueError: If the code can't be parsed.
+    """
+    if re.match(r"^[0-7]+$", permission_code):
+        mode = int(permission_code, 8)
+        if mode > _ALL_BITS:
+            raise ValueError("can't parse permission code {code!r}".format(code=permission_code))
+        mentioned = _ALL_BITS
+        if len(permission_code) < 5:
+            mentioned &= ~_SET_ID_BITS | mode
+        operations = [_Operation("=", "", _ALL_BITS, mode, mentioned)]
+        return lambda current_mode, is_dir: _adjust(current_mode, is_dir, operations, 0)
+
+    operations = []
+    for clause in permission_code.split(","):
+        match = _CLAUSE.match(clause)
+        if not match:
+            raise ValueError("can't parse permission code {code!r}".format(code=permission_code))
+        affected = 0
+        for letter in match.group("who"):
+            affected |= _WHO_BITS[letter]
+        for operator, letters in _ACTION.findall(match.group("actions")):
+            if letters in _COPY_BITS:
+                value = _COPY_BITS[letters]
+            else:
+                value = 0
+                for letter in letters:
+                    value |= _PERMISSION_BITS[letter]
+            operations.append(_Operation(operator, letters, affected, value,
+                                         affected & value if affected else value))
+    # The umask only matters to clauses without who letters.
+    umask = _current_umask() if any(not operation.affected for operation in operations) else 0
+    return lambda current_mode, is_dir: _adjust(current_mode, is_dir, operations, umask)
+
+
+def _adjust(current_mode, is_dir, operations, umask):
+    mode = stat.S_IMODE(current_mode)
+    for operation in operations:
+        omitted = _SET_ID_BITS & ~operation.mentioned if is_dir else 0
+        value = operation.value
+        if operation.letters in _COPY_BITS:
+            value &= mode
+            value = ((_READ_BITS if value & _READ_BITS else 0) |
+                     (_WRITE_BITS if value & _WRITE_BITS else 0) |
+                     (_EXECUTE_BITS if value & _EXECUTE_BITS else 0))
+        elif "X" in operation.letters and (is_dir or mode & _EXECUTE_BITS):
+            # Execute only for directories and files that are already
+            # executable by someone.
+            value |= _EXECUTE_BITS
+        value &= (operation.affected or ~umask) & ~omitted
+
+        if operation.operator == "+":
+            mode |= value
+        elif operation.operator == "-":
+            mode &= ~value
+        else:
+            # "=" clears every bit of the who, or every bit at all without
+            # who letters, whatever the umask says.
+            preserved = (~operation.affected if operation.affected else 0) | omitted
+            mode = (mode & preserved) | value
+    return mode
+
+
+class _Change(object):
+
+    def __init__(self, mode_for, uid, gid):
+        self.mode_for = mode_for
+        self.uid = uid
+        self.gid = gid
+
+    def apply(self, path, stat_result):
+        """Changes what differs on one entry; returns whether it changed."""
+        changed = False
+        if (self.uid != -1 and stat_result.st_uid != self.uid) or \
+                (self.gid != -1 and stat_result.st_gid != self.gid):
+            os.chown(path, self.uid, self.gid, follow_symlinks=False)
+            changed = True
+            # chown clears set-id bits on files, so look again before
+            # deciding whether the mode still needs changing.
+            if self.mode_for is not None:
+                stat_result = os.lstat(path)
+        if self.mode_for is not None:
+            mode = self.mode_for(stat_result.st_mode, stat.S_ISDIR(stat_result.st_mode))
+            if mode != stat.S_IMODE(stat_result.st_mode):
+                os.chmod(path, mode)
+                changed = True
+        return changed
+
+    def apply_to_directory(self, directory):
+        examined, changed = 0, 0
+        subdirectories = []
+        with os.scandir(directory) as iterator:
+            for dir_entry in iterator:
+                # Symlinks are neither changed nor followed, so a link can't
+                # redirect the change outside the tree.
+                if dir_entry.is_symlink():
+                    continue
+                try:
+                    stat_result = dir_entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue  # removed between readdir and stat
+                examined += 1
+                changed += self.apply(dir_entry.path, stat_result)
+                if stat.S_ISDIR(stat_result.st_mode):
+                    subdirectories.append(dir_entry.path)
+        return examined, changed, subdirectories
+
+
+def change_tree(path, mode=None, uid=-1, gid=-1, recursive=True, jobs=None):
+    """Sets the mode and/or ownership of path and, optionally, everything
+    below it, touching only the entries that actually differ.
+
+    Each entry is stat'ed (for free from os.scandir on most file systems)
+    and os.chmod or os.chown is only called where the result would differ,
+    so re-applying the same change to a large tree costs a read-only walk
+    rather than a metadata write per inode. Directories are processed in
+    parallel on a thread pool. Symlinks inside the tree are skipped.
+
+    Args:
+        path (str): File or directory to change.
+        mode (str): chmod permission code, e.g. "755" or "g+rwX". Defaults
+            to leaving the mode alone.
+        uid (int): New owner, or -1 to leave it alone.
+        gid (int): New group, or -1 to leave it alone.
+        recursive (bool): Also change everything below path. Defaults to
+            True.
+        jobs (int): Number of directories processed at once. Defaults to the
+            ThreadPoolExecutor default.
+
+    Returns:
+        ChangeStats: How many entries were examined and how many changed.
+    """
+    change = _Change(parse_mode(mode) if mode else None, uid, gid)
+    if os.path.islink(path):
+        path = os.path.realpath(path)
+    stat_result = os.stat(path)
+    changed = int(change.apply(path, stat_result))
+    if not recursive or not stat.S_ISDIR(stat_result.st_mode):
+        return ChangeStats(1, changed)
+
+    examined = 1
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = set([executor.submit(change.apply_to_directory, path)])
+        while running:
+            done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                directory_examined, directory_changed, subdirectories = future.result()
+                examined += directory_examined
+                changed += directory_changed
+                for subdirectory in subdirectories:
+                    running.add(executor.submit(change.apply_to_directory, subdirectory))
+    return ChangeStats(examined, changed)
@@ -0,0 +1,285 @@
+import collections
+import hashlib
+import json
+import os
+import re
+import shlex
+import tempfile
+
+from conductor import packages
+from conductor.scheduler import Step
+from conductor.scheduler import parse_command_lines
+
+
+INCLUDE_DIRECTIVE = "@include"
+PLAN_FORMAT_VERSION = 2
+DEFAULT_CACHE_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "conductor", "plans")
+
+# Commands that can't change anything, and commands after which earlier
+# package work can't be assumed to still hold.
+_NO_OP_COMMANDS = (":", "true")
+_PACKAGE_TOOLS = re.compile(r"(?:^|[\s;&|(])(?:apt-get|apt|aptitude|dpkg|add-apt-repository)\b")
+_LINE_REFERENCE = re.compile(r"^line (\d+):")
+
+ExecutionPlan = collections.namedtuple("ExecutionPlan", ["steps", "sources", "dropped"])
+
+
+def _continues(line):
+    # An odd number of trailing backslashes escapes the newline; an even
+    # number is a run of escaped backslashes.
+    trailing = len(line) - len(line.rstrip("\\"))
+    return trailing % 2 == 1 and not line.lstrip().startswith("#")
+
+
+def read_command_lines(filename, included=None, _including=()):
+    """Streams the lines of a command file, resolving continuations and
+    includes.
+
+    A line ending in a backslash continues on the next line, as in the
+    shell. A line "@include other.txt" is replaced by the lines of that
+    file, relative to the including file's directory. Comments and blank
+    lines are passed through for parse_command_lines to skip, and each line
+    swallowed by a continuation is yielded as "", so step ids such as
+    "line12" still match the line numbers of a file without includes.
+
+    Args:
+        filename (str): Command file to read.
+        included (list): If given, every file read, the top one included,
+            is appended to it.
+
+    Yields:
+        tuple(tuple(str, int), str): The file and line number a line starts
+            on, and the line without its newline.
+
+    Raises:
+        ValueError: If files include each other in a cycle, or a
+            continuation runs off the end of a file.
+    """
+    real_path = os.path.realpath(filename)
+    if real_path in _including:
+        raise ValueError("{file} includes itself".format(file=filename))
+    if included is not None:
+        included.append(filename)
+
+    with open(filename, "r") as command_file:
+        pending, origin, swallowed = None, None, 0
+        for line_number, line in enumerate(command_file, 1):
+            line = line.rstrip("\n")
+            if pending is not None:
+                line = pending + line
+                swallowed += 1
+            else:
+                origin = (filename, line_number)
+            if _continues(line):
+                pending = line[:-1]
+                continue
+            pending = None
+
+            stripped = line.strip()
+            if stripped.startswith(INCLUDE_DIRECTIVE + " "):
+                words = shlex.split(stripped[len(INCLUDE_DIRECTIVE):])
+                if len(words) != 1:
+                    raise ValueError("{file}, line {n}: expected one file after {directive}".format(
+                        file=filename, n=origin[1], directive=INCLUDE_DIRECTIVE))
+                path = os.path.join(os.path.dirname(filename), os.path.expanduser(words[0]))
+                for item in read_command_lines(path, included, _including + (real_path,)):
+                    yield item
+            else:
+                yield origin, line
+            for _ in range(swallowed):
+                yield origin, ""
+            swallowed = 0
+        if pending is not None:
+            raise ValueError("{file}, line {n}: continuation at end of file".format(
+                file=filename, n=origin[1]))
+
+
+def optimize_steps(steps):
+    """Drops steps that can't change anything and merges compatible ones.
+
+    - ":" and "true" are dropped.
+    - apt-get update is dropped if nothing but apt-get update and install
+      ran since the last one.
+    - Packages an earlier apt-get install step already installed are left
+      out of later ones, and a step with none left is dropped. Any other
+      apt, aptitude or dpkg command makes the earlier installs count for
+      nothing.
+    - Consecutive apt-get installs are merged with batch_install_steps.
+
+    Update and install steps are only dropped or trimmed when every step
+    above them is guaranteed to have finished first, as for plain lines.
+    Steps that depended on a dropped step wait for what it waited for.
+
+    Args:
+        steps (List[Step]): Steps as returned by parse_command_lines.
+
+    Returns:
+        tuple(List[Step], List[str]): The new steps and the ids of the
+            dropped ones. The input is not modified.
+    """
+    kept = []
+    dropped = []
+    replaced = {}
+    sinks = set()  # kept steps nothing later depends on yet
+    updated = False
+    installed = set()
+
+    for step in steps:
+        depends_on = []
+        for dep in step.depends_on:
+            for new_dep in replaced.get(dep, [dep]):
+                if new_dep not in depends_on:
+                    depends_on.append(new_dep)
+        # Once this step waits for every sink, every kept step above it
+        # has finished by the time it starts.
+        waits_for_everything = sinks.issubset(depends_on)
+        command = step.command_string.strip()
+        drop = command in _NO_OP_COMMANDS
+
+        # Only work done once everything above it had finished is counted,
+        # so it can't have raced an earlier change to the package sources.
+        if not drop and packages.is_update_command(command):
+            drop = updated and waits_for_everything
+            updated = waits_for_everything
+        elif not drop:
+            parsed = packages.parse_install_command(command)
+            if parsed is not None:
+                head, names = parsed
+                new_names = [name for name in names if name not in installed]
+                if waits_for_everything:
+                    if len(new_names) < len(names):
+                        drop = not new_names
+                        command = "{head} {names}".format(head=head, names=" ".join(new_names))
+                    installed.update(names)
+            else:
+                updated = False
+                if _PACKAGE_TOOLS.search(command):
+                    installed.clear()
+
+        if drop:
+            dropped.append(step.step_id)
+            replaced[step.step_id] = depends_on
+            continue
+        kept.append(step.replace(command_string=command, depends_on=depends_on))
+        sinks.difference_update(depends_on)
+        sinks.add(step.step_id)
+
+    return packages.batch_install_steps(kept), dropped
+
+
+def _file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_filename(cache_directory, filename, optimize):
+    key = hashlib.sha256("{version}:{optimize}:{path}:{digest}".format(
+        version=PLAN_FORMAT_VERSION, optimize=optimize, path=os.path.realpath(filename),
+        digest=_file_digest(filename)).encode("utf-8")).hexdigest()
+    return os.path.join(cache_directory, key + ".json")
+
+
+def _load_cached(cache_filename):
+    # Plans are stored as plain JSON, so a cache file someone else could
+    # write can at worst describe wrong steps, never run code on load.
+    try:
+        with open(cache_filename, "r") as cache_file:
+            record = json.load(cache_file)
+        plan = ExecutionPlan(
+            [Step(step["step_id"], step["command_string"], step["depends_on"],
+                  step["line_number"], cpus=step["cpus"], memory=step["memory"])
+             for step in record["steps"]],
+            tuple(tuple(source) for source in record["sources"]), record["dropped"])
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+    # The key covers the top file; included files are checked here.
+    for path, digest in plan.sources[1:]:
+        try:
+            if _file_digest(path) != digest:
+                return None
+        except (IOError, OSError):
+            return None
+    return plan
+
+
+def _save_cached(plan, cache_filename):
+    record = {
+        "steps": [dict(step_id=step.step_id, command_string=step.command_string,
+                       depends_on=step.depends_on, line_number=step.line_number,
+                       cpus=step.cpus, memory=step.memory) for step in plan.steps],
+        "sources": plan.sources,
+        "dropped": plan.dropped,
+    }
+    directory = os.path.dirname(cache_filename)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(handle, "w") as cache_file:
+        json.dump(record, cache_file)
+    os.replace(temp_name, cache_filename)
+
+
+def compile_plan(filename, optimize=True, cache_directory=""):
+    """Turns a command file into an execution plan, reusing a cached plan
+    if the file and everything it includes are unchanged.
+
+    The file is read with read_command_lines and parsed with
+    parse_command_lines. With optimize, optimize_steps then drops
+    redundant steps and merges compatible ones. Given a cache_directory,
+    the compiled plan is cached as JSON, keyed by the file's path and the
+    sha256 of its contents, so a later run of the same file skips parsing.
+    Included files are re-hashed to check the cached plan is still current.
+
+    Args:
+        filename (str): Command file.
+        optimize (bool): Drop and merge redundant steps. Defaults to True.
+        cache_directory (str): Where compiled plans are kept, e.g.
+            DEFAULT_CACHE_DIRECTORY, or "" for no cache. Defaults to "".
+
+    Returns:
+        ExecutionPlan: The steps, the (filename, sha256) of every file read
+            and the ids of the steps optimize dropped.
+
+    Raises:
+        ValueError: If the file can't be parsed. The message names the file
+            and line the problem is on.
+    """
+    cache_filename = None
+    if cache_directory:
+        cache_filename = _cache_filename(cache_directory, filename, optimize)
+        plan = _load_cached(cache_filename)
+        if plan is not None:
+            return plan
+
+    included = []
+    origins = []
+    lines = []
+    for origin, line in read_command_lines(filename, included):
+        origins.append(origin)
+        lines.append(line)
+    try:
+        steps = parse_command_lines(lines)
+    except ValueError as error:
+        # Point at the file and line the problem is really on.
+        match = _LINE_REFERENCE.match(str(error))
+        if not match:
+            raise
+        source, line_number = origins[int(match.group(1)) - 1]
+        raise ValueError("{file}, line {n}:{rest}".format(
+            file=source, n=line_number, rest=str(error)[match.end():]))
+
+    dropped = []
+    if optimize:
+        steps, dropped = optimize_steps(steps)
+    sources = []
+    for path in included:
+        if path not in [source for source, _ in sources]:
+            sources.append((path, _file_digest(path)))
+    plan = ExecutionPlan(steps, tuple(sources), tuple(dropped))
+    if cache_filename is not None:
+        _save_cached(plan, cache_filename)
+    return plan
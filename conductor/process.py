@@ -0,0 +1,507 @@
+import atexit
+import collections
+import os
+import queue
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+import weakref
+
+
+STDOUT = "stdout"
+STDERR = "stderr"
+
+# Longest single item handed out by the reader threads. Output without
+# newlines (binary dumps, progress bars) is split into pieces of this size so
+# one runaway "line" can't grow without bound.
+MAX_CHUNK_SIZE = 64 * 1024
+
+# Seconds between SIGTERM and SIGKILL when a command is stopped.
+DEFAULT_GRACE_PERIOD = 5.0
+
+
+def _exit_code(wait_status):
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+class CommandResult(object):
+    """The outcome of a finished shell command.
+
+    Attributes:
+        command_string (str): The command that was run.
+        exit_code (int): The exit status. Negative values mean the child was
+            killed by that signal.
+        stdout (str): Captured standard output.
+        stderr (str): Captured standard error.
+        duration (float): Wall-clock seconds from spawn to exit.
+        started (float): Unix time the command was started.
+        user_time (float): CPU seconds spent in user mode by the command and
+            the children it waited for, or None if unknown.
+        system_time (float): CPU seconds spent in the kernel, likewise.
+        max_rss (int): Peak resident set size in bytes of the largest
+            process in the command, or None if unknown.
+        stdout_size (int): Characters written to stdout, even if only part
+            of the output was kept.
+        stderr_size (int): Characters written to stderr, likewise.
+        host (str): Where the command ran, for remote transports.
+        timed_out (bool): True if the command was stopped because it ran
+            past its timeout.
+    """
+
+    def __init__(self, command_string, exit_code, stdout="", stderr="",
+                 duration=0.0, started=None, user_time=None, system_time=None,
+                 max_rss=None, stdout_size=None, stderr_size=None, host=None,
+                 timed_out=False):
+        self.command_string = command_string
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.started = time.time() - duration if started is None else started
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+        self.stdout_size = len(stdout) if stdout_size is None else stdout_size
+        self.stderr_size = len(stderr) if stderr_size is None else stderr_size
+        self.host = host
+        self.timed_out = timed_out
+
+    @property
+    def succeeded(self):
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return "CommandResult(exit_code={code}, command={cmd!r})".format(
+            code=self.exit_code, cmd=self.command_string)
+
+
+class ProcessHandle(object):
+    """A handle on a shell command running in the background.
+
+    The child is started in its own session, so it leads a new process group
+    and kill() reaches everything it spawned (pipelines, sub-shells, etc.).
+    Two daemon threads drain stdout and stderr into a queue as soon as the
+    process starts. By default the queue is unbounded, so the child never
+    stalls on a full pipe even if nobody is reading yet; pass
+    max_buffered_lines to spawn() to cap memory instead, in which case the
+    child is paused until the reader catches up.
+
+    The child is reaped with os.wait4, so its CPU time and peak memory are
+    available from rusage once it has exited.
+
+    Attributes:
+        on_result (callable): If set, called with the CommandResult the first
+            time result() builds one.
+    """
+
+    def __init__(self, command_string, popen, max_buffered_lines=0):
+        self.command_string = command_string
+        self.popen = popen
+        self.pid = popen.pid
+        self.started = time.time()
+        self.rusage = None
+        self.on_result = None
+        self.output_sizes = {STDOUT: 0, STDERR: 0}
+        self._reap_lock = threading.Lock()
+        self._lines = queue.Queue(maxsize=max_buffered_lines)
+        self._open_streams = 0
+        self._readers = []
+
+        for name, pipe in ((STDOUT, popen.stdout), (STDERR, popen.stderr)):
+            if pipe is None:
+                continue
+            self._open_streams += 1
+            reader = threading.Thread(target=self._pump, args=(name, pipe))
+            reader.daemon = True
+            reader.start()
+            self._readers.append(reader)
+
+    @classmethod
+    def spawn(cls, command_string, max_buffered_lines=0, capture_stderr=True,
+              new_session=True, cwd=None):
+        """Starts command_string under /bin/sh and returns immediately.
+
+        Args:
+            command_string (str or List[str]): A shell command represented as
+                a string, or an argv list to run directly without a shell.
+            max_buffered_lines (int): How many unread lines to hold before
+                the child is paused. Defaults to 0 (no limit).
+            capture_stderr (bool): Capture stderr rather than leaving it
+                attached to ours. Defaults to True.
+            new_session (bool): Start the child in its own session and
+                process group. Defaults to True.
+            cwd (str): Directory to run in. Defaults to the current one.
+
+        Returns:
+            ProcessHandle: A handle on the running process.
+        """
+        use_shell = not isinstance(command_string, (list, tuple))
+        popen = subprocess.Popen(command_string, shell=use_shell,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE if capture_stderr else None,
+                                 universal_newlines=True,
+                                 start_new_session=new_session, cwd=cwd)
+        if not use_shell:
+            command_string = " ".join(shlex.quote(str(arg)) for arg in command_string)
+        return cls(command_string, popen, max_buffered_lines)
+
+    def _pump(self, name, pipe):
+        with pipe:
+            for line in iter(lambda: pipe.readline(MAX_CHUNK_SIZE), ""):
+                self.output_sizes[name] += len(line)
+                self._lines.put((name, line))
+        self._lines.put((name, None))
+
+    def _reap(self, block):
+        if self.popen.returncode is not None:
+            return self.popen.returncode
+        if not self._reap_lock.acquire(block):
+            return None  # another thread is already blocked in wait()
+        try:
+            if self.popen.returncode is not None:
+                return self.popen.returncode
+            try:
+                pid, status, rusage = os.wait4(self.pid, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                return self.popen.poll()  # reaped behind our back
+            if pid == 0:
+                return None
+            self.rusage = rusage
+            self.popen.returncode = _exit_code(status)
+            return self.popen.returncode
+        finally:
+            self._reap_lock.release()
+
+    @property
+    def exit_code(self):
+        """int or None: The exit status, or None while the child is running.
+        Negative values mean the child was killed by that signal."""
+        return self.popen.returncode
+
+    def poll(self):
+        """Checks whether the process has exited without blocking.
+
+        Returns:
+            int or None: The exit status, or None if still running.
+        """
+        return self._reap(block=False)
+
+    def is_running(self):
+        return self.poll() is None
+
+    def wait(self, timeout=None):
+        """Blocks until the process exits.
+
+        Args:
+            timeout (float): Seconds to wait before giving up. Defaults to
+                waiting forever.
+
+        Returns:
+            int: The exit status.
+
+        Raises:
+            subprocess.TimeoutExpired: If the process is still running after
+                timeout seconds.
+        """
+        if timeout is None:
+            return self._reap(block=True)
+
+        deadline = time.time() + timeout
+        delay = 0.0005
+        while True:
+            exit_code = self._reap(block=False)
+            if exit_code is not None:
+                return exit_code
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.command_string, timeout)
+            delay = min(delay * 2, remaining, 0.05)
+            time.sleep(delay)
+
+    def stream(self, timeout=None):
+        """Yields output as it is produced until both pipes are closed.
+
+        Args:
+            timeout (float): Seconds to wait for the pipes to close. Defaults
+                to waiting forever.
+
+        Yields:
+            tuple(str, str): ("stdout" or "stderr", line) pairs. Lines keep
+                their trailing newline; very long lines arrive in pieces of
+                at most MAX_CHUNK_SIZE characters.
+
+        Raises:
+            subprocess.TimeoutExpired: If output is still open after timeout
+                seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self._open_streams:
+            try:
+                if deadline is None:
+                    name, line = self._lines.get()
+                else:
+                    name, line = self._lines.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                raise subprocess.TimeoutExpired(self.command_string, timeout)
+            if line is None:
+                self._open_streams -= 1
+                continue
+            yield name, line
+
+    def iter_stdout(self):
+        """Yields stdout lines as they arrive, discarding stderr."""
+        for name, line in self.stream():
+            if name == STDOUT:
+                yield line
+
+    def iter_stderr(self):
+        """Yields stderr lines as they arrive, discarding stdout."""
+        for name, line in self.stream():
+            if name == STDERR:
+                yield line
+
+    def communicate(self, timeout=None):
+        """Waits for the process to exit and collects all remaining output.
+
+        Args:
+            timeout (float): Seconds to wait for the exit. Defaults to
+                waiting forever.
+
+        Returns:
+            tuple(str, str): The remaining stdout and stderr text.
+        """
+        result = self.result(timeout=timeout)
+        return result.stdout, result.stderr
+
+    def _collect(self, captured, callback, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        for name, line in self.stream(timeout=timeout):
+            if callback is not None:
+                callback(name, line)
+            captured[name].append(line)
+        remaining = None if deadline is None else max(deadline - time.time(), 0)
+        self.wait(timeout=remaining)
+
+    def result(self, timeout=None, keep_lines=None, callback=None,
+               stop_on_timeout=False, grace_period=DEFAULT_GRACE_PERIOD):
+        """Drains the output, waits for the process and packages everything
+        as a CommandResult.
+
+        Args:
+            timeout (float): Seconds to wait for the exit. Defaults to
+                waiting forever.
+            keep_lines (int): Only keep the last keep_lines lines of each
+                stream in the result. Defaults to keeping everything.
+            callback (callable): Called as callback(stream_name, line) for
+                every line as it arrives.
+            stop_on_timeout (bool): When the timeout expires, stop the
+                process group (see stop()) and return a result with
+                timed_out set, instead of raising. Defaults to False.
+            grace_period (float): Seconds between SIGTERM and SIGKILL when
+                stop_on_timeout applies.
+
+        Returns:
+            CommandResult: The exit status, output and duration.
+
+        Raises:
+            subprocess.TimeoutExpired: If the timeout expires and
+                stop_on_timeout is False. The process is left running.
+        """
+        captured = {STDOUT: collections.deque(maxlen=keep_lines),
+                    STDERR: collections.deque(maxlen=keep_lines)}
+        timed_out = False
+        try:
+            self._collect(captured, callback, timeout)
+        except subprocess.TimeoutExpired:
+            if not stop_on_timeout:
+                raise
+            timed_out = True
+            self.stop(grace_period)
+            try:
+                # Keep whatever was printed on the way out. A daemon that
+                # escaped the group may hold the pipes open, so don't wait
+                # on it for long.
+                self._collect(captured, callback, grace_period)
+            except subprocess.TimeoutExpired:
+                pass
+
+        result = CommandResult(self.command_string, self.exit_code,
+                               "".join(captured[STDOUT]), "".join(captured[STDERR]),
+                               time.time() - self.started, started=self.started,
+                               stdout_size=self.output_sizes[STDOUT],
+                               stderr_size=self.output_sizes[STDERR],
+                               timed_out=timed_out)
+        if self.rusage is not None:
+            result.user_time = self.rusage.ru_utime
+            result.system_time = self.rusage.ru_stime
+            # ru_maxrss is in kilobytes on Linux but bytes on macOS.
+            result.max_rss = self.rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        if self.on_result is not None:
+            on_result, self.on_result = self.on_result, None
+            on_result(result)
+        return result
+
+    def send_signal(self, sig):
+        """Sends sig to every process in the child's process group.
+
+        Returns:
+            bool: False if the group had already gone away.
+        """
+        try:
+            os.killpg(self.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return False
+        return True
+
+    def terminate(self):
+        return self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        """Kills the whole process group with SIGKILL and reaps the child.
+
+        Returns:
+            int: The exit status.
+        """
+        self.send_signal(signal.SIGKILL)
+        return self.wait()
+
+    def stop(self, grace_period=DEFAULT_GRACE_PERIOD):
+        """Asks the whole process group to exit with SIGTERM and, if the
+        child is still running after grace_period seconds, kills the group
+        with SIGKILL. Anything left in the group after the child exits is
+        killed too, so no orphans are left behind.
+
+        Returns:
+            int: The exit status.
+        """
+        if self.poll() is None:
+            self.terminate()
+            try:
+                self.wait(timeout=grace_period)
+            except subprocess.TimeoutExpired:
+                pass
+        self.send_signal(signal.SIGKILL)
+        return self.wait()
+
+    def __repr__(self):
+        return "ProcessHandle(pid={pid}, exit_code={code}, command={cmd!r})".format(
+            pid=self.pid, code=self.exit_code, cmd=self.command_string)
+
+
+_registries = weakref.WeakSet()
+
+
+class ProcessRegistry(object):
+    """Keeps track of the processes started on behalf of a caller so that
+    everything in flight can be torn down at once.
+
+    Once cancel() has been called, the registry stays cancelled until
+    reset(): schedulers stop starting new work, and any process added in the
+    meantime is stopped straight away. Every process still registered when
+    the interpreter exits is stopped as well.
+
+    A run such as a command file or a sweep gets its own registry from
+    start_run(), so cancelling the run, or the run timing out, leaves the
+    parent usable. Processes added to a run are tracked by the parent too,
+    and cancelling the parent cancels every run still in progress.
+
+    Args:
+        grace_period (float): Seconds between SIGTERM and SIGKILL when
+            processes are stopped.
+        parent (ProcessRegistry): The registry this run belongs to, if any.
+    """
+
+    def __init__(self, grace_period=DEFAULT_GRACE_PERIOD, parent=None):
+        self.grace_period = grace_period
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._handles = set()
+        self._runs = set()
+        self._cancelled = threading.Event()
+        _registries.add(self)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def add(self, handle):
+        """Starts tracking handle, or stops it if the registry is cancelled."""
+        with self._lock:
+            # Forget processes that have exited so the set doesn't grow.
+            self._handles = set(h for h in self._handles if h.exit_code is None)
+            self._handles.add(handle)
+        if self.parent is not None:
+            self.parent.add(handle)
+        if self.cancelled:
+            handle.stop(self.grace_period)
+        return handle
+
+    def discard(self, handle):
+        with self._lock:
+            self._handles.discard(handle)
+        if self.parent is not None:
+            self.parent.discard(handle)
+
+    def start_run(self):
+        """Returns a new registry for one run; hand it to finish_run() once
+        the run is over."""
+        run = ProcessRegistry(self.grace_period, parent=self)
+        with self._lock:
+            self._runs.add(run)
+            cancelled = self.cancelled
+        if cancelled:
+            run._cancelled.set()
+        return run
+
+    def finish_run(self, run):
+        with self._lock:
+            self._runs.discard(run)
+
+    def running(self):
+        """Returns the handles that are still running."""
+        with self._lock:
+            handles = list(self._handles)
+        return [handle for handle in handles if handle.poll() is None]
+
+    def cancel(self, grace_period=None):
+        """Marks the registry cancelled and stops every running process in
+        parallel, escalating from SIGTERM to SIGKILL after grace_period.
+
+        Returns:
+            int: How many processes were stopped.
+        """
+        with self._lock:
+            self._cancelled.set()
+            runs = list(self._runs)
+        for run in runs:
+            # Their processes are ours too, so stop_all reaches them.
+            run._cancelled.set()
+        return self.stop_all(grace_period)
+
+    def stop_all(self, grace_period=None):
+        grace_period = self.grace_period if grace_period is None else grace_period
+        handles = self.running()
+        for handle in handles:
+            handle.terminate()
+        stoppers = [threading.Thread(target=handle.stop, args=(grace_period,))
+                    for handle in handles]
+        for stopper in stoppers:
+            stopper.start()
+        for stopper in stoppers:
+            stopper.join()
+        return len(handles)
+
+    def reset(self):
+        """Clears the cancelled flag so new work can start again."""
+        self._cancelled.clear()
+
+
+@atexit.register
+def _stop_registered_processes():
+    for registry in list(_registries):
+        registry.stop_all(grace_period=1.0)
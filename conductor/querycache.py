@@ -0,0 +1,204 @@
+import collections
+import copy
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from conductor import accounts
+from conductor import sysinfo
+
+
+# Seconds a result stays fresh, per OperationWrapper method. Hardware and
+# the installed OS only change across reboots or upgrades; accounts, disks
+# and network counters move faster.
+DEFAULT_TTLS = {
+    "list_hardware": 3600,
+    "operating_system_information": 3600,
+    "operating_system_kernel_information": 3600,
+    "list_all_users": 60,
+    "list_all_groups_on_system": 60,
+    "list_user_groups": 60,
+    "list_my_groups": 60,
+    "disk_free_space": 5,
+    "network_addresses": 5,
+}
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 256
+
+# The record types cached queries return, by name. Only these are rebuilt
+# from a saved cache.
+_RECORD_TYPES = dict((record_type.__name__, record_type) for record_type in (
+    accounts.UserAccount, accounts.GroupAccount, sysinfo.DiskUsage,
+    sysinfo.NetworkInterface, sysinfo.KernelInfo, sysinfo.OSRelease))
+
+
+def _encode(value):
+    """Turns a query result into plain JSON data. Tuples, records and
+    dicts become tagged objects so _decode can rebuild them exactly."""
+    if isinstance(value, tuple) and hasattr(value, "_fields"):
+        if _RECORD_TYPES.get(type(value).__name__) is not type(value):
+            raise TypeError("can't save {name} results".format(name=type(value).__name__))
+        return {"record": type(value).__name__, "fields": [_encode(item) for item in value]}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(item) for item in value]}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, dict):
+        return {"dict": [[_encode(key), _encode(item)] for key, item in value.items()]}
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    raise TypeError("can't save {name} results".format(name=type(value).__name__))
+
+
+def _decode(data):
+    if isinstance(data, list):
+        return [_decode(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    if "record" in data:
+        return _RECORD_TYPES[data["record"]](*[_decode(item) for item in data["fields"]])
+    if "tuple" in data:
+        return tuple(_decode(item) for item in data["tuple"])
+    return dict((_decode(key), _decode(item)) for key, item in data["dict"])
+
+
+class QueryCache(object):
+    """Remembers the results of read-only queries for a while.
+
+    Each result is kept for the TTL of the method that produced it, and only
+    the max_entries most recently used results are kept. Entries expire by
+    wall-clock time, so a cache saved to cache_filename by save() and loaded
+    by a later process stays correct across restarts.
+
+    Args:
+        ttls (dict): Seconds per method name, on top of DEFAULT_TTLS. A TTL
+            of 0 turns caching off for that method.
+        default_ttl (float): Seconds for methods not in ttls. Defaults to 60.
+        max_entries (int): Results kept before the least recently used is
+            evicted. Defaults to 256.
+        cache_filename (str): Where save() persists the cache, as JSON.
+            If empty the cache only lives as long as the object. A file
+            that can't be read is ignored.
+    """
+
+    def __init__(self, ttls=None, default_ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 cache_filename=""):
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.cache_filename = cache_filename
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        if cache_filename and os.path.exists(cache_filename):
+            self._load()
+
+    def _load(self):
+        # JSON rather than pickle: whoever can write the file can at worst
+        # plant wrong results, never run code in this process.
+        try:
+            with open(self.cache_filename, "r") as cache_file:
+                saved = json.load(cache_file)
+            now = time.time()
+            for (name, arguments), expires, value in saved:
+                if expires > now:
+                    self._entries[(name, arguments)] = (expires, _decode(value))
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self._entries.clear()
+        self._evict()
+
+    def ttl(self, name):
+        return self.ttls.get(name, self.default_ttl)
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, name, arguments, compute):
+        """Returns the cached result of name called with arguments, calling
+        compute() for it if there is none or it has expired.
+
+        Args:
+            name (str): Method name; selects the TTL.
+            arguments (str): Identifies the call's arguments.
+            compute (callable): Produces the result on a miss.
+
+        Returns:
+            A copy of the result, so callers can't change the cached one.
+        """
+        ttl = self.ttl(name)
+        if ttl <= 0:
+            return compute()
+        key = (name, arguments)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            self._evict()
+            self._dirty = True
+        return value
+
+    def invalidate(self, *names):
+        """Forgets the results of the named methods, or every result if no
+        names are given."""
+        with self._lock:
+            if not names:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] in names]:
+                    del self._entries[key]
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        """Atomically writes the unexpired entries to cache_filename if the
+        cache changed."""
+        if not self.cache_filename or not self._dirty:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_filename))
+        with self._lock:
+            now = time.time()
+            entries = []
+            for key, (expires, value) in self._entries.items():
+                if expires <= now:
+                    continue
+                try:
+                    entries.append([list(key), expires, _encode(value)])
+                except TypeError:
+                    continue  # kept in memory, but not worth saving
+            handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(handle, "w") as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temp_name, self.cache_filename)
+            self._dirty = False
+
+
+def cached_query(method):
+    """Decorates a read-only OperationWrapper method so its results are
+    served from the wrapper's query_cache, if it has one. Results are kept
+    apart per host and working directory, so wrappers can share a cache."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.query_cache is None:
+            return method(self, *args, **kwargs)
+        host = None if self.transport is None else self.transport.host
+        arguments = repr((host, self._working_directory(), args, sorted(kwargs.items())))
+        return self.query_cache.get(method.__name__, arguments,
+                                    lambda: method(self, *args, **kwargs))
+    return wrapper
@@ -0,0 +1,170 @@
+import os
+import re
+import threading
+
+
+MEMINFO_FILENAME = "/proc/meminfo"
+
+# Argument names that say how many cores a command will use.
+THREAD_ARGUMENTS = ("num_threads", "threads", "nthreads", "cpus", "cores", "n_jobs", "jobs")
+# Argument names that say how much memory a command will use.
+MEMORY_ARGUMENTS = ("memory", "mem", "max_memory")
+
+_THREAD_OPTION = re.compile(
+    r"(?:^|\s)--?(?:{names})(?:\s+|=)(\d+)(?=\s|$)".format(names="|".join(THREAD_ARGUMENTS)))
+_MEMORY_OPTION = re.compile(
+    r"(?:^|\s)--?(?:{names})(?:\s+|=)(\d+[kKmMgGtT]?)[bB]?(?=\s|$)".format(
+        names="|".join(MEMORY_ARGUMENTS)))
+_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_memory(value):
+    """Turns 512, "512M", "4G" or "4GB" into a number of bytes."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([kKmMgGtT]?)[bB]?\s*$", str(value))
+    if not match:
+        raise ValueError("can't parse memory size {value!r}".format(value=value))
+    return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+
+def requirements_from_arguments(argument_dictionary):
+    """Infers (cpus, memory) from a command_string_builder style dictionary,
+    e.g. {"num_threads": 8} needs 8 cores. Unknown needs default to one core
+    and no memory reservation.
+
+    Returns:
+        tuple(int, int): Cores and bytes of memory.
+    """
+    cpus, memory = 1, 0
+    for name in THREAD_ARGUMENTS:
+        if name in argument_dictionary:
+            cpus = max(int(argument_dictionary[name]), 1)
+            break
+    for name in MEMORY_ARGUMENTS:
+        if name in argument_dictionary:
+            memory = parse_memory(argument_dictionary[name])
+            break
+    return cpus, memory
+
+
+def requirements_from_command(command):
+    """Infers (cpus, memory) from options such as "-num_threads 8" or
+    "--mem=4G" in a command string or argv list.
+
+    Returns:
+        tuple(int, int): Cores and bytes of memory.
+    """
+    if isinstance(command, (list, tuple)):
+        command = " ".join(str(word) for word in command)
+    cpus, memory = 1, 0
+    match = _THREAD_OPTION.search(command)
+    if match:
+        cpus = max(int(match.group(1)), 1)
+    match = _MEMORY_OPTION.search(command)
+    if match:
+        memory = parse_memory(match.group(1))
+    return cpus, memory
+
+
+def available_memory(meminfo_filename=MEMINFO_FILENAME):
+    """Reads MemAvailable (or MemTotal on old kernels) from /proc/meminfo.
+
+    Returns:
+        int or None: Bytes of memory, or None if it can't be read.
+    """
+    values = {}
+    try:
+        with open(meminfo_filename, "r") as meminfo:
+            for line in meminfo:
+                name, _, rest = line.partition(":")
+                values[name] = rest.split()
+    except (IOError, OSError):
+        return None
+    for name in ("MemAvailable", "MemTotal"):
+        if name in values:
+            return int(values[name][0]) * 1024
+    return None
+
+
+def available_cpus():
+    """Counts the cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class ResourcePool(object):
+    """Tracks how many cores and how many bytes of memory running commands
+    have reserved, and admits new commands only while they fit.
+
+    A command that asks for more than the whole machine is clamped to the
+    machine's size, so it still runs, just on its own.
+
+    Args:
+        cpus (int): Cores to hand out. Defaults to the cores this process
+            may use.
+        memory (int or str): Memory to hand out, e.g. "16G". Defaults to
+            MemAvailable from /proc/meminfo; no limit if that can't be read.
+    """
+
+    def __init__(self, cpus=None, memory=None):
+        self.cpus = cpus or available_cpus()
+        self.memory = parse_memory(memory) if memory is not None else available_memory()
+        self.cpus_in_use = 0
+        self.memory_in_use = 0
+        self._condition = threading.Condition()
+
+    def _clamp(self, cpus, memory):
+        cpus = min(max(cpus, 1), self.cpus)
+        memory = parse_memory(memory)
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+        return cpus, memory
+
+    def fits(self, cpus, memory=0):
+        """Checks whether a command needing cpus and memory could start now."""
+        cpus, memory = self._clamp(cpus, memory)
+        with self._condition:
+            return self._fits(cpus, memory)
+
+    def _fits(self, cpus, memory):
+        if self.cpus_in_use + cpus > self.cpus:
+            return False
+        return self.memory is None or self.memory_in_use + memory <= self.memory
+
+    def try_acquire(self, cpus, memory=0):
+        """Reserves resources if they are free right now.
+
+        Returns:
+            tuple(int, int) or None: The reservation to hand back to
+                release(), or None if it doesn't fit yet.
+        """
+        cpus, memory = self._clamp(cpus, memory)
+        with self._condition:
+            if not self._fits(cpus, memory):
+                return None
+            self.cpus_in_use += cpus
+            self.memory_in_use += memory
+            return cpus, memory
+
+    def acquire(self, cpus, memory=0):
+        """Waits until resources are free and reserves them.
+
+        Returns:
+            tuple(int, int): The reservation to hand back to release().
+        """
+        cpus, memory = self._clamp(cpus, memory)
+        with self._condition:
+            while not self._fits(cpus, memory):
+                self._condition.wait()
+            self.cpus_in_use += cpus
+            self.memory_in_use += memory
+            return cpus, memory
+
+    def release(self, reservation):
+        cpus, memory = reservation
+        with self._condition:
+            self.cpus_in_use -= cpus
+            self.memory_in_use -= memory
+            self._condition.notify_all()
@@ -0,0 +1,262 @@
+import collections
+import re
+from concurrent import futures
+
+from conductor.resources import parse_memory
+from conductor.resources import requirements_from_command
+
+
+# "[name] command", "[name <- dep1 dep2] command" or
+# "[name cpus=8 mem=4G <- dep1] command". The name must touch the opening
+# bracket so shell tests such as "[ -f foo ] && ..." are left alone.
+_ANNOTATED_LINE = re.compile(
+    r"^\[(?P<name>[\w.-]+)(?P<hints>(?:\s+\w+=[\w.]+)*)"
+    r"(?:\s*<-\s*(?P<deps>[\w.,\s-]*))?\]\s+(?P<command>.+)$")
+_RESOURCE_HINTS = ("cpus", "mem")
+
+PARALLEL_PREFIX = "&"
+
+
+class Step(object):
+    """A single command in a command file together with its dependencies.
+
+    Attributes:
+        step_id (str): Unique name of the step within its file.
+        command_string (str): The shell command to run.
+        depends_on (List[str]): Ids of steps that must finish first.
+        line_number (int): Line of the command file the step came from.
+        cpus (int): Cores the command needs, or None to infer it from the
+            command string.
+        memory (int or str): Memory the command needs, e.g. "4G", or None
+            to infer it from the command string.
+    """
+
+    def __init__(self, step_id, command_string, depends_on=(), line_number=None,
+                 cpus=None, memory=None):
+        self.step_id = step_id
+        self.command_string = command_string
+        self.depends_on = list(depends_on)
+        self.line_number = line_number
+        self.cpus = cpus
+        self.memory = memory
+
+    def requirements(self):
+        """Returns the (cpus, memory) the step needs, preferring declared
+        values over ones inferred from options like "-num_threads 8"."""
+        cpus, memory = requirements_from_command(self.command_string)
+        if self.cpus is not None:
+            cpus = int(self.cpus)
+        if self.memory is not None:
+            memory = parse_memory(self.memory)
+        return cpus, memory
+
+    def replace(self, **changes):
+        """Returns a copy of the step with the given attributes changed,
+        keeping everything else, including declared cpus and memory."""
+        attributes = dict(step_id=self.step_id, command_string=self.command_string,
+                          depends_on=self.depends_on, line_number=self.line_number,
+                          cpus=self.cpus, memory=self.memory)
+        attributes.update(changes)
+        return Step(**attributes)
+
+    def __repr__(self):
+        return "Step({id!r}, {cmd!r}, depends_on={deps!r})".format(
+            id=self.step_id, cmd=self.command_string, deps=self.depends_on)
+
+
+def parse_command_lines(lines):
+    """Turns the lines of a command file into a list of dependent steps.
+
+    The format is backwards compatible with plain one-command-per-line files,
+    which still run strictly in order. Blank lines and lines starting with "#"
+    are ignored. Three kinds of command line are understood:
+
+        apt-get update                  A plain line is a barrier: it waits
+                                        for every step above it, and every
+                                        step below it waits for it.
+        & wget http://host/a.tar.gz     An "&" line only waits for the last
+                                        barrier, so consecutive "&" lines run
+                                        concurrently.
+        [fetch] wget http://host/b      A named step behaves like an "&" line
+        [check <- fetch] sha1sum b      and may also wait for earlier named
+                                        steps listed after "<-".
+        [bwa cpus=8 mem=16G] bwa mem    A named step may declare the cores
+                                        and memory it needs; otherwise they
+                                        are inferred from the command.
+
+    Args:
+        lines (List[str]): Lines of a command file.
+
+    Returns:
+        List[Step]: Steps in file order.
+
+    Raises:
+        ValueError: If a name is reused, a dependency names a step that is
+            not defined on an earlier line, or a resource hint is unknown.
+    """
+    steps = []
+    known_ids = set()
+    barrier = None
+    since_barrier = []
+
+    for line_number, raw_line in enumerate(lines, 1):
+        line = raw_line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        annotated = _ANNOTATED_LINE.match(line)
+        if annotated:
+            step_id = annotated.group("name")
+            command = annotated.group("command").strip()
+            hints = dict(hint.split("=", 1) for hint in annotated.group("hints").split())
+            for hint in hints:
+                if hint not in _RESOURCE_HINTS:
+                    raise ValueError("line {n}: unknown resource hint {hint!r}".format(
+                        n=line_number, hint=hint))
+            depends_on = re.split(r"[\s,]+", (annotated.group("deps") or "").strip())
+            depends_on = [dep for dep in depends_on if dep]
+            for dep in depends_on:
+                if dep not in known_ids:
+                    raise ValueError(
+                        "line {n}: step {id!r} depends on unknown step {dep!r}".format(
+                            n=line_number, id=step_id, dep=dep))
+            if barrier and barrier not in depends_on:
+                depends_on.insert(0, barrier)
+            is_barrier = False
+        elif line.startswith(PARALLEL_PREFIX):
+            hints = {}
+            step_id = "line{n}".format(n=line_number)
+            command = line[len(PARALLEL_PREFIX):].strip()
+            depends_on = [barrier] if barrier else []
+            is_barrier = False
+        else:
+            step_id = "line{n}".format(n=line_number)
+            command = line
+            hints = {}
+            depends_on = ([barrier] if barrier else []) + since_barrier
+            is_barrier = True
+
+        if step_id in known_ids:
+            raise ValueError("line {n}: duplicate step name {id!r}".format(
+                n=line_number, id=step_id))
+        known_ids.add(step_id)
+        steps.append(Step(step_id, command, depends_on, line_number,
+                          cpus=int(hints["cpus"]) if "cpus" in hints else None,
+                          memory=hints.get("mem")))
+
+        if is_barrier:
+            barrier = step_id
+            since_barrier = []
+        else:
+            since_barrier.append(step_id)
+
+    return steps
+
+
+class CommandScheduler(object):
+    """Runs a graph of steps on a pool of worker threads.
+
+    A step is started as soon as every step it depends on has finished, with
+    at most `jobs` steps running at once. Ready steps are started in file
+    order, so with jobs=1 a file runs exactly as it is written.
+
+    Args:
+        run_step (callable): Called with a Step on a worker thread; must
+            return a CommandResult.
+        jobs (int): Maximum number of steps running at the same time.
+        stop_on_failure (bool): If True, no new steps are started once any
+            step exits non-zero. Steps already running are allowed to finish.
+        resources (ResourcePool): If given, a ready step is only started
+            while the cores and memory it needs are free, so several
+            multi-threaded steps don't oversubscribe the machine. A step that
+            doesn't fit yet lets smaller ready steps behind it go first.
+        cancellation (ProcessRegistry): If given, no new steps are started
+            once it is cancelled, and it is cancelled if the run is
+            interrupted (e.g. by Ctrl-C) so running steps are torn down
+            rather than waited for.
+    """
+
+    def __init__(self, run_step, jobs=1, stop_on_failure=False, resources=None,
+                 cancellation=None):
+        if jobs < 1:
+            raise ValueError("jobs must be at least 1")
+        self.run_step = run_step
+        self.jobs = jobs
+        self.stop_on_failure = stop_on_failure
+        self.resources = resources
+        self.cancellation = cancellation
+
+    def run(self, steps):
+        """Runs steps, respecting their dependencies.
+
+        Args:
+            steps (List[Step]): Steps as returned by parse_command_lines.
+
+        Returns:
+            OrderedDict: Maps step id to CommandResult for every step that
+                ran, in completion order.
+        """
+        steps_by_id = collections.OrderedDict((step.step_id, step) for step in steps)
+        position = dict((step.step_id, index) for index, step in enumerate(steps))
+        waiting_on = {}
+        dependents = collections.defaultdict(list)
+        for step in steps:
+            waiting_on[step.step_id] = len(step.depends_on)
+            for dep in step.depends_on:
+                dependents[dep].append(step.step_id)
+
+        ready = [step.step_id for step in steps if not step.depends_on]
+        results = collections.OrderedDict()
+        running = {}
+        reservations = {}
+        failed = False
+
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while ready or running:
+                    for step_id in list(ready):
+                        if len(running) >= self.jobs or self._stopped(failed):
+                            break
+                        step = steps_by_id[step_id]
+                        if self.resources is not None and not running:
+                            # Nothing of ours to wait for, so wait on the pool.
+                            reservations[step_id] = self.resources.acquire(*step.requirements())
+                        elif self.resources is not None:
+                            reservation = self.resources.try_acquire(*step.requirements())
+                            if reservation is None:
+                                continue
+                            reservations[step_id] = reservation
+                        ready.remove(step_id)
+                        running[executor.submit(self.run_step, step)] = step
+
+                    if not running:
+                        break
+
+                    done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        step = running.pop(future)
+                        if step.step_id in reservations:
+                            self.resources.release(reservations.pop(step.step_id))
+                        result = future.result()
+                        results[step.step_id] = result
+                        if self.stop_on_failure and not result.succeeded:
+                            failed = True
+
+                        for dependent in dependents[step.step_id]:
+                            waiting_on[dependent] -= 1
+                            if waiting_on[dependent] == 0:
+                                ready.append(dependent)
+
+                    # Keep file order among everything that became ready.
+                    ready.sort(key=position.get)
+            except BaseException:
+                # Tear down running steps instead of letting the executor
+                # wait for them on the way out.
+                if self.cancellation is not None:
+                    self.cancellation.cancel()
+                raise
+
+        return results
+
+    def _stopped(self, failed):
+        return failed or (self.cancellation is not None and self.cancellation.cancelled)
@@ -0,0 +1,257 @@
+import os
+import selectors
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+from conductor.process import DEFAULT_GRACE_PERIOD
+from conductor.process import CommandResult
+
+
+def _default_shell():
+    # bash reports a syntax error in an eval'd command and carries on; dash
+    # exits, which would end the session.
+    return "/bin/bash" if os.path.exists("/bin/bash") else "/bin/sh"
+
+
+def _shell_quote(text):
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+class SessionClosedError(RuntimeError):
+    """Raised when the session's shell has exited, e.g. because a command ran
+    "exit". Start a new ShellSession to carry on."""
+
+
+class ShellSession(object):
+    """One long-lived shell that many commands are sent to in turn.
+
+    The shell is spawned once, so each command costs a pipe round trip
+    instead of a fork and exec, and state such as the working directory,
+    exported variables and shell functions carries over from one command to
+    the next. Each command is followed by a unique sentinel on stdout and
+    stderr that marks where its output ends and carries its exit status and
+    the shell's working directory, which is kept as cwd.
+
+    Commands run with stdin redirected from /dev/null so they can't swallow
+    the next command. Sessions are safe to share between threads; commands
+    are run one at a time.
+
+    The shell leads its own process group, which every command it runs
+    joins. A command can only be stopped together with its shell, so a
+    command that runs past its timeout, or a session stopped with stop(),
+    ends the session. A session can be handed to a ProcessRegistry like a
+    ProcessHandle.
+
+    Args:
+        shell (str): Shell to run. Defaults to /bin/bash, or /bin/sh if bash
+            is not installed.
+        cwd (str): Starting working directory. Defaults to the current one.
+        env (dict): Starting environment. Defaults to the current one.
+        argv (List[str]): Full command line to start instead of shell, for
+            shells reached through another program, such as
+            ["ssh", "-T", "host", "bash"].
+    """
+
+    def __init__(self, shell=None, cwd=None, env=None, argv=None):
+        self.shell = shell or _default_shell()
+        self.argv = list(argv) if argv else [self.shell]
+        self._lock = threading.Lock()
+        self.popen = subprocess.Popen(self.argv, stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, cwd=cwd, env=env,
+                                      start_new_session=True)
+        self.pid = self.popen.pid
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self._stopped = False
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.popen.stdout, selectors.EVENT_READ, "stdout")
+        self._selector.register(self.popen.stderr, selectors.EVENT_READ, "stderr")
+        self._pending = {"stdout": b"", "stderr": b""}
+
+    @property
+    def is_alive(self):
+        return self.popen.poll() is None
+
+    @property
+    def exit_code(self):
+        """int or None: The shell's exit status, or None while it runs."""
+        return self.popen.returncode
+
+    def poll(self):
+        return self.popen.poll()
+
+    def send_signal(self, sig):
+        """Sends sig to the shell and every command it is running.
+
+        Returns:
+            bool: False if the group had already gone away.
+        """
+        try:
+            os.killpg(self.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return False
+        return True
+
+    def terminate(self):
+        self._stopped = True
+        return self.send_signal(signal.SIGTERM)
+
+    def stop(self, grace_period=DEFAULT_GRACE_PERIOD):
+        """Stops the shell and whatever it is running with SIGTERM, then
+        SIGKILL after grace_period seconds. A command in progress returns
+        with what it printed so far; later commands raise
+        SessionClosedError.
+
+        Returns:
+            int: The shell's exit status.
+        """
+        self._stopped = True
+        if self.popen.poll() is None:
+            self.terminate()
+            try:
+                self.popen.wait(timeout=grace_period)
+            except subprocess.TimeoutExpired:
+                pass
+        self.send_signal(signal.SIGKILL)
+        return self.popen.wait()
+
+    def run(self, command_string, timeout=None, grace_period=DEFAULT_GRACE_PERIOD,
+            processes=None):
+        """Runs a command in the session and waits for it to finish.
+
+        Args:
+            command_string (str): A shell command represented as a string.
+            timeout (float): Seconds the command may run before the session
+                is stopped. Defaults to no limit.
+            grace_period (float): Seconds between SIGTERM and SIGKILL when
+                the session is stopped.
+            processes (ProcessRegistry): Registers the session while the
+                command runs, so cancelling the registry stops it.
+
+        Returns:
+            CommandResult: The command's exit status and output. If the
+                session was stopped, the exit status is the shell's and
+                timed_out is set if the timeout expired.
+
+        Raises:
+            SessionClosedError: If the shell has exited.
+        """
+        marker = "__conductor_{id}__".format(id=uuid.uuid4().hex).encode("ascii")
+        script = ("eval {command} </dev/null\n"
+                  "__conductor_rc=$?\n"
+                  "printf '%s %d %s\\n' '{marker}' \"$__conductor_rc\" \"$PWD\"\n"
+                  "printf '%s\\n' '{marker}' >&2\n").format(
+                      command=_shell_quote(command_string),
+                      marker=marker.decode("ascii"))
+
+        with self._lock:
+            if not self.is_alive:
+                raise SessionClosedError("shell session has exited with status {code}".format(
+                    code=self.popen.returncode))
+            started = time.time()
+            deadline = None if timeout is None else started + timeout
+            if processes is not None:
+                processes.add(self)
+            try:
+                try:
+                    self.popen.stdin.write(script.encode("utf-8"))
+                    self.popen.stdin.flush()
+                except BrokenPipeError:
+                    if not self._stopped:
+                        raise SessionClosedError("shell session has exited")
+                stdout, stderr, exit_code, timed_out = self._read_until(
+                    marker, deadline, grace_period)
+            finally:
+                if processes is not None:
+                    processes.discard(self)
+
+        return CommandResult(command_string, exit_code,
+                             stdout.decode("utf-8", "replace"),
+                             stderr.decode("utf-8", "replace"),
+                             time.time() - started, started=started,
+                             timed_out=timed_out)
+
+    def _read_until(self, marker, deadline=None, grace_period=DEFAULT_GRACE_PERIOD):
+        outputs = {"stdout": None, "stderr": None}
+        exit_code = None
+        timed_out = False
+        stdout_end = marker + b" "
+        stderr_end = marker + b"\n"
+        open_streams = len(self._selector.get_map())
+
+        while outputs["stdout"] is None or outputs["stderr"] is None:
+            remaining = None if deadline is None else max(deadline - time.time(), 0)
+            events = self._selector.select(remaining) if open_streams else []
+            if not events:
+                if timed_out or not open_streams:
+                    # Stopped, but a daemon that escaped the group holds
+                    # the pipes open, or both pipes are closed.
+                    break
+                timed_out = True
+                self.stop(grace_period)
+                # Keep whatever was printed on the way out.
+                deadline = time.time() + grace_period
+                continue
+            for key, _ in events:
+                name = key.data
+                chunk = os.read(key.fileobj.fileno(), 65536)
+                if not chunk:
+                    if not self._stopped:
+                        self.popen.wait()
+                        raise SessionClosedError(
+                            "shell session exited with status {code}".format(
+                                code=self.popen.returncode))
+                    self._selector.unregister(key.fileobj)
+                    open_streams -= 1
+                    continue
+                self._pending[name] += chunk
+
+            if outputs["stdout"] is None:
+                buffered = self._pending["stdout"]
+                start = buffered.find(stdout_end)
+                end = buffered.find(b"\n", start) if start >= 0 else -1
+                if end >= 0:
+                    outputs["stdout"] = buffered[:start]
+                    status, _, cwd = buffered[start + len(stdout_end):end].partition(b" ")
+                    exit_code = int(status)
+                    self.cwd = os.fsdecode(cwd)
+                    self._pending["stdout"] = buffered[end + 1:]
+
+            if outputs["stderr"] is None:
+                buffered = self._pending["stderr"]
+                start = buffered.find(stderr_end)
+                if start >= 0:
+                    outputs["stderr"] = buffered[:start]
+                    self._pending["stderr"] = buffered[start + len(stderr_end):]
+
+        if self._stopped:
+            # The command didn't get to print its sentinel; report what it
+            # printed and how the shell ended.
+            for name in outputs:
+                if outputs[name] is None:
+                    outputs[name], self._pending[name] = self._pending[name], b""
+            if exit_code is None:
+                exit_code = self.popen.wait()
+        return outputs["stdout"], outputs["stderr"], exit_code, timed_out
+
+    def close(self):
+        """Ends the shell, killing it if it doesn't exit promptly."""
+        if self.is_alive:
+            try:
+                self.popen.stdin.close()
+                self.popen.wait(timeout=5)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                self.popen.kill()
+                self.popen.wait()
+        self._selector.close()
+        self.popen.stdout.close()
+        self.popen.stderr.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
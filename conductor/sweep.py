@@ -0,0 +1,186 @@
+import collections
+import itertools
+import os
+from concurrent import futures
+
+from conductor.process import CommandResult
+from conductor.resources import requirements_from_arguments
+
+
+PRODUCT = "product"
+ZIP = "zip"
+
+SweepResult = collections.namedtuple(
+    "SweepResult", ["key", "parameters", "argv", "output", "result", "skipped"])
+
+
+def expand_parameters(parameter_values, mode=PRODUCT):
+    """Expands per-argument value lists into individual parameter sets.
+
+    Args:
+        parameter_values (dict): Maps an argument name to the list of values
+            to try, e.g. {"evalue": [1e-5, 1e-10], "db": ["16s", "nt"]}.
+        mode (str): "product" for every combination, or "zip" to pair the
+            n-th values of every list (all lists must be the same length).
+
+    Returns:
+        List[OrderedDict]: Parameter sets with names in sorted order. With
+            "product", the last name varies fastest.
+
+    Raises:
+        ValueError: For an unknown mode or, with "zip", uneven lists.
+    """
+    names = sorted(parameter_values)
+    values = [list(parameter_values[name]) for name in names]
+    if mode == PRODUCT:
+        combinations = itertools.product(*values)
+    elif mode == ZIP:
+        if len(set(len(column) for column in values)) > 1:
+            raise ValueError("zip sweeps need the same number of values for every argument")
+        combinations = zip(*values)
+    else:
+        raise ValueError("unknown sweep mode {mode!r}".format(mode=mode))
+    return [collections.OrderedDict(zip(names, combination)) for combination in combinations]
+
+
+class ParameterSweep(object):
+    """Runs one CommandTemplate over many parameter sets.
+
+    Each parameter set is merged over fixed_arguments and rendered to an argv
+    list, so no shell is involved. If output_template is given it is filled
+    in from the parameters (e.g. "hits_{db}_{evalue}.xml"), passed to the
+    command as output_argument, and used to make runs resumable: parameter
+    sets whose output file already exists are skipped.
+
+    Args:
+        template (CommandTemplate): The command to run.
+        parameter_values (dict): Argument name to list of values.
+        mode (str): "product" or "zip"; see expand_parameters.
+        fixed_arguments (dict): Arguments shared by every run.
+        output_template (str): str.format pattern for each run's output file.
+        output_argument (str): Argument name the output file is passed as.
+            If empty, the output file is only used for the resume check.
+        remove_failed_outputs (bool): Delete the output file of a run that
+            exits non-zero, so a half-written file doesn't count as done on
+            the next resume. Defaults to True.
+    """
+
+    def __init__(self, template, parameter_values, mode=PRODUCT, fixed_arguments=None,
+                 output_template="", output_argument="", remove_failed_outputs=True):
+        self.template = template
+        self.parameter_values = parameter_values
+        self.mode = mode
+        self.fixed_arguments = dict(fixed_arguments or {})
+        self.output_template = output_template
+        self.output_argument = output_argument
+        self.remove_failed_outputs = remove_failed_outputs
+
+    def jobs(self):
+        """Yields (key, parameters, argv, output) for every parameter set.
+
+        The key is the tuple of parameter values in sorted-name order.
+        """
+        for parameters in expand_parameters(self.parameter_values, self.mode):
+            arguments = dict(self.fixed_arguments)
+            arguments.update(parameters)
+            output = ""
+            if self.output_template:
+                output = self.output_template.format(**parameters)
+                if self.output_argument:
+                    arguments[self.output_argument] = output
+            yield (tuple(parameters.values()), parameters,
+                   self.template.render_argv(arguments), output)
+
+    def _run_one(self, run_command, resolve_path, job):
+        key, parameters, argv, output = job
+        result = run_command(argv)
+        if (not result.succeeded and output and self.remove_failed_outputs and
+                os.path.exists(resolve_path(output))):
+            os.remove(resolve_path(output))
+        return SweepResult(key, parameters, argv, output, result, False)
+
+    def requirements(self, parameters):
+        """Returns the (cpus, memory) one parameter set needs, inferred from
+        arguments such as num_threads or memory."""
+        arguments = dict(self.fixed_arguments)
+        arguments.update(parameters)
+        return requirements_from_arguments(arguments)
+
+    def run(self, run_command, jobs=1, resume=True, resources=None, cancellation=None,
+            resolve_path=None):
+        """Runs the sweep, at most jobs commands at a time, yielding results
+        as each command finishes.
+
+        Args:
+            run_command (callable): Runs an argv list and returns a
+                CommandResult.
+            jobs (int): Maximum number of commands running at once.
+            resume (bool): Skip parameter sets whose output already exists.
+                Defaults to True.
+            resources (ResourcePool): If given, a command is only started
+                while the cores and memory it needs are free. Commands start
+                in order, so a large one is never starved by smaller ones.
+            cancellation (ProcessRegistry): The registry of this sweep's
+                run, holding only the processes it started. If given, no new
+                commands are started once it is cancelled, and it is
+                cancelled if the caller stops iterating early or the sweep
+                is interrupted.
+            resolve_path (callable): Turns an output file name into the
+                path it has where the commands run, for the resume check
+                and the removal of failed outputs. Defaults to using it as
+                is.
+
+        Yields:
+            SweepResult: One per parameter set, in completion order. Skipped
+                sets come back with skipped=True and a successful empty
+                result.
+        """
+        resolve_path = resolve_path or (lambda path: path)
+        pending = iter(self.jobs())
+        with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            running = {}
+            held = None
+            exhausted = False
+            try:
+                while running or held or not exhausted:
+                    if cancellation is not None and cancellation.cancelled:
+                        exhausted, held = True, None
+                    # Only a bounded window is submitted at a time, so a sweep
+                    # of a million combinations doesn't queue a million futures.
+                    limit = jobs if resources is not None else jobs * 2
+                    while len(running) < limit:
+                        job, held = held, None
+                        if job is None:
+                            job = None if exhausted else next(pending, None)
+                        if job is None:
+                            exhausted = True
+                            break
+                        key, parameters, argv, output = job
+                        if resume and output and os.path.exists(resolve_path(output)):
+                            yield SweepResult(key, parameters, argv, output,
+                                              CommandResult(" ".join(argv), 0), True)
+                            continue
+                        reservation = None
+                        if resources is not None and not running:
+                            # Nothing of ours to wait for, so wait on the pool.
+                            reservation = resources.acquire(*self.requirements(parameters))
+                        elif resources is not None:
+                            reservation = resources.try_acquire(*self.requirements(parameters))
+                            if reservation is None:
+                                held = job
+                                break
+                        running[executor.submit(self._run_one, run_command, resolve_path,
+                                                job)] = reservation
+
+                    if running:
+                        done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                        for future in done:
+                            reservation = running.pop(future)
+                            if reservation is not None:
+                                resources.release(reservation)
+                            yield future.result()
+            except BaseException:
+                # Includes GeneratorExit when the caller stops iterating.
+                if cancellation is not None:
+                    cancellation.cancel()
+                raise
@@ -0,0 +1,373 @@
+import collections
+import hashlib
+import json
+import os
+import stat
+import tempfile
+from concurrent import futures
+
+from conductor import trees
+from conductor.checksum import hash_file
+from conductor.files import scan_directory
+
+
+MANIFEST_VERSION = 2
+DEFAULT_MANIFEST_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "conductor", "sync")
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+FILE = "file"
+DIRECTORY = "directory"
+SYMLINK = "symlink"
+
+SyncStats = collections.namedtuple("SyncStats", [
+    "files", "copied", "delta", "unchanged", "deleted", "bytes_copied", "bytes_total"])
+SyncStats.__new__.__defaults__ = (0, 0, 0, 0, 0, 0, 0)
+
+
+def build_manifest(directory, jobs=1):
+    """Describes every entry below directory by its stat information.
+
+    Args:
+        directory (str): Tree to describe.
+        jobs (int): Directories read at once; see scan_directory.
+
+    Returns:
+        dict: Maps each path, relative to directory and using "/", to a dict
+            with "type" ("file", "directory" or "symlink"), "size", "mtime"
+            and "mode", plus "target" for symlinks. Special files are left
+            out.
+    """
+    prefix = os.path.join(directory, "")
+    manifest = {}
+    for entry in scan_directory(directory, recursive=True, jobs=jobs, include_hidden=True):
+        relative = entry.path[len(prefix):]
+        if os.sep != "/":
+            relative = relative.replace(os.sep, "/")
+        record = _record(entry.path, entry.mode, entry.size, entry.mtime)
+        if record is not None:
+            manifest[relative] = record
+    return manifest
+
+
+def _record(path, mode, size, mtime):
+    if stat.S_ISLNK(mode):
+        record = {"type": SYMLINK, "target": os.readlink(path)}
+    elif stat.S_ISDIR(mode):
+        record = {"type": DIRECTORY}
+    elif stat.S_ISREG(mode):
+        record = {"type": FILE}
+    else:
+        return None
+    record.update(size=size, mtime=mtime, mode=stat.S_IMODE(mode))
+    return record
+
+
+def verify_manifest(manifest, directory):
+    """Checks a saved manifest against what is really in directory, with
+    one lstat per entry and no reads.
+
+    Entries whose path is gone are removed. Entries whose type, size,
+    modification time, mode or link target changed are replaced by what is
+    there now, without the digests of the old contents. Entries that are
+    not in the manifest at all are not looked for.
+
+    Args:
+        manifest (dict): As returned by build_manifest; updated in place.
+        directory (str): Tree the manifest describes.
+
+    Returns:
+        dict: manifest.
+    """
+    for relative in list(manifest):
+        path = os.path.join(directory, *relative.split("/"))
+        try:
+            stat_result = os.lstat(path)
+            actual = _record(path, stat_result.st_mode, stat_result.st_size,
+                             stat_result.st_mtime)
+        except OSError:
+            actual = None
+        old = manifest[relative]
+        if actual is None:
+            del manifest[relative]
+        elif any(actual.get(key) != old.get(key) for key in actual):
+            manifest[relative] = actual
+    return manifest
+
+
+def load_manifest(manifest_filename):
+    """Reads a manifest saved by save_manifest, or returns None if there is
+    none or it is unreadable."""
+    try:
+        with open(manifest_filename, "r") as manifest_file:
+            saved = json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if saved.get("version") != MANIFEST_VERSION:
+        return None
+    return saved["entries"]
+
+
+def save_manifest(manifest, manifest_filename):
+    """Atomically writes a manifest to manifest_filename."""
+    directory = os.path.dirname(os.path.abspath(manifest_filename))
+    handle, temp_name = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(handle, "w") as manifest_file:
+        json.dump({"version": MANIFEST_VERSION, "entries": manifest}, manifest_file)
+    os.replace(temp_name, manifest_filename)
+
+
+def _block_digest(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def delta_copy(source, destination, block_size=DEFAULT_BLOCK_SIZE, known_blocks=None):
+    """Updates an existing copy of a file by rewriting only the blocks that
+    differ, then truncating it to the source's length.
+
+    Args:
+        source (str): File to copy from.
+        destination (str): Existing copy to bring up to date.
+        block_size (int): Bytes per block.
+        known_blocks (List[str]): Block digests of destination from an
+            earlier sync. If given, destination is trusted to still match
+            them and is not read; otherwise it is read and compared.
+
+    Returns:
+        tuple(int, List[str]): Bytes written and the block digests of the
+            new contents.
+    """
+    written = 0
+    offset = 0
+    blocks = []
+    with open(source, "rb") as source_file, open(destination, "r+b") as destination_file:
+        for block in iter(lambda: source_file.read(block_size), b""):
+            digest = _block_digest(block)
+            index = len(blocks)
+            if known_blocks is not None:
+                same = index < len(known_blocks) and known_blocks[index] == digest
+            else:
+                destination_file.seek(offset)
+                same = destination_file.read(len(block)) == block
+            if not same:
+                destination_file.seek(offset)
+                destination_file.write(block)
+                written += len(block)
+            blocks.append(digest)
+            offset += len(block)
+        destination_file.truncate(offset)
+    return written, blocks
+
+
+class TreeSync(object):
+    """Makes destination a copy of source, transferring only what changed.
+
+    The source is described by a stat walk and compared with a manifest of
+    the destination. The manifest is saved under manifest_directory, keyed
+    by the destination's real path, after every sync. The next sync checks
+    each entry with a single lstat of the destination, so syncing a mostly
+    unchanged tree reads no destination directories and no file contents,
+    while destination files deleted or edited since still get copied again.
+    Files added to the destination by something else are only seen with
+    trust_manifest=False, which walks the destination instead.
+
+    Files that are new or whose size or modification time differ are copied
+    with trees.copy_file on a thread pool. With checksum=True, files are
+    also compared by content. Large files that already exist at the
+    destination can be updated block by block instead.
+
+    Args:
+        source (str): Directory to copy from.
+        destination (str): Directory to bring up to date. Created if needed.
+        jobs (int): Files copied at once. Defaults to the ThreadPoolExecutor
+            default.
+        checksum (bool): Also compare file contents by sha256, catching
+            changes that kept the size and modification time. Every source
+            file is read. Defaults to False.
+        delete (bool): Remove destination entries that are not in the
+            source. Defaults to False.
+        delta_threshold (int): Update files of at least this many bytes that
+            already exist at the destination block by block, writing only the
+            blocks that changed. Defaults to None (always copy whole files).
+        block_size (int): Block size for delta updates.
+        trust_manifest (bool): Use the saved destination manifest instead of
+            walking the destination. Defaults to True.
+        manifest_directory (str): Where destination manifests are kept,
+            e.g. DEFAULT_MANIFEST_DIRECTORY, or "" to keep none and walk the
+            destination every time. Defaults to "".
+    """
+
+    def __init__(self, source, destination, jobs=None, checksum=False, delete=False,
+                 delta_threshold=None, block_size=DEFAULT_BLOCK_SIZE, trust_manifest=True,
+                 manifest_directory=""):
+        self.source = source
+        self.destination = destination
+        self.jobs = jobs
+        self.checksum = checksum
+        self.delete = delete
+        self.delta_threshold = delta_threshold
+        self.block_size = block_size
+        self.trust_manifest = trust_manifest
+        self.manifest_filename = ""
+        if manifest_directory:
+            key = hashlib.sha256(os.path.realpath(destination).encode("utf-8")).hexdigest()
+            self.manifest_filename = os.path.join(manifest_directory, key + ".json")
+
+    def _path(self, root, relative):
+        return os.path.join(root, *relative.split("/"))
+
+    def _destination_manifest(self):
+        manifest = None
+        if self.trust_manifest and self.manifest_filename:
+            manifest = load_manifest(self.manifest_filename)
+        if manifest is not None:
+            manifest = verify_manifest(manifest, self.destination)
+        else:
+            manifest = build_manifest(self.destination) if os.path.isdir(self.destination) else {}
+        return manifest
+
+    def _digest(self, root, relative, record):
+        if "digest" not in record:
+            record["digest"] = hash_file(self._path(root, relative), "sha256").hexdigest
+        return record["digest"]
+
+    def _sync_file(self, relative, record, old):
+        """Brings one file up to date; returns (action, bytes written)."""
+        source_path = self._path(self.source, relative)
+        destination_path = self._path(self.destination, relative)
+        exists = old is not None and old["type"] == FILE
+        if exists and old["size"] == record["size"] and old["mtime"] == record["mtime"]:
+            if not self.checksum or \
+                    self._digest(self.source, relative, record) == \
+                    self._digest(self.destination, relative, old):
+                for key in ("digest", "blocks"):
+                    if key in old and key not in record:
+                        record[key] = old[key]
+                if old["mode"] != record["mode"]:
+                    os.chmod(destination_path, record["mode"])
+                return "unchanged", 0
+
+        if exists and self.delta_threshold is not None and record["size"] >= self.delta_threshold:
+            written, record["blocks"] = delta_copy(source_path, destination_path, self.block_size,
+                                                   old.get("blocks"))
+            source_stat = os.stat(source_path)
+            os.chmod(destination_path, record["mode"])
+            os.utime(destination_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+            action = "delta"
+        else:
+            written = trees.copy_file(source_path, destination_path)
+            action = "copied"
+        return action, written
+
+    def _remove(self, relative, old):
+        path = self._path(self.destination, relative)
+        if old["type"] == DIRECTORY:
+            trees.remove_tree(path)
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+    def run(self):
+        """Performs the sync.
+
+        Returns:
+            SyncStats: Counts of source files examined, copied whole,
+                updated by delta, left unchanged and destination entries
+                deleted, plus bytes written and total source file bytes.
+        """
+        source_manifest = build_manifest(self.source, jobs=self.jobs or 1)
+        old_manifest = self._destination_manifest()
+        os.makedirs(self.destination, exist_ok=True)
+        counts = collections.Counter()
+
+        # Anything that is going away or changing type is removed first,
+        # deepest first so directories are empty by the time they go.
+        removed_directories = set()
+        for relative in sorted(old_manifest, reverse=True):
+            old = old_manifest[relative]
+            record = source_manifest.get(relative)
+            if record is None and not self.delete:
+                continue
+            if record is None or record["type"] != old["type"]:
+                self._remove(relative, old)
+                counts["deleted"] += record is None
+                del old_manifest[relative]
+                if old["type"] == DIRECTORY:
+                    removed_directories.add(relative)
+        if removed_directories:
+            # A removed directory takes anything still listed under it along.
+            for relative in list(old_manifest):
+                parent = relative.rpartition("/")[0]
+                while parent and parent not in removed_directories:
+                    parent = parent.rpartition("/")[0]
+                if parent:
+                    del old_manifest[relative]
+
+        changed_directories = set()
+        for relative in sorted(source_manifest):
+            record = source_manifest[relative]
+            old = old_manifest.get(relative)
+            path = self._path(self.destination, relative)
+            if record["type"] == DIRECTORY and old is None:
+                os.makedirs(path, exist_ok=True)
+                changed_directories.add(relative)
+            elif record["type"] == SYMLINK and (old is None or old["target"] != record["target"]):
+                if os.path.lexists(path):
+                    os.unlink(path)
+                os.symlink(record["target"], path)
+                changed_directories.add(relative.rpartition("/")[0])
+
+        def finished(done):
+            for future in done:
+                action, written = future.result()
+                relative = running.pop(future)
+                counts["files"] += 1
+                counts[action] += 1
+                counts["bytes_copied"] += written
+                counts["bytes_total"] += source_manifest[relative]["size"]
+                if action != "unchanged":
+                    changed_directories.add(relative.rpartition("/")[0])
+
+        # Same default as ThreadPoolExecutor; only a bounded window of files
+        # is queued at a time.
+        window = (self.jobs or min(32, (os.cpu_count() or 1) + 4)) * 4
+        running = {}
+        with futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for relative, record in source_manifest.items():
+                if record["type"] != FILE:
+                    continue
+                if len(running) >= window:
+                    finished(futures.wait(running, return_when=futures.FIRST_COMPLETED)[0])
+                running[executor.submit(self._sync_file, relative, record,
+                                        old_manifest.get(relative))] = relative
+            finished(futures.wait(running)[0])
+
+        # Restore directory modes and times, children first, wherever the
+        # sync touched a directory or its metadata differs.
+        for relative in sorted(source_manifest, reverse=True):
+            record = source_manifest[relative]
+            if record["type"] != DIRECTORY:
+                continue
+            old = old_manifest.get(relative)
+            if relative in changed_directories or old is None or \
+                    (old["mode"], old["mtime"]) != (record["mode"], record["mtime"]):
+                source_stat = os.stat(self._path(self.source, relative))
+                path = self._path(self.destination, relative)
+                os.chmod(path, record["mode"])
+                os.utime(path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+
+        if not self.delete:
+            for relative, old in old_manifest.items():
+                source_manifest.setdefault(relative, old)
+        if self.manifest_filename:
+            os.makedirs(os.path.dirname(self.manifest_filename), exist_ok=True)
+            save_manifest(source_manifest, self.manifest_filename)
+        return SyncStats(**counts)
+
+
+def sync_tree(source, destination, **options):
+    """Syncs source into destination; see TreeSync for the options.
+
+    Returns:
+        SyncStats: What the sync did.
+    """
+    return TreeSync(source, destination, **options).run()
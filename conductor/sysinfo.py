@@ -0,0 +1,266 @@
+import collections
+import fcntl
+import os
+import re
+import shlex
+import socket
+import struct
+import threading
+import time
+
+
+DiskUsage = collections.namedtuple("DiskUsage", [
+    "mount_point", "device", "fstype", "total", "used", "free", "available", "inodes",
+    "inodes_free"])
+Uptime = collections.namedtuple("Uptime", ["seconds", "idle_seconds", "load_average"])
+NetworkInterface = collections.namedtuple("NetworkInterface", [
+    "name", "addresses", "rx_bytes", "rx_packets", "rx_errors", "rx_dropped", "tx_bytes",
+    "tx_packets", "tx_errors", "tx_dropped"])
+KernelInfo = collections.namedtuple("KernelInfo", [
+    "system", "node", "release", "version", "machine"])
+OSRelease = collections.namedtuple("OSRelease", [
+    "id", "name", "version_id", "pretty_name", "codename", "fields"])
+Sample = collections.namedtuple("Sample", ["timestamp", "values"])
+
+_MOUNT_ESCAPE = re.compile(r"\\([0-7]{3})")
+_SIOCGIFADDR = 0x8915
+_OS_RELEASE_FILENAMES = ("/etc/os-release", "/usr/lib/os-release")
+
+
+def _unescape_mount_field(field):
+    # /proc/self/mounts writes spaces, tabs and backslashes as \ooo.
+    return _MOUNT_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def _mounts():
+    with open("/proc/self/mounts", "r") as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) >= 3:
+                yield _unescape_mount_field(fields[1]), _unescape_mount_field(fields[0]), fields[2]
+
+
+def disk_usage(paths=None):
+    """Reports space and inodes on file systems, like df, using os.statvfs.
+
+    Args:
+        paths (List[str]): Paths whose file systems to report. Defaults to
+            every mounted file system with a size, which leaves out pseudo
+            file systems such as proc and sysfs.
+
+    Returns:
+        List[DiskUsage]: Sizes in bytes. available is what unprivileged
+            users can still write, as in df's Avail column.
+    """
+    if paths is None:
+        candidates = list(_mounts())
+    else:
+        candidates = [(path, "", "") for path in paths]
+    usage = []
+    for mount_point, device, fstype in candidates:
+        try:
+            stats = os.statvfs(mount_point)
+        except OSError:
+            if paths is not None:
+                raise
+            continue  # unreadable or stale mounts are left out, as by df
+        if paths is None and stats.f_blocks == 0:
+            continue
+        usage.append(DiskUsage(
+            mount_point, device, fstype, stats.f_blocks * stats.f_frsize,
+            (stats.f_blocks - stats.f_bfree) * stats.f_frsize, stats.f_bfree * stats.f_frsize,
+            stats.f_bavail * stats.f_frsize, stats.f_files, stats.f_ffree))
+    return usage
+
+
+def uptime():
+    """Reads how long the system has been up from /proc/uptime.
+
+    Returns:
+        Uptime: Seconds since boot, seconds all CPUs together spent idle and
+            the 1, 5 and 15 minute load averages.
+    """
+    with open("/proc/uptime", "r") as uptime_file:
+        seconds, idle_seconds = (float(value) for value in uptime_file.read().split()[:2])
+    return Uptime(seconds, idle_seconds, os.getloadavg())
+
+
+def _ipv4_address(probe, name):
+    try:
+        packed = fcntl.ioctl(probe.fileno(), _SIOCGIFADDR,
+                             struct.pack("256s", name.encode()[:15]))
+    except OSError:
+        return None  # no IPv4 address configured
+    return socket.inet_ntoa(packed[20:24])
+
+
+def _ipv6_addresses():
+    addresses = collections.defaultdict(list)
+    try:
+        with open("/proc/net/if_inet6", "r") as if_inet6:
+            for line in if_inet6:
+                fields = line.split()
+                if len(fields) >= 6:
+                    packed = bytes.fromhex(fields[0])
+                    addresses[fields[5]].append(socket.inet_ntop(socket.AF_INET6, packed))
+    except (IOError, OSError):
+        pass  # IPv6 disabled
+    return addresses
+
+
+def network_interfaces():
+    """Lists network interfaces with their addresses and traffic counters.
+
+    Counters come from /proc/net/dev, IPv4 addresses from the SIOCGIFADDR
+    ioctl and IPv6 addresses from /proc/net/if_inet6.
+
+    Returns:
+        List[NetworkInterface]: One per interface, in kernel order. Byte,
+            packet, error and drop counters count since the interface came
+            up.
+    """
+    ipv6 = _ipv6_addresses()
+    interfaces = []
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        with open("/proc/net/dev", "r") as net_dev:
+            for line in net_dev:
+                name, separator, counters = line.partition(":")
+                if not separator or "|" in line:
+                    continue  # the two header lines
+                name = name.strip()
+                values = [int(value) for value in counters.split()]
+                addresses = [_ipv4_address(probe, name)] + ipv6.get(name, [])
+                interfaces.append(NetworkInterface(
+                    name, tuple(address for address in addresses if address),
+                    values[0], values[1], values[2], values[3],
+                    values[8], values[9], values[10], values[11]))
+    finally:
+        probe.close()
+    return interfaces
+
+
+def kernel_information():
+    """Returns what uname -a prints, from os.uname."""
+    return KernelInfo(*os.uname())
+
+
+def os_release(filenames=_OS_RELEASE_FILENAMES):
+    """Reads the distribution's identification from /etc/os-release.
+
+    Returns:
+        OSRelease: ID, NAME, VERSION_ID, PRETTY_NAME and VERSION_CODENAME
+            (or UBUNTU_CODENAME), with every field of the file in fields.
+            Missing fields are "".
+
+    Raises:
+        IOError: If neither /etc/os-release nor /usr/lib/os-release exists.
+    """
+    for filename in filenames:
+        if os.path.exists(filename):
+            break
+    with open(filename, "r") as release_file:
+        fields = {}
+        for line in release_file:
+            key, separator, value = line.strip().partition("=")
+            if separator and not key.startswith("#"):
+                words = shlex.split(value)
+                fields[key] = words[0] if words else ""
+    return OSRelease(fields.get("ID", ""), fields.get("NAME", ""), fields.get("VERSION_ID", ""),
+                     fields.get("PRETTY_NAME", ""),
+                     fields.get("VERSION_CODENAME") or fields.get("UBUNTU_CODENAME", ""), fields)
+
+
+DEFAULT_COLLECTORS = collections.OrderedDict([
+    ("disks", disk_usage),
+    ("uptime", uptime),
+    ("network", network_interfaces),
+])
+
+
+class SystemSampler(object):
+    """Polls collectors on a background thread and keeps the latest
+    samples in a fixed-size ring buffer.
+
+    Each sample calls every collector in-process, so a health check reading
+    from the buffer costs no process spawns, and memory stays bounded however
+    long the sampler runs.
+
+    Args:
+        interval (float): Seconds between samples. Defaults to 10.
+        capacity (int): Samples kept; older ones are dropped. Defaults to
+            360, an hour at the default interval.
+        collectors (dict): Maps a name to a function taking no arguments.
+            Defaults to disk usage, uptime and network interfaces.
+    """
+
+    def __init__(self, interval=10.0, capacity=360, collectors=None):
+        self.interval = interval
+        self.collectors = collections.OrderedDict(collectors or DEFAULT_COLLECTORS)
+        self._buffer = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Collects one sample now and adds it to the buffer.
+
+        A collector that raises is recorded as None rather than stopping
+        the sampler.
+
+        Returns:
+            Sample: The time it was taken and each collector's result.
+        """
+        values = {}
+        for name, collector in self.collectors.items():
+            try:
+                values[name] = collector()
+            except Exception:
+                values[name] = None
+        sample = Sample(time.time(), values)
+        with self._lock:
+            self._buffer.append(sample)
+        return sample
+
+    def samples(self):
+        """Returns the buffered samples, oldest first."""
+        with self._lock:
+            return list(self._buffer)
+
+    def latest(self):
+        """Returns the newest sample, or None before the first one."""
+        with self._lock:
+            return self._buffer[-1] if self._buffer else None
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stopping.wait(self.interval):
+                return
+
+    def start(self):
+        """Starts sampling in the background, taking the first sample
+        immediately."""
+        if not self.is_running:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="system-sampler",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops sampling; the buffered samples stay available."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,234 @@
+import collections
+import threading
+from concurrent import futures
+
+from conductor.process import DEFAULT_GRACE_PERIOD
+from conductor.process import CommandResult
+from conductor.process import ProcessHandle
+from conductor.session import SessionClosedError
+from conductor.session import ShellSession
+
+
+class TransportUnsupportedError(RuntimeError):
+    """Raised by OperationWrapper methods that work in-process on this
+    machine when the wrapper runs its commands through a transport, so
+    their results would describe the wrong machine."""
+
+
+class Transport(object):
+    """Somewhere commands can be run. Subclasses implement run()."""
+
+    host = "localhost"
+
+    @property
+    def is_alive(self):
+        return True
+
+    def run(self, command_string, timeout=None, grace_period=DEFAULT_GRACE_PERIOD,
+            processes=None):
+        """Runs a shell command and waits for it.
+
+        Args:
+            command_string (str): A shell command represented as a string.
+            timeout (float): Seconds the command may run before it is
+                stopped. Defaults to no limit.
+            grace_period (float): Seconds between SIGTERM and SIGKILL when
+                the command is stopped.
+            processes (ProcessRegistry): Registers whatever runs the command
+                while it runs, so cancelling the registry stops it.
+
+        Returns:
+            CommandResult: The command's exit status and output. timed_out
+                is set if the command was stopped.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LocalTransport(Transport):
+    """Runs every command in a fresh local shell, like os.popen."""
+
+    def __init__(self, host="localhost"):
+        self.host = host
+
+    def run(self, command_string, timeout=None, grace_period=DEFAULT_GRACE_PERIOD,
+            processes=None):
+        handle = ProcessHandle.spawn(command_string)
+        if processes is not None:
+            processes.add(handle)
+        try:
+            return handle.result(timeout=timeout, stop_on_timeout=True,
+                                 grace_period=grace_period)
+        except BaseException:
+            handle.stop(grace_period)
+            raise
+        finally:
+            if processes is not None:
+                processes.discard(handle)
+
+
+class SessionTransport(Transport):
+    """Runs commands over one persistent ShellSession.
+
+    A command that is stopped takes the session with it; the next command
+    starts a new one.
+
+    Args:
+        host (str): Name the transport reports results under.
+        argv (List[str]): Command that starts the shell. Defaults to a local
+            shell, which makes a cheap loopback stand-in for SSHTransport.
+    """
+
+    def __init__(self, host="localhost", argv=None):
+        self.host = host
+        self.argv = argv
+        self.session = ShellSession(argv=argv)
+
+    @property
+    def is_alive(self):
+        return self.session.is_alive
+
+    def run(self, command_string, timeout=None, grace_period=DEFAULT_GRACE_PERIOD,
+            processes=None):
+        if not self.session.is_alive:
+            self.session.close()
+            self.session = ShellSession(argv=self.argv)
+        return self.session.run(command_string, timeout=timeout, grace_period=grace_period,
+                                processes=processes)
+
+    def close(self):
+        self.session.close()
+
+
+class SSHTransport(SessionTransport):
+    """A persistent shell on a remote host over a single ssh connection.
+
+    The connection is opened once and every command reuses it, so the cost of
+    the TCP and key exchange handshakes is paid once per host rather than once
+    per command. Authentication must be non-interactive (keys or an agent).
+
+    Args:
+        host (str): Host name or address.
+        user (str): Remote user. Defaults to ssh's own default.
+        port (int): Remote port. Defaults to ssh's own default.
+        ssh_options (List[str]): Extra arguments for ssh, e.g.
+            ["-o", "StrictHostKeyChecking=no"].
+        remote_shell (str): Shell to start on the remote side. Defaults to
+            bash; with dash a syntax error in a command ends the session.
+    """
+
+    def __init__(self, host, user=None, port=None, ssh_options=(),
+                 remote_shell="bash"):
+        argv = ["ssh", "-T", "-o", "BatchMode=yes"]
+        if port:
+            argv += ["-p", str(port)]
+        argv += list(ssh_options)
+        argv += ["{user}@{host}".format(user=user, host=host) if user else host,
+                 remote_shell]
+        super(SSHTransport, self).__init__(host, argv)
+
+
+class ConnectionPool(object):
+    """Keeps one open transport per host and hands it out on request.
+
+    Connections stay open between calls, so repeated fan-outs to the same
+    hosts reuse them. A connection whose shell has died is replaced the next
+    time it is asked for.
+
+    Args:
+        transport_factory (callable): Called with a host name to open a new
+            transport, e.g. SSHTransport.
+    """
+
+    def __init__(self, transport_factory=SSHTransport):
+        self.transport_factory = transport_factory
+        self._lock = threading.Lock()
+        self._transports = {}
+
+    def get(self, host):
+        """Returns an open transport for host, connecting if needed."""
+        with self._lock:
+            transport = self._transports.get(host)
+            if transport is None or not transport.is_alive:
+                transport = self.transport_factory(host)
+                self._transports[host] = transport
+            return transport
+
+    def discard(self, host):
+        with self._lock:
+            transport = self._transports.pop(host, None)
+        if transport is not None:
+            transport.close()
+
+    def close(self):
+        """Closes every pooled connection."""
+        with self._lock:
+            transports = list(self._transports.values())
+            self._transports.clear()
+        for transport in transports:
+            transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _run_on_host(pool, host, list_of_command_strings, stop_on_failure, on_result, timeout,
+                 processes):
+    results = []
+    for command in list_of_command_strings:
+        if processes is not None and processes.cancelled:
+            break
+        try:
+            result = pool.get(host).run(command, timeout=timeout, processes=processes)
+        except (SessionClosedError, OSError) as error:
+            pool.discard(host)
+            result = CommandResult(command, -1, stderr=str(error))
+        result.host = host
+        if on_result is not None:
+            on_result(result)
+        results.append(result)
+        if stop_on_failure and not result.succeeded:
+            break
+    return results
+
+
+def run_on_hosts(hosts, list_of_command_strings, pool, max_parallel=10,
+                 stop_on_failure=True, on_result=None, timeout=None, processes=None):
+    """Runs the same list of commands on many hosts at once.
+
+    Each host works through the list in order over its pooled connection,
+    with up to max_parallel hosts in flight, so the total time is about that
+    of the slowest host rather than the sum over all of them.
+
+    Args:
+        hosts (List[str]): Hosts to run on.
+        list_of_command_strings (List[str]): Commands, run in order on
+            every host.
+        pool (ConnectionPool): Where connections come from.
+        max_parallel (int): Maximum number of hosts worked on at once.
+        stop_on_failure (bool): Stop a host's list at its first failing
+            command. Other hosts carry on. Defaults to True.
+        on_result (callable): Called with each CommandResult as it finishes.
+        timeout (float): Seconds each command may run before its host's
+            connection is stopped. Defaults to no limit.
+        processes (ProcessRegistry): Registers each connection while it
+            runs a command. Once the registry is cancelled, running commands
+            are stopped and no more are started.
+
+    Returns:
+        OrderedDict: Maps each host, in the order given, to the list of
+            CommandResults of the commands that ran there. A connection
+            failure shows up as a result with exit code -1.
+    """
+    with futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        pending = collections.OrderedDict(
+            (host, executor.submit(_run_on_host, pool, host, list_of_command_strings,
+                                   stop_on_failure, on_result, timeout, processes))
+            for host in hosts)
+        return collections.OrderedDict((host, future.result())
+                                       for host, future in pending.items())
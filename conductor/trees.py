@@ -0,0 +1,326 @@
+import collections
+import errno
+import os
+import shutil
+import stat
+from concurrent import futures
+
+from conductor.files import scan_directory
+
+
+# Bytes handed to one copy_file_range/sendfile call. Large enough that the
+# per-call overhead disappears, small enough that a timeout or cancellation
+# isn't stuck behind one huge call.
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# copy_file_range and sendfile fail with these when the kernel or file system
+# can't do an in-kernel copy between the two files; a plain read/write loop
+# still can.
+_FALLBACK_ERRNOS = set([errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                        errno.ENOTSUP, errno.EBADF])
+
+TreeStats = collections.namedtuple("TreeStats", [
+    "files", "directories", "symlinks", "bytes", "skipped"])
+TreeStats.__new__.__defaults__ = (0, 0, 0, 0, 0)
+
+
+def _add(stats, **counts):
+    return stats._replace(**dict((name, getattr(stats, name) + count)
+                                 for name, count in counts.items()))
+
+
+def _copy_with(copy_call, source_fd, destination_fd):
+    copied = 0
+    try:
+        while True:
+            count = copy_call(source_fd, destination_fd, copied)
+            if count == 0:
+                return copied
+            copied += count
+    except OSError as error:
+        if copied or error.errno not in _FALLBACK_ERRNOS:
+            raise
+        return None
+
+
+def _copy_file_range(source_fd, destination_fd, offset):
+    return os.copy_file_range(source_fd, destination_fd, COPY_CHUNK_SIZE)
+
+
+def _sendfile(source_fd, destination_fd, offset):
+    return os.sendfile(destination_fd, source_fd, offset, COPY_CHUNK_SIZE)
+
+
+def _copy_contents(source_fd, destination_fd):
+    # Try the zero-copy calls first; either can refuse a particular pair of
+    # files, in which case nothing has been written yet and the next
+    # method starts from the beginning.
+    if hasattr(os, "copy_file_range"):
+        copied = _copy_with(_copy_file_range, source_fd, destination_fd)
+        if copied is not None:
+            return copied
+    if hasattr(os, "sendfile"):
+        copied = _copy_with(_sendfile, source_fd, destination_fd)
+        if copied is not None:
+            return copied
+
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    os.lseek(destination_fd, 0, os.SEEK_SET)
+    copied = 0
+    buffer = bytearray(1024 * 1024)
+    view = memoryview(buffer)
+    with open(source_fd, "rb", buffering=0, closefd=False) as source:
+        while True:
+            count = source.readinto(buffer)
+            if not count:
+                return copied
+            written = 0
+            while written < count:
+                written += os.write(destination_fd, view[written:count])
+            copied += count
+
+
+def _copy_metadata(path, stat_result):
+    os.chmod(path, stat.S_IMODE(stat_result.st_mode))
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+
+
+def copy_file(source, destination, preserve=True):
+    """Copies one regular file, inside the kernel where possible.
+
+    The data moves with os.copy_file_range, which lets file systems such as
+    btrfs and XFS share extents instead of copying, falling back to
+    os.sendfile and finally to a read/write loop.
+
+    Args:
+        source (str): File to copy.
+        destination (str): Path of the copy. Replaced if it exists.
+        preserve (bool): Copy the permission bits and timestamps too.
+            Defaults to True.
+
+    Returns:
+        int: Bytes copied.
+
+    Raises:
+        shutil.SameFileError: If destination is source.
+    """
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        stat_result = os.fstat(source_fd)
+        destination_fd = os.open(destination, os.O_WRONLY | os.O_CREAT,
+                                 stat.S_IMODE(stat_result.st_mode))
+        try:
+            # Check before truncating, or copying a file onto itself would
+            # empty it.
+            destination_stat = os.fstat(destination_fd)
+            if (destination_stat.st_dev, destination_stat.st_ino) == \
+                    (stat_result.st_dev, stat_result.st_ino):
+                raise shutil.SameFileError(
+                    "{source!r} and {destination!r} are the same file".format(
+                        source=source, destination=destination))
+            os.ftruncate(destination_fd, 0)
+            copied = _copy_contents(source_fd, destination_fd)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+    if preserve:
+        _copy_metadata(destination, stat_result)
+    return copied
+
+
+def _copy_symlink(source, destination):
+    if os.path.lexists(destination):
+        os.unlink(destination)
+    os.symlink(os.readlink(source), destination)
+
+
+def copy_tree(source, destination, jobs=None, preserve=True):
+    """Copies a directory tree, copying files on a thread pool.
+
+    The source is walked with scan_directory while files are copied by up
+    to jobs worker threads, each using copy_file. Only a bounded number of
+    copies is queued at a time, so memory stays flat for trees of millions
+    of files. Symlinks are recreated rather than followed, and sockets,
+    FIFOs and device nodes are skipped. Copying into an existing directory
+    merges with what is there, replacing files of the same name.
+
+    Args:
+        source (str): Directory, or single file, to copy.
+        destination (str): Path the copy of source is created at.
+        jobs (int): Number of files copied at once. Defaults to the
+            ThreadPoolExecutor default.
+        preserve (bool): Copy permission bits and timestamps. Defaults to
+            True.
+
+    Returns:
+        TreeStats: Counts of files, directories and symlinks copied, the
+            bytes copied and the special files skipped.
+
+    Raises:
+        ValueError: If destination is inside source.
+    """
+    if os.path.islink(source):
+        _copy_symlink(source, destination)
+        return TreeStats(symlinks=1)
+    if not os.path.isdir(source):
+        return TreeStats(files=1, bytes=copy_file(source, destination, preserve))
+
+    prefix = os.path.join(source, "")
+    if os.path.join(os.path.realpath(destination), "").startswith(
+            os.path.join(os.path.realpath(source), "")):
+        raise ValueError("can't copy {source!r} into itself".format(source=source))
+    source_stat = os.stat(source)
+    os.makedirs(destination, exist_ok=True)
+    directories = [(destination, source_stat)]
+    stats = TreeStats(directories=1)
+
+    # Same default as ThreadPoolExecutor.
+    window = (jobs or min(32, (os.cpu_count() or 1) + 4)) * 4
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = set()
+        for entry in scan_directory(source, recursive=True, jobs=1, include_hidden=True):
+            target = os.path.join(destination, entry.path[len(prefix):])
+            if entry.is_symlink:
+                _copy_symlink(entry.path, target)
+                stats = _add(stats, symlinks=1)
+            elif entry.is_dir:
+                os.makedirs(target, exist_ok=True)
+                directories.append((target, os.stat(entry.path)))
+                stats = _add(stats, directories=1)
+            elif stat.S_ISREG(entry.mode):
+                if len(running) >= window:
+                    done, running = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                    for future in done:
+                        stats = _add(stats, files=1, bytes=future.result())
+                running.add(executor.submit(copy_file, entry.path, target, preserve))
+            else:
+                stats = _add(stats, skipped=1)
+        for future in futures.as_completed(running):
+            stats = _add(stats, files=1, bytes=future.result())
+
+    if preserve:
+        # Children first, so writing into a directory doesn't bump the
+        # modification time that was just restored on it.
+        for path, stat_result in reversed(directories):
+            _copy_metadata(path, stat_result)
+    return stats
+
+
+def _empty_directory(directory):
+    counts = {"files": 0, "symlinks": 0, "bytes": 0}
+    subdirectories = []
+    with os.scandir(directory) as iterator:
+        for dir_entry in iterator:
+            if dir_entry.is_dir(follow_symlinks=False):
+                subdirectories.append(dir_entry.path)
+                continue
+            if dir_entry.is_symlink():
+                counts["symlinks"] += 1
+            else:
+                counts["files"] += 1
+                counts["bytes"] += dir_entry.stat(follow_symlinks=False).st_size
+            os.unlink(dir_entry.path)
+    return counts, subdirectories
+
+
+def remove_tree(path, jobs=None):
+    """Deletes a directory tree, emptying directories in parallel.
+
+    Each directory is read with os.scandir and its files unlinked on a
+    worker thread, with subdirectories handed back to the pool as they are
+    found. The emptied directories are then removed deepest first. A symlink
+    is removed itself and never followed.
+
+    Args:
+        path (str): Directory, file or symlink to delete.
+        jobs (int): Number of directories emptied at once. Defaults to the
+            ThreadPoolExecutor default.
+
+    Returns:
+        TreeStats: Counts of files, directories and symlinks removed and the
+            bytes the files took up.
+    """
+    if os.path.islink(path):
+        os.unlink(path)
+        return TreeStats(symlinks=1)
+    if not os.path.isdir(path):
+        size = os.lstat(path).st_size
+        os.unlink(path)
+        return TreeStats(files=1, bytes=size)
+
+    stats = TreeStats()
+    directories = [(0, path)]
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {executor.submit(_empty_directory, path): 0}
+        while running:
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                depth = running.pop(future) + 1
+                counts, subdirectories = future.result()
+                stats = _add(stats, **counts)
+                for subdirectory in subdirectories:
+                    directories.append((depth, subdirectory))
+                    running[executor.submit(_empty_directory, subdirectory)] = depth
+
+    directories.sort(key=lambda item: item[0], reverse=True)
+    for _, directory in directories:
+        os.rmdir(directory)
+    return _add(stats, directories=len(directories))
+
+
+def make_directory(path, mode=0o777, parents=False):
+    """Creates a directory.
+
+    Args:
+        path (str): Directory to create.
+        mode (int): Permission bits, before the umask. Defaults to 0o777.
+        parents (bool): Also create missing parents, and don't fail if the
+            directory already exists, like mkdir -p. Defaults to False.
+
+    Returns:
+        TreeStats: The number of directories created.
+    """
+    if not parents:
+        os.mkdir(path, mode)
+        return TreeStats(directories=1)
+
+    missing = []
+    head = os.path.abspath(path)
+    while not os.path.isdir(head):
+        missing.append(head)
+        head = os.path.dirname(head)
+    os.makedirs(path, mode, exist_ok=True)
+    return TreeStats(directories=len(missing))
+
+
+def move_tree(source, destination, jobs=None):
+    """Moves a file or directory tree.
+
+    Within one file system this is a single rename. Across file systems the
+    tree is copied with copy_tree, keeping permissions and timestamps, and
+    the source removed with remove_tree.
+
+    Args:
+        source (str): File or directory to move.
+        destination (str): Path it is moved to.
+        jobs (int): Worker threads for a cross-file-system move.
+
+    Returns:
+        TreeStats: For a rename, one file, directory or symlink and no
+            bytes; otherwise what copy_tree copied.
+    """
+    is_symlink = os.path.islink(source)
+    is_dir = not is_symlink and os.path.isdir(source)
+    try:
+        os.rename(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    else:
+        return TreeStats(files=int(not (is_dir or is_symlink)), directories=int(is_dir),
+                         symlinks=int(is_symlink))
+
+    stats = copy_tree(source, destination, jobs=jobs, preserve=True)
+    remove_tree(source, jobs=jobs)
+    return stats
@@ -6,5 +6,5 @@ if __name__ == "__main__":
 
     print("Starting install....")
     ops = conductor.OperationWrapper(debug=True)
-    ops.install(filename)
+    ops.install(filename, batch_packages=True)
     print("Done!")
@@ -7,5 +7,6 @@ setup(name="conductor",
       author="jmategk0",
       license="MIT",
       packages=["conductor"],
+      python_requires=">=3.7",
       zip_safe=False,
       test_suite="tests")